@@ -0,0 +1,368 @@
+'''
+Benchmarks the parsing, slack building and ranking hot paths at 1 day, 1 year and 50 year scales.
+
+Inputs are all local so runs are repeatable:
+    - xtide-offline files for XTide tokenising, event building and slack building
+    - JSON (NOAA) and HTML (Dairiki) fixtures rendered from the same xtide-offline data by stand_in_server.py
+    - a cached CHS PDF from bc-current-pdfs/ (stage is skipped if no PDF has been downloaded yet)
+    - cold imports of the main modules and a one site, one day offline plan, each in a fresh interpreter
+
+Each stage is run --repeat times and the fastest run is kept. Results are written as JSON to --output. If a
+--baseline results file is given, any stage slower than baseline * (1 + threshold) is reported as a regression
+and the program exits with status 1.
+
+Examples:
+    python3 benchmark.py --scales day,year
+    python3 benchmark.py --save-baseline
+    python3 benchmark.py --baseline bench_baseline.json
+'''
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+import canada_pdf_lib
+import data_collect
+import dive_plan
+import interpreter as intp
+import stand_in_server
+import xtide_saver
+from interpreter_common import DATEFMT
+
+SCALES = {'day': 1, 'year': 365, '50y': 50 * 365}
+DEFAULT_STATION = 'Hale Passage, west end, Puget Sound, Washington Current'
+DEFAULT_SITE = 'Fox Island Bridge Hale'
+DEFAULT_OUTPUT = 'bench_output.json'
+DEFAULT_BASELINE = 'bench_baseline.json'
+
+# allowed slowdown vs the baseline before a stage counts as a regression, by stage name prefix
+REGRESSION_THRESHOLDS = {
+    'default': 0.25,
+    'import': 0.5,    # dominated by disk cache state
+    'pdf': 0.5,
+}
+MIN_REGRESSION_SECONDS = 0.002  # stages faster than this are too noisy to flag
+
+
+def threshold(stage):
+    for prefix, value in REGRESSION_THRESHOLDS.items():
+        if stage.startswith(prefix):
+            return value
+    return REGRESSION_THRESHOLDS['default']
+
+
+class Bench:
+    """Collects the fastest of several timed runs for each named stage."""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def run(self, stage, fn, items=None, setup=None):
+        """Times fn(arg) where arg = setup() is prepared outside the timed region. Returns the last fn result."""
+        times = []
+        result = None
+        for _ in range(self.repeat):
+            arg = setup() if setup else None
+            start = time.perf_counter()
+            result = fn(arg) if setup else fn()
+            times.append(time.perf_counter() - start)
+        n = items(result) if callable(items) else items
+        self.results[stage] = {
+            'seconds': min(times),
+            'median_seconds': statistics.median(times),
+            'runs': len(times),
+            'items': n,
+            'us_per_item': min(times) / n * 1e6 if n else None,
+            'threshold': threshold(stage),
+        }
+        print('{:<34} {:>10.4f}s  {:>10}'.format(stage, min(times), '' if n is None else '{} items'.format(n)))
+        return result
+
+    def skip(self, stage, reason):
+        self.results[stage] = {'skipped': reason}
+        print('{:<34} {:>11}  {}'.format(stage, 'skipped', reason))
+
+
+# ------------------------------------------- inputs ----------------------------------------------------------------
+def offlineLines(station):
+    with open(data_collect.absName(xtide_saver.getFileName(station)), 'r') as f:
+        return f.read().splitlines()
+
+
+def linesForDays(lines, days):
+    """
+    The first `days` days of the offline lines. Longer spans than the file covers repeat the whole file, each
+    repetition shifted by the span of the file so the dates keep increasing.
+    """
+    firstDay = dt.strptime(lines[0].split()[0], DATEFMT)
+    lastDay = dt.strptime(lines[-1].split()[0], DATEFMT)
+    available = (lastDay - firstDay).days + 1
+    if days > available:
+        reps = -(-days // available)
+        dates = sorted({line[:10] for line in lines})
+        shifted = list(lines)
+        for rep in range(1, reps):
+            offset = td(days=rep * available)
+            newDates = {d: dt.strftime(dt.strptime(d, DATEFMT) + offset, DATEFMT) for d in dates}
+            shifted.extend(newDates[line[:10]] + line[10:] for line in lines)
+        lines = shifted
+    endStr = dt.strftime(firstDay + td(days=days), DATEFMT)
+    for i, line in enumerate(lines):
+        if line[:10] >= endStr:
+            return lines[:i]
+    return lines
+
+
+class _NoSunMoonXTideInterpreter(intp.XTideDockerInterpreter):
+    """Builds slacks without ephemeris so slack building and sun/moon attach can be timed separately."""
+
+    def _addSunMoonData(self, s):
+        pass
+
+
+class _OfflineXTideInterpreter(intp.XTideDockerInterpreter):
+    """Preloads from the xtide-offline lines instead of running the Docker container."""
+
+    def __init__(self, station, lines):
+        super().__init__(station['name'], station)
+        self._lines = lines
+
+    def _run_xtide_range(self, start_day, end_day):
+        startStr, endStr = dt.strftime(start_day, DATEFMT), dt.strftime(end_day, DATEFMT)
+        return [x for x in self._lines if startStr <= x[:10] <= endStr]
+
+
+class _FixtureNoaaInterpreter(intp.NoaaAPIInterpreter):
+    """Reads NOAA json fixtures rendered from the offline data instead of calling the API."""
+
+    def __init__(self, station, offline):
+        super().__init__('fixture', station)
+        self._offline = offline
+        self._fixtures = {}  # begin day -> json text, kept across runs so rendering is not timed
+
+    def _getJson(self, day):
+        key = dt.strftime(day, DATEFMT)
+        if key not in self._fixtures:
+            begin = dt(day.year, day.month, day.day)
+            events = self._offline.between(begin - td(days=1), begin + td(days=self.REQUEST_DAYS + 1))
+            self._fixtures[key] = json.dumps(stand_in_server.noaaCurrentPredictions(events))
+        return json.loads(self._fixtures[key])
+
+
+class _FixtureDairikiInterpreter(intp.DairikiInterpreter):
+    """Reads Dairiki monthly html fixtures rendered from the offline data instead of downloading pages."""
+
+    def __init__(self, station, pages):
+        super().__init__('fixture', station)
+        self._pages = pages
+
+    def _getMonthHtml(self, url):
+        return self._pages.get(url.rsplit('/', 1)[1], '<table class="tidetable"><tbody></tbody></table>')
+
+
+def dairikiPages(offline):
+    pages = {}
+    first, last = offline.events[0].time, offline.events[-1].time
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        start = dt(year, month, 1)
+        end = dt(year + 1, 1, 1) if month == 12 else dt(year, month + 1, 1)
+        pages['{}-{:02d}'.format(year, month)] = stand_in_server.dairikiMonthHtml(offline.between(start, end), 'bench')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return pages
+
+
+# ------------------------------------------- stages ----------------------------------------------------------------
+def benchXTide(bench, scale, days, lines, station, site):
+    scaled = linesForDays(lines, days)
+    m = _NoSunMoonXTideInterpreter(station['name'], station)
+    full = intp.XTideDockerInterpreter(station['name'], station)
+
+    bench.run('xtide.tokenise.' + scale, lambda: [x.split() for x in scaled], items=len(scaled))
+    events = bench.run('xtide.event_build.' + scale, lambda: m._parse_xtide_events(scaled), items=len)
+    slacks = bench.run('xtide.slack_build.' + scale, lambda: m._build_slacks_from_events(events), items=len)
+
+    def attach(ss):
+        for s in ss:
+            full._addSunMoonData(s)
+        return ss
+    slacks = bench.run('xtide.sun_moon_attach.' + scale, attach, items=len,
+                       setup=lambda: m._build_slacks_from_events(events))
+
+    def evaluate():
+        return [s for s in slacks if s.isDiveable(site, False)[0]]
+    diveable = bench.run('rank.is_diveable.' + scale, evaluate, items=len(slacks))
+    bench.run('rank.sort.' + scale, lambda ss: ss.sort(key=lambda x: abs(x.ebbSpeed) + abs(x.floodSpeed)),
+              items=len(diveable), setup=lambda: list(diveable))
+
+
+def benchRankLoop(bench, scale, days, lines, station, site):
+    firstDay = dt.strptime(lines[0].split()[0], DATEFMT)
+    lastDay = dt.strptime(lines[-1].split()[0], DATEFMT)
+    days = min(days, (lastDay - firstDay).days)
+    dayList = dive_plan.getAllDays(max(days - 1, 0), firstDay)
+    m = _OfflineXTideInterpreter(station, lines)
+    m.preload_range(dayList[0], dayList[-1])
+
+    def rank():
+        slacks = []
+        for day in dayList:
+            slacks.extend(m.getSlacks(day, intp.TIME_FILTER_ALL))
+        diveable = [s for s in slacks if dive_plan.isDiveable(s, site, False)[0]]
+        diveable.sort(key=lambda x: abs(x.ebbSpeed) + abs(x.floodSpeed))
+        return diveable
+    bench.run('rank.loop.' + scale, rank, items=len(dayList))
+
+
+def benchNoaa(bench, scale, days, offline, station):
+    firstDay = dt(offline.events[0].time.year, offline.events[0].time.month, offline.events[0].time.day)
+    days = min(days, (offline.events[-1].time - firstDay).days - 15)
+    dayList = dive_plan.getAllDays(max(days - 1, 0), firstDay)
+    m = _FixtureNoaaInterpreter(station, offline)
+
+    def walk(_):
+        n = 0
+        for day in dayList:
+            n += len(m.getSlacks(day, intp.TIME_FILTER_ALL))
+        return n
+    bench.run('noaa.day_walk.' + scale, walk, items=len(dayList), setup=lambda: setattr(m, '_events', None))
+
+
+def benchDairiki(bench, scale, days, pages, station):
+    months = sorted(pages)[1:-1]  # leave the neighbouring months available for boundary lookups
+    count = max(1, days // 30)
+    yearMonths = [tuple(int(x) for x in months[i % len(months)].split('-')) for i in range(count)]
+    m = _FixtureDairikiInterpreter(station, pages)
+
+    def parse():
+        n = 0
+        for year, month in yearMonths:
+            n += len(m._fetchAndParseMonth(year, month))
+        return n
+    bench.run('dairiki.fetch_and_parse_month.' + scale, parse, items=len(yearMonths))
+
+
+def benchPdf(bench):
+    pdfs = sorted(glob.glob(data_collect.absName(os.path.join('bc-current-pdfs', '*.pdf'))))
+    if not pdfs:
+        bench.skip('pdf.parse_pdf.year', 'no cached CHS PDF in bc-current-pdfs/')
+        return
+    year = canada_pdf_lib.extract_year_from_url(pdfs[0])
+    bench.run('pdf.parse_pdf.year', lambda: canada_pdf_lib.parse_pdf(pdfs[0], year, intp.Slack), items=len)
+
+
+# modules timed with a cold import in a fresh interpreter
+IMPORT_MODULES = ['dive_plan', 'interpreter', 'interpreter_tides', 'canada_pdf_lib']
+
+# one site, one day plan from the xtide-offline files, run in a fresh interpreter to include startup
+OFFLINE_PLAN_DAY = '''
+import json
+from datetime import datetime as dt
+import data_collect, dive_plan, interpreter as intp
+data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+station = dive_plan.getStation(data['stations'], {station!r})
+site = dive_plan.getStation(data['sites'], {site!r})
+m = intp.TBoneSCOfflineInterpreter(station.get('url_xtide_a', ''), station)
+for s in m.getSlacks(dt(2026, 7, 4), intp.TIME_FILTER_ALL):
+    dive_plan.isDiveable(s, site, False)
+'''
+
+
+def benchImport(bench, station, site):
+    import subprocess
+    import sys
+
+    def runPython(code):
+        subprocess.run([sys.executable, '-c', code], cwd=data_collect.absName(''), check=True)
+
+    bench.run('import.python', lambda: runPython('pass'), items=1)
+    for module in IMPORT_MODULES:
+        bench.run('import.' + module, lambda: runPython('import ' + module), items=1)
+    bench.run('import.startup.offline_plan_day',
+              lambda: runPython(OFFLINE_PLAN_DAY.format(station=station['name'], site=site['name'])), items=1)
+
+
+# ------------------------------------------- results ----------------------------------------------------------------
+def compareToBaseline(results, baselineFile):
+    with open(baselineFile, 'r') as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    for stage, result in results.items():
+        base = baseline.get(stage)
+        if not base or 'seconds' not in base or 'seconds' not in result:
+            continue
+        limit = base['seconds'] * (1 + result['threshold'])
+        result['baseline_seconds'] = base['seconds']
+        result['ratio'] = result['seconds'] / base['seconds'] if base['seconds'] else None
+        if result['seconds'] > limit and result['seconds'] > MIN_REGRESSION_SECONDS:
+            result['regression'] = True
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing, slack building and ranking hot paths')
+    parser.add_argument('--scales', default='day,year,50y', help='Comma-delimited subset of {}'.format(list(SCALES)))
+    parser.add_argument('--repeat', default=3, type=int, help='Runs per stage, the fastest is kept')
+    parser.add_argument('--station', default=DEFAULT_STATION, help='Current station with an xtide-offline file')
+    parser.add_argument('--site', default=DEFAULT_SITE, help='Dive site used for the isDiveable and rank stages')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Results json file')
+    parser.add_argument('--baseline', default=None, help='Results json file to check for regressions against')
+    parser.add_argument('--save-baseline', action='store_true', default=False, dest='SAVE_BASELINE',
+                        help='Also write the results to {}'.format(DEFAULT_BASELINE))
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    station = dive_plan.getStation(data['stations'], args.station)
+    site = dive_plan.getStation(data['sites'], args.site)
+    if not station or not site:
+        exit(1)
+    lines = offlineLines(station['name'])
+    offline = stand_in_server.OfflineStation(xtide_saver.getFileName(station['name']))
+    pages = dairikiPages(offline)
+
+    bench = Bench(args.repeat)
+    for scale in [s.strip() for s in args.scales.split(',') if s.strip()]:
+        days = SCALES[scale]
+        benchXTide(bench, scale, days, lines, station, site)
+        benchRankLoop(bench, scale, days, lines, station, site)
+        benchNoaa(bench, scale, days, offline, station)
+        benchDairiki(bench, scale, days, pages, station)
+    benchPdf(bench)
+    benchImport(bench, station, site)
+
+    output = {
+        'created': dt.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'station': station['name'],
+        'site': site['name'],
+        'results': bench.results,
+    }
+    regressions = compareToBaseline(bench.results, args.baseline) if args.baseline else []
+    output['regressions'] = regressions
+    with open(data_collect.absName(args.output), 'w') as f:
+        json.dump(output, f, indent=2)
+    print('Results written to {}'.format(args.output))
+    if args.SAVE_BASELINE:
+        with open(data_collect.absName(DEFAULT_BASELINE), 'w') as f:
+            json.dump(output, f, indent=2)
+        print('Baseline written to {}'.format(DEFAULT_BASELINE))
+
+    if regressions:
+        for stage in regressions:
+            r = bench.results[stage]
+            print('REGRESSION: {} took {:.4f}s vs baseline {:.4f}s (threshold +{:.0%})'.format(
+                stage, r['seconds'], r['baseline_seconds'], r['threshold']))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+'''
+Calibrates the slack_before_ebb and slack_before_flood offsets of every current site in dive_sites.json from the
+splash times recorded in the meetup CSVs (see data_prompt_splash.py), in one run.
+
+The dives with a splash time are classified into sites (data_query_old.refineDives). For each station the slack
+series of every day with a dive is fetched from a current source in one pass, read through the prediction cache.
+Each splash is joined to the slack it was planned for: the one whose predicted club entry (slack + offset - 30
+minutes, see interpreter._getEntryTimes) is nearest, found with a binary search over the whole series (see
+data_add_slacks.getNearestSlacks). The offset implied by each dive is then splash - slack + 30 minutes.
+
+The offset of each site and direction (before ebb, before flood) is fitted with a Huber M-estimator, which follows
+the bulk of the dives and down-weights the odd late start or misjoined slack instead of averaging them in. A 95%
+confidence interval comes from bootstrap resampling, with all resamples fitted at once. A new offset is proposed
+when there are enough dives and the interval excludes the current value. The proposals are printed, and can be
+written to a JSON file or applied to dive_sites.json in place.
+
+The "recorded" source uses the slacks stored in the CSV by data_add_slacks.py instead of fetching, which needs no
+network but only has the slack the dive was matched to when the CSV was made.
+
+Examples:
+    python3 calibrate_offsets.py --sources noaa
+    python3 calibrate_offsets.py --sources recorded --min-dives 10 --output offsets.json
+    python3 calibrate_offsets.py --sites "Day Island Wall" --apply
+'''
+
+import argparse
+import json
+import re
+from datetime import datetime as dt
+
+import numpy as np
+
+import data_collect
+import data_query_old as dqo
+import dive_plan
+import prediction_cache
+from data_add_slacks import getNearestSlacks, getSlackSeries
+from dive_plan import pickInterpreter, stationKey
+
+SPLASH_FILE = 'dive_meetup_data_old_format_with_slacks_with_splash.csv'
+CLUB_ENTRY_MINUTES = 30  # club entry is this long before the min current time, see interpreter._getEntryTimes
+RECORDED = 'recorded'
+OFFSET_KEYS = {True: 'slack_before_ebb', False: 'slack_before_flood'}
+
+
+def huberLocation(values, k=1.345, iterations=30):
+    '''
+    Returns the Huber M-estimate of the location of each row of the (rows, n) values, by iteratively reweighted
+    means starting from the median, with the scale fixed at the normalised MAD (at least a minute).
+    '''
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    mu = np.median(values, axis=1, keepdims=True)
+    scale = np.maximum(1.4826 * np.median(np.abs(values - mu), axis=1, keepdims=True), 1.0)
+    for _ in range(iterations):
+        r = np.abs(values - mu) / scale
+        w = np.minimum(1.0, k / np.maximum(r, 1e-12))
+        mu = (w * values).sum(axis=1, keepdims=True) / w.sum(axis=1, keepdims=True)
+    return mu[:, 0]
+
+
+def fitOffset(offsets, confidence=0.95, resamples=2000, seed=0):
+    '''Returns (estimate, low, high, MAD) of the robust location of the offsets with a bootstrap interval.'''
+    offsets = np.asarray(offsets, dtype=float)
+    estimate = huberLocation(offsets)[0]
+    rng = np.random.default_rng(seed)
+    fits = huberLocation(offsets[rng.integers(0, len(offsets), (resamples, len(offsets)))])
+    low, high = np.percentile(fits, [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100])
+    return estimate, low, high, np.median(np.abs(offsets - np.median(offsets)))
+
+
+def joinSplashes(splashes, slacks, site, maxGapMinutes=120):
+    '''
+    Returns [(splash, slack)] joining each splash time to the slack whose predicted club entry with the site's
+    current offsets is nearest, dropping splashes with none within maxGapMinutes.
+    '''
+    matches = getNearestSlacks(splashes, slacks, site, 0, maxGapMinutes)
+    return [(splash, s) for splash, s in zip(splashes, matches) if s is not None]
+
+
+def impliedOffset(splash, slack):
+    '''Returns the slack_before_* offset in minutes that would have predicted the splash exactly.'''
+    return (splash - slack.time).total_seconds() / 60 + CLUB_ENTRY_MINUTES
+
+
+def applyProposals(text, proposals):
+    '''
+    Returns the dive_sites.json text with the proposed {site name: {key: value}} offsets replaced in place, keeping
+    the file's formatting.
+    '''
+    for name, values in proposals.items():
+        start = text.find('"name": {}'.format(json.dumps(name)))
+        if start < 0:
+            continue
+        end = text.find('"name":', start + 1)
+        end = len(text) if end < 0 else end
+        block = text[start:end]
+        for key, value in values.items():
+            block = re.sub(r'("{}":\s*)-?\d+(\.\d+)?'.format(key), r'\g<1>{}'.format(value), block, count=1)
+        text = text[:start] + block + text[end:]
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the slack offsets of the current sites from recorded splash times')
+    parser.add_argument('--input', default=SPLASH_FILE, type=str, help='Meetup CSV with splash times')
+    parser.add_argument('--sites', default='', type=str, help='Comma-delimited site names, every site by default')
+    parser.add_argument('--min-dives', default=5, type=int,
+                        help='Only propose an offset for a site and direction with at least this many dives')
+    parser.add_argument('--max-gap', default=120, type=int,
+                        help='Drop splashes more than this many minutes from any predicted club entry')
+    parser.add_argument('--output', default=None, type=str, help='Write the proposed offsets to this JSON file')
+    parser.add_argument('--apply', action='store_true', default=False, help='Write the proposals to dive_sites.json')
+    dive_plan.add_arguments(parser, timeFilter=False, days=False, calendar=False,
+                            sourcesHelp='Comma-delimited sources in order of preference (e.g. "noaa,xtide docker" or '
+                                        '"recorded"), the first source configured for each station is used by default')
+    args = parser.parse_args()
+
+    dives, _ = dqo.getDives(args.input)
+    bySite = dqo.refineDives([d for d in dives if d.splash])
+    siteNames = [n.strip() for n in args.sites.split(',') if n.strip()]
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    cache = None if args.NO_CACHE else prediction_cache.PredictionCache()
+
+    # one slack series per station, fetched for the days of every dive on it
+    sites = {}
+    for name, siteDives in bySite.items():
+        site = dqo.getSiteData(siteNames, name, data)
+        if site and 'data_tides' not in site:
+            sites[site['name']] = (site, siteDives)
+    stations = {}
+    for site, siteDives in sites.values():
+        stations.setdefault(stationKey(site), []).append((site, siteDives))
+
+    joined = {}  # site name -> [(splash, slack)]
+    for key, stationSites in stations.items():
+        if args.sources == [RECORDED]:
+            for site, siteDives in stationSites:
+                joined[site['name']] = [(d.splash, d.slack) for d in siteDives if d.slack]
+            continue
+        _, choices = dive_plan.getInterpreters(stationSites[0][0], data, cache, args.OFFLINE)
+        m, label = pickInterpreter(choices, args.sources)
+        if not m:
+            print('No source for {}'.format(key[1]))
+            continue
+        days = {dt(d.date.year, d.date.month, d.date.day) for _, siteDives in stationSites for d in siteDives}
+        slacks, _ = getSlackSeries([(m, label)], days)
+        print('{}: {} slacks on {} dive days ({})'.format(key[1], len(slacks), len(days), label))
+        for site, siteDives in stationSites:
+            joined[site['name']] = joinSplashes([d.splash for d in siteDives], slacks, site, args.max_gap)
+    if cache:
+        cache.flush()
+
+    proposals = {}
+    print('{:<24} {:<18} {:>5} {:>8} {:>8} {:>16} {:>6}'.format('site', 'offset', 'dives', 'current', 'fitted',
+                                                                 '95% interval', 'MAD'))
+    for name, pairs in joined.items():
+        site = sites[name][0]
+        for beforeEbb, key in OFFSET_KEYS.items():
+            offsets = [impliedOffset(splash, s) for splash, s in pairs if bool(s.slackBeforeEbb) == beforeEbb]
+            if not offsets:
+                continue
+            estimate, low, high, mad = fitOffset(offsets)
+            current = site[key]
+            propose = len(offsets) >= args.min_dives and not low <= current <= high
+            if propose:
+                proposals.setdefault(name, {})[key] = int(round(estimate))
+            print('{:<24} {:<18} {:>5} {:>8} {:>8.0f} {:>7.0f} to {:>5.0f} {:>6.0f}{}'.format(
+                name[:24], key, len(offsets), current, estimate, low, high, mad,
+                '\t-> propose {}'.format(int(round(estimate))) if propose else ''))
+
+    if not proposals:
+        print('No offsets to change')
+        return
+    print(json.dumps(proposals, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(proposals, f, indent=2)
+        print('Wrote the proposals to {}'.format(args.output))
+    if args.apply:
+        path = data_collect.absName('dive_sites.json')
+        text = open(path, encoding='utf-8').read()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(applyProposals(text, proposals))
+        print('Updated {}'.format(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,13 +10,13 @@ the CanadaPDFInterpreter class in interpreter.py.
 
 import os
 import re
-import requests
-import pdfplumber
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 from typing import List, Tuple, Optional
 import pytz
 
+import profiling
+
 
 # Mapping of month names to numbers (English and French)
 MONTH_MAP = {
@@ -53,11 +53,15 @@ def download_pdf(url: str, cache_dir: str = "bc-current-pdfs") -> str:
 
     # Check if file already exists locally
     if os.path.exists(local_path):
+        profiling.cache_hit('canada_pdf_file')
         return local_path
+    profiling.cache_miss('canada_pdf_file')
 
     # Download the file
+    import requests
     print(f"Downloading PDF to: {local_path}")
-    response = requests.get(url)
+    with profiling.timed('network.canada_pdf'):
+        response = requests.get(url)
     response.raise_for_status()
 
     with open(local_path, 'wb') as f:
@@ -536,6 +540,7 @@ def parse_pdf(pdf_path: str, year: int, Slack) -> list:
     - Page 4: October, November, December
     - Each month has 2 columns (days 1-15, days 16-31)
     """
+    import pdfplumber  # slow to import, only load it when a PDF is actually parsed
     all_events = []
 
     # Define months per page based on CHS PDF structure
@@ -633,7 +638,8 @@ def parse_current_pdf(url: str, Slack) -> list:
     pdf_path = download_pdf(url)
 
     # Parse PDF (file is kept in cache for future use)
-    slacks = parse_pdf(pdf_path, year, Slack)
+    with profiling.timed('pdf_parse.canada_pdf'):
+        slacks = parse_pdf(pdf_path, year, Slack)
     return slacks
 
 
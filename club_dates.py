@@ -0,0 +1,182 @@
+'''
+Finds club dive dates: the weekend and holiday days (from getDiveDays) with the most sites diveable in daylight.
+
+A calendar of one bitset per site, one bit per day of the horizon, is built from every station's slacks (or tide
+windows), read through the prediction cache and the materialised diveability rows of dive_calendar.py, so once a
+year is prefetched a full sweep of dive_sites.json takes seconds. Queries are vectorised bitwise operations over the
+bitsets:
+    - days where at least K of a set of sites are diveable
+    - days where every one of a set of sites (e.g. site A and B) is diveable
+and combinations of both, e.g. both sites of a trip and at least 3 others as backups.
+
+Examples:
+    python3 club_dates.py -f 365 -k 10
+    python3 club_dates.py -f 180 --require "deception pass, skyline wall"
+    python3 club_dates.py -d 2026-05-01 -f 120 -k 2 --sites "day island wall, sunrise beach, fox island bridge" --fridays
+'''
+
+import argparse
+import json
+from datetime import datetime as dt
+
+import numpy as np
+
+import data_collect
+import dive_calendar
+import dive_plan
+import prediction_cache
+import rank_year_slacks
+from must_do_dives import getSite
+from dive_plan import pickInterpreter, stationKey
+from interpreter_common import DATEFMT
+
+
+class DiveCalendar:
+    '''
+    Per-site, per-day diveability over a list of days, stored as one packed bitset (np.packbits) per site.
+
+    Args:
+        names: Site names, one per row of the bitsets.
+        days: The days of the horizon, one per bit.
+        bits: (sites, ceil(days / 8)) uint8 array of packed bits, bit d of row i is set if site i is diveable on
+            days[d].
+    '''
+
+    def __init__(self, names, days, bits):
+        self.names = list(names)
+        self.days = list(days)
+        self.bits = bits
+        self.rows = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def fromDiveable(cls, names, days, diveable):
+        '''Returns the calendar of a (sites, days) boolean array.'''
+        diveable = np.asarray(diveable, dtype=bool).reshape(len(names), len(days))
+        return cls(names, days, np.packbits(diveable, axis=1))
+
+    def _rows(self, names):
+        if names is None:
+            return self.bits
+        return self.bits[[self.rows[name] for name in names]]
+
+    def _unpack(self, bits):
+        return np.unpackbits(bits, axis=-1, count=len(self.days)).astype(bool)
+
+    def diveable(self, name):
+        '''Returns the boolean array of the days the site is diveable.'''
+        return self._unpack(self.bits[self.rows[name]])
+
+    def allOf(self, names):
+        '''Returns the boolean array of the days every one of the sites is diveable.'''
+        if not names:
+            return np.ones(len(self.days), dtype=bool)
+        return self._unpack(np.bitwise_and.reduce(self._rows(names), axis=0))
+
+    def anyOf(self, names):
+        '''Returns the boolean array of the days at least one of the sites is diveable.'''
+        if not names:
+            return np.zeros(len(self.days), dtype=bool)
+        return self._unpack(np.bitwise_or.reduce(self._rows(names), axis=0))
+
+    def counts(self, names=None):
+        '''Returns the number of the sites (all by default) diveable on each day.'''
+        return self._unpack(self._rows(names)).sum(axis=0)
+
+    def atLeast(self, k, names=None):
+        '''Returns the boolean array of the days at least k of the sites (all by default) are diveable.'''
+        return self.counts(names) >= k
+
+    def sitesOn(self, index, names=None):
+        '''Returns the names of the sites (all by default) diveable on the day with the given index.'''
+        byte, bit = divmod(index, 8)
+        names = self.names if names is None else names
+        return [n for n in names if self.bits[self.rows[n], byte] & (0x80 >> bit)]
+
+
+def buildCalendar(sites, data, days, timeFilter='day', sources=(), cache=None, offline=False, store=None):
+    '''
+    Returns the DiveCalendar of the sites over the days. Sites on the same station share one interpreter, so each
+    station's windows are fetched once per day. Reads the diveability from the store (a dive_calendar.CalendarStore)
+    if given.
+    '''
+    interpreters = {}
+    windows = {}  # station key -> [windows of each day]
+    diveable = np.zeros((len(sites), len(days)), dtype=bool)
+    for i, site in enumerate(sites):
+        key = stationKey(site)
+        if key not in interpreters:
+            _, choices = dive_plan.getInterpreters(site, data, cache, offline)
+            interpreters[key] = pickInterpreter(choices, sources)
+            if not interpreters[key][0]:
+                print('No source for {}'.format(site['name']))
+        m, label = interpreters[key]
+        if not m:
+            continue
+        if store:
+            store.refresh(site, data, m, label, days)
+            for d, day in enumerate(days):
+                diveable[i, d] = any(r[1] for r in store.getDay(site['name'], label, day, timeFilter) or [])
+        else:
+            if key not in windows:
+                windows[key] = []
+                for day in days:
+                    try:
+                        windows[key].append(m.getSlacks(day, timeFilter))
+                    except Exception as e:
+                        print('Error fetching {} for {} on {}: {}'.format(label, site['name'],
+                                                                          dt.strftime(day, DATEFMT), repr(e)))
+                        windows[key].append([])
+            for d, dayWindows in enumerate(windows[key]):
+                diveable[i, d] = any(True for _ in rank_year_slacks.diveableSlacks(dayWindows, site))
+    return DiveCalendar.fromDiveable([s['name'] for s in sites], days, diveable)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the dive days with the most sites diveable')
+    parser.add_argument('--sites', default='', type=str,
+                        help='Comma-delimited candidate site names, every site in dive_sites.json by default')
+    parser.add_argument('--require', default='', type=str,
+                        help='Comma-delimited site names that must all be diveable on the day')
+    parser.add_argument('-k', '--min-sites', dest='K', default=1, type=int,
+                        help='Only print days with at least this many candidate sites diveable')
+    parser.add_argument('-d', '--start-date', dest='START', default=None, type=lambda d: dt.strptime(d, '%Y-%m-%d'),
+                        help='First day in the format yyyy-mm-dd, today by default')
+    parser.add_argument('-f', '--futuredays', dest='DAYS_IN_FUTURE', default=365, type=int,
+                        help='Number of days after the start date to consider')
+    parser.add_argument('--top', default=20, type=int, help='Number of days to print, 0 for all')
+    parser.add_argument('--by-date', action='store_true', default=False,
+                        help='Print the days by date instead of from the most sites diveable to the least')
+    dive_plan.add_arguments(parser)
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    candidates = dive_plan.parse_sites(args.sites, data['sites']) or [s['name'] for s in data['sites']]
+    required = dive_plan.parse_sites(args.require, data['sites'])
+    sites = [getSite(data['sites'], name) for name in dict.fromkeys(candidates + required)]
+    days = dive_plan.getDiveDays(args.DAYS_IN_FUTURE, args.START or dt.now(), args.INCLUDE_WORKDAYS,
+                                 args.INCLUDE_FRIDAYS)
+    cache = None if args.NO_CACHE else prediction_cache.PredictionCache()
+    store = None if args.NO_CACHE or args.NO_CALENDAR else dive_calendar.CalendarStore()
+
+    calendar = buildCalendar(sites, data, days, args.TIME_FILTER, args.sources, cache, args.OFFLINE, store)
+    if cache:
+        cache.flush()
+    if store:
+        store.flush()
+
+    counts = calendar.counts(candidates)
+    matches = np.flatnonzero(calendar.allOf(required) & (counts >= args.K))
+    print('{} of {} days with at least {} of {} sites diveable{}'.format(
+        len(matches), len(days), args.K, len(candidates),
+        ', including ' + ' and '.join(required) if required else ''))
+    if not args.by_date:
+        matches = matches[np.argsort(-counts[matches], kind='stable')]
+    if args.top:
+        matches = matches[:args.top]
+    for d in matches:
+        print('{}: {:>2} sites\t{}'.format(dt.strftime(days[d], DATEFMT), counts[d],
+                                           ', '.join(calendar.sitesOn(d, candidates))))
+
+
+if __name__ == '__main__':
+    main()
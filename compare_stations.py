@@ -1,124 +1,313 @@
 '''
-This program is used to compare slack at two current stations.
+This program is used to compare slack at current stations.
 
 Current stations will have a constant offset (one for slack before ebb and
 another before flood) from each other if based on the same underlying data
 source. Otherwise the time differences between the stations will vary for each
 slack.
-'''
 
-import dive_plan, data_collect
-import interpreter as intp
+The slack series of each station is fetched for the whole horizon (months or years), read through the prediction
+cache. Two series are aligned by matching every slack to the nearest slack of the same type (before ebb or before
+flood) at the other station with a binary search (np.searchsorted). A pair is only kept when both slacks are each
+other's nearest and are within --max-gap minutes, so missing and extra events at either station (weak currents that
+never reach slack, a source dropping a day) leave their slack unmatched instead of shifting every later pair. The
+offset statistics of the matched pairs are printed for the whole horizon and optionally per month.
+
+With --matrix every station in dive_sites.json (or the ones matching --stations) is fetched in parallel, one job per
+station in a process pool, and every pair of stations is aligned to produce an offset matrix. The most consistent
+pairs are printed and the full matrix can be written to CSV.
+
+Examples:
+    python3 compare_stations.py --station1 "burrows i. allan" --station2 "burrows pass" -f 365
+    python3 compare_stations.py --station1 gabriola --station2 gabriola --sources harmonic --sources2 "canada api"
+    python3 compare_stations.py --matrix -d 2026-01-01 -f 365 --sources harmonic --offline --output offsets.csv
+'''
 
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime as dt
+from datetime import timedelta as td
+
 import numpy as np
-import json
 
+import data_collect
+import dive_plan
+import prediction_cache
+from data_add_slacks import getSlackSeries
+from interpreter_common import DATEFMT
 
-def main():
-    START = dt.now()
-    TRIM_NOAA = True
-
-    # STATION1 = "Strait of Juan de Fuca Entrance, Washington Current"
-    # STATION1 = "Juan De Fuca Strait (East), British Columbia Current"
-    # STATION1 = "Rosario Strait, Washington Current"
-    # STATION1 = "Deception Pass (narrows), Washington Current"
-    # STATION1 = "Admiralty Inlet (off Bush Point), Washington Current"
-    # STATION1 = "Alki Point, 0.3 mile west of, Puget Sound, Washington Current"
-    # STATION1 = "West end, Rich Passage, Puget Sound, Washington Current"
-    # STATION1 = "Agate Passage, north end, Puget Sound, Washington Current"
-    # STATION1 = "The Narrows, north end (midstream), Washington Current"
-    # STATION1 = "South end (midstream), The Narrows, Puget Sound, Washington Current"
-    # STATION1 = "Hale Passage, west end, Puget Sound, Washington Current"
-    STATION1 = "Burrows I. Allan I. Passage between, Washington Current"
-
-    NOAA1 = True
-    # NOAA1 = False
-
-    # STATION2 = "Strait of Juan de Fuca Entrance, Washington Current"
-    # STATION2 = "Juan De Fuca Strait (East), British Columbia Current"
-    # STATION2 = "Rosario Strait, Washington Current"
-    # STATION2 = "Deception Pass (narrows), Washington Current"
-    # STATION2 = "Admiralty Inlet (off Bush Point), Washington Current"
-    # STATION2 = "Alki Point, 0.3 mile west of, Puget Sound, Washington Current"
-    # STATION2 = "West end, Rich Passage, Puget Sound, Washington Current"
-    # STATION2 = "Agate Passage, north end, Puget Sound, Washington Current"
-    # STATION2 = "The Narrows, north end (midstream), Washington Current"
-    # STATION2 = "South end (midstream), The Narrows, Puget Sound, Washington Current"
-    # STATION2 = "Hale Passage, west end, Puget Sound, Washington Current"
-    # STATION2 = "Gibson Point, 0.8 mile east of, Puget Sound, Washington Current"
-    STATION2 = "Burrows Pass, Washington Current"
-
-    NOAA2 = True
-    # NOAA2 = False
+TYPES = {True: 'before ebb', False: 'before flood'}
+
+# set in each worker process by _initWorker
+_OPTIONS = None
+
+
+def findStation(stations, name):
+    '''Returns the first station whose name contains the given text (case insensitive), or None.'''
+    for station in stations:
+        if name.lower() in station['name'].lower() and station['name'] != 'all':
+            return station
+    return None
+
+
+def getStationSources(station, sources, cache=None, offline=False):
+    '''
+    Returns [(interpreter, label)] of the station's sources in the order of the given labels, or every configured
+    source in dive_sites.json order if none are given.
+    '''
+    interpreters = dive_plan.getStationInterpreters(station)
+    if cache is not None:
+        interpreters = [(prediction_cache.CachedInterpreter(m, label, station, cache, offline), label)
+                        for m, label in interpreters]
+    if not sources:
+        return interpreters
+    return [(m, label) for source in sources for m, label in interpreters if label.lower() == source]
+
+
+def slackArrays(slacks):
+    '''Returns (minutes since the epoch, before ebb flags) of the slacks sorted by time.'''
+    times = np.array([s.time.timestamp() / 60 for s in slacks], dtype=float)
+    beforeEbb = np.array([bool(s.slackBeforeEbb) for s in slacks], dtype=bool)
+    order = np.argsort(times, kind='stable')
+    return times[order], beforeEbb[order]
+
+
+def getSeries(station, sources, days, cache=None, offline=False):
+    '''Returns (label, times, beforeEbb) of the slacks on the days from the station's first source with any.'''
+    slacks, label = getSlackSeries(getStationSources(station, sources, cache, offline), days)
+    times, beforeEbb = slackArrays(slacks)
+    # getSlackSeries also fetches the days either side
+    inRange = (times >= min(days).timestamp() / 60) & (times < (max(days) + td(days=1)).timestamp() / 60)
+    return label, times[inRange], beforeEbb[inRange]
+
+
+def _nearest(sortedTimes, times):
+    '''Returns the index of the nearest of the sorted times to each of the given times.'''
+    right = np.clip(np.searchsorted(sortedTimes, times), 0, len(sortedTimes) - 1)
+    left = np.clip(right - 1, 0, len(sortedTimes) - 1)
+    return np.where(np.abs(sortedTimes[left] - times) <= np.abs(sortedTimes[right] - times), left, right)
+
+
+def alignSlacks(times1, beforeEbb1, times2, beforeEbb2, maxGapMinutes=180):
+    '''
+    Returns the (index1, index2) arrays of the matched slacks of two sorted series: each pair is of the same type,
+    each slack is the other's nearest of that type, and they are at most maxGapMinutes apart.
+    '''
+    index1, index2 = [], []
+    for ebb in TYPES:
+        i1 = np.flatnonzero(beforeEbb1 == ebb)
+        i2 = np.flatnonzero(beforeEbb2 == ebb)
+        if not len(i1) or not len(i2):
+            continue
+        t1, t2 = times1[i1], times2[i2]
+        to2 = _nearest(t2, t1)
+        to1 = _nearest(t1, t2)
+        keep = (to1[to2] == np.arange(len(t1))) & (np.abs(t2[to2] - t1) <= maxGapMinutes)
+        index1.append(i1[keep])
+        index2.append(i2[to2[keep]])
+    if not index1:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    index1, index2 = np.concatenate(index1), np.concatenate(index2)
+    order = np.argsort(index1, kind='stable')
+    return index1[order], index2[order]
+
+
+def offsetStats(diffs):
+    '''Returns the count, mean, median, std, min, 10th and 90th percentile and max of the differences in minutes.'''
+    if not len(diffs):
+        return {'count': 0}
+    p10, median, p90 = np.percentile(diffs, [10, 50, 90])
+    return {'count': len(diffs), 'mean': float(np.mean(diffs)), 'median': float(median),
+            'std': float(np.std(diffs)), 'min': float(np.min(diffs)), 'p10': float(p10), 'p90': float(p90),
+            'max': float(np.max(diffs))}
 
 
+def compareSeries(series1, series2, maxGapMinutes=180):
+    '''
+    Returns {'before ebb': stats, 'before flood': stats, 'matched': n, 'unmatched1': n, 'unmatched2': n} of the
+    offsets from station 1 to station 2 (station 1 time - station 2 time) of two (times, beforeEbb) series.
+    '''
+    times1, beforeEbb1 = series1
+    times2, beforeEbb2 = series2
+    index1, index2 = alignSlacks(times1, beforeEbb1, times2, beforeEbb2, maxGapMinutes)
+    diffs = times1[index1] - times2[index2]
+    result = {TYPES[ebb]: offsetStats(diffs[beforeEbb1[index1] == ebb]) for ebb in TYPES}
+    result.update(matched=len(index1), unmatched1=len(times1) - len(index1), unmatched2=len(times2) - len(index2))
+    return result
+
+
+def monthlyStats(series1, series2, maxGapMinutes=180):
+    '''Returns [(month 'YYYY-MM', {'before ebb': stats, 'before flood': stats})] of the offsets by station 1 month.'''
+    times1, beforeEbb1 = series1
+    index1, index2 = alignSlacks(times1, beforeEbb1, *series2, maxGapMinutes)
+    diffs = times1[index1] - series2[0][index2]
+    months = np.array([dt.strftime(dt.fromtimestamp(t * 60), '%Y-%m') for t in times1[index1]])
+    result = []
+    for month in dict.fromkeys(months):
+        inMonth = months == month
+        result.append((month, {TYPES[ebb]: offsetStats(diffs[inMonth & (beforeEbb1[index1] == ebb)])
+                               for ebb in TYPES}))
+    return result
+
+
+def _initWorker(options):
+    global _OPTIONS
+    _OPTIONS = options
+
+
+def seriesJob(station, days):
+    '''Fetches the slack series of one station. Returns (label, times, beforeEbb, seconds).'''
+    start = time.perf_counter()
+    cache = None if _OPTIONS['noCache'] else prediction_cache.PredictionCache()
+    series = getSeries(station, _OPTIONS['sources'], days, cache, _OPTIONS['offline'])
+    if cache:
+        cache.flush()
+    return series + (time.perf_counter() - start,)
+
+
+def offsetMatrix(names, series, maxGapMinutes=180):
+    '''Returns [(name1, name2, comparison)] of every pair of the stations with a series, see compareSeries.'''
+    return [(names[i], names[j], compareSeries(series[names[i]], series[names[j]], maxGapMinutes))
+            for i in range(len(names)) for j in range(i + 1, len(names))]
+
+
+def printStats(title, stats):
+    print('{}: {} slacks'.format(title, stats['count']))
+    if stats['count']:
+        print('\t{mean:.2f} avg, {median:.2f} median, {std:.2f} std deviation, {min:.2f} min, {max:.2f} max slack '
+              'difference from station1 to station2 in minutes'.format(**stats))
+
+
+def fmt(stats, key):
+    return '{:.1f}'.format(stats[key]) if stats['count'] else ''
+
+
+def compareAll(args, data, days, sources):
+    stationFilter = [s.strip().lower() for s in args.stations.split(',') if s.strip()]
+    stations = [s for s in data['stations'] if s['name'] != 'all' and
+                (not stationFilter or any(f in s['name'].lower() for f in stationFilter))]
+    options = {'sources': sources, 'offline': args.OFFLINE, 'noCache': args.NO_CACHE}
+    print('Fetching {} to {} for {} stations with {} workers'.format(
+        dt.strftime(days[0], DATEFMT), dt.strftime(days[-1], DATEFMT), len(stations), args.workers))
+
+    start = time.perf_counter()
+    series, labels = {}, {}
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_initWorker,
+                             initargs=(options,)) as pool:
+        futures = {pool.submit(seriesJob, station, days): station['name'] for station in stations}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                label, times, beforeEbb, seconds = future.result()
+            except Exception as e:
+                print('[{:>3}/{}] {}: error {}'.format(done, len(stations), name[:60], repr(e)))
+                continue
+            if not len(times):
+                print('[{:>3}/{}] {}: no slacks'.format(done, len(stations), name[:60]))
+                continue
+            series[name], labels[name] = (times, beforeEbb), label
+            print('[{:>3}/{}] {:<60} {:>5} slacks {:<14} ({:.1f}s)'.format(done, len(stations), name[:60],
+                                                                          len(times), label, seconds))
+
+    names = [s['name'] for s in stations if s['name'] in series]
+    pairs = offsetMatrix(names, series, args.max_gap)
+    print('Compared {} station pairs in {:.1f}s'.format(len(pairs), time.perf_counter() - start))
+
+    # pairs with both types matched, most consistent (smallest worst std deviation) first
+    def spread(pair):
+        stats = [pair[2][t] for t in TYPES.values()]
+        return max(s['std'] for s in stats) if all(s['count'] for s in stats) else float('inf')
+    ranked = sorted(pairs, key=spread)
+    print('\n{:<34}{:<34}{:>16}{:>16}{:>9}'.format('Station 1', 'Station 2', 'ebb med (std)', 'flood med (std)',
+                                                    'matched'))
+    for name1, name2, result in ranked[:args.top] if args.top else ranked:
+        ebb, flood = result['before ebb'], result['before flood']
+        total = result['matched'] + max(result['unmatched1'], result['unmatched2'])
+        print('{:<34}{:<34}{:>16}{:>16}{:>8.0f}%'.format(
+            name1[:32], name2[:32], '{} ({})'.format(fmt(ebb, 'median'), fmt(ebb, 'std')),
+            '{} ({})'.format(fmt(flood, 'median'), fmt(flood, 'std')),
+            result['matched'] / total * 100 if total else 0))
+
+    if args.output:
+        keys = ['count', 'mean', 'median', 'std', 'min', 'p10', 'p90', 'max']
+        with open(args.output, 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(['station1', 'source1', 'station2', 'source2', 'type'] + keys + ['unmatched1', 'unmatched2'])
+            for name1, name2, result in pairs:
+                for t in TYPES.values():
+                    w.writerow([name1, labels[name1], name2, labels[name2], t] +
+                               [round(result[t][k], 2) if k in result[t] else '' for k in keys] +
+                               [result['unmatched1'], result['unmatched2']])
+        print('Wrote the offset matrix to {}'.format(args.output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the slack times of current stations')
+    parser.add_argument('--station1', default='', type=str, help='Name (or part of it) of the first station')
+    parser.add_argument('--station2', default='', type=str, help='Name (or part of it) of the second station')
+    parser.add_argument('--matrix', action='store_true', default=False,
+                        help='Compare every pair of stations instead of station1 and station2')
+    parser.add_argument('--stations', default='', type=str,
+                        help='Comma-delimited station name substrings to limit the matrix to, all by default')
+    parser.add_argument('-d', '--start-date', dest='START', default=None, type=lambda d: dt.strptime(d, '%Y-%m-%d'),
+                        help='First day in the format yyyy-mm-dd, today by default')
+    parser.add_argument('-f', '--futuredays', dest='DAYS_IN_FUTURE', default=30, type=int,
+                        help='Number of days after the start date to compare')
+    parser.add_argument('--sources2', default=None, type=dive_plan.parseSources,
+                        help='Sources of station2 if different from --sources, e.g. to compare two sources of the '
+                             'same station')
+    parser.add_argument('--max-gap', default=180, type=int,
+                        help='Leave slacks unmatched if the nearest of the same type is further than this in minutes')
+    parser.add_argument('--by-month', action='store_true', default=False, help='Also print the offsets per month')
+    parser.add_argument('--top', default=20, type=int, help='Number of most consistent station pairs to print')
+    parser.add_argument('--output', default=None, type=str, help='Write the offset matrix as CSV to this file')
+    parser.add_argument('--workers', default=os.cpu_count() or 1, type=int, help='Worker processes for --matrix')
+    dive_plan.add_arguments(parser, timeFilter=False, days=False, calendar=False,
+                            sourcesHelp='Comma-delimited sources in order of preference (e.g. "harmonic,noaa"), the '
+                                        'first configured source with slacks is used by default')
+    args = parser.parse_args()
+
     data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    days = dive_plan.getAllDays(args.DAYS_IN_FUTURE, args.START or dt.now())
+    if args.matrix:
+        compareAll(args, data, days, args.sources)
+        return
+
+    stations = []
+    for name in (args.station1, args.station2):
+        station = findStation(data['stations'], name) if name else None
+        if not station:
+            print('Unknown station "{}", choose from: {}'.format(
+                name, ', '.join(s['name'] for s in data['stations'] if s['name'] != 'all')))
+            exit(1)
+        stations.append(station)
+    sources2 = args.sources if args.sources2 is None else args.sources2
 
-    station1 = dive_plan.getStation(data['stations'], STATION1)
-    if NOAA1:
-        m1 = intp.NoaaInterpreter(station1['url_noaa'])
-    else:
-        m1 = intp.TBoneSCInterpreter(station1['url_xtide'])
-
-    station2 = dive_plan.getStation(data['stations'], STATION2)
-    if NOAA2:
-        m2 = intp.NoaaInterpreter(station2['url_noaa'])
-    else:
-        m2 = intp.TBoneSCInterpreter(station2['url_xtide'])
-
-    slacks1 = m1.allSlacks(START)
-    slacks2 = m2.allSlacks(START)
-
-    if len(slacks1) != len(slacks2) and (NOAA1 or NOAA2) and TRIM_NOAA:  # one source is NOAA and one is MobileGeographics
-        print("Trimming excess NOAA slacks")
-        if NOAA1:
-            slacks1 = slacks1[:len(slacks2)]
-        elif NOAA2:
-            slacks2 = slacks2[:len(slacks1)]
-
-    if len(slacks1) != len(slacks2):
-        print("Pick a different day or add some fancy comparison - number of slacks don't match")
-        source = "NOAA" if NOAA1 else "XTide"
-        print('{} slacks from {} station for location {}'.format(len(slacks1), source, STATION1))
-        source = "NOAA" if NOAA2 else "XTide"
-        print('{} slacks from {} station for location {}'.format(len(slacks2), source, STATION2))
+    cache = None if args.NO_CACHE else prediction_cache.PredictionCache()
+    (label1, *series1), (label2, *series2) = [getSeries(station, s, days, cache, args.OFFLINE)
+                                              for station, s in zip(stations, (args.sources, sources2))]
+    if cache:
+        cache.flush()
+    for station, label, (times, _) in ((stations[0], label1, series1), (stations[1], label2, series2)):
+        print('{} slacks from {} for station {}'.format(len(times), label, station['name']))
+    if not len(series1[0]) or not len(series2[0]):
+        print('No slacks to compare')
         exit(0)
 
-    beforeEbbDiffs = []
-    beforeFloodDiffs = []
-    for i, s1 in enumerate(slacks1):
-        s2 = slacks2[i]
-        assert s2.slackBeforeEbb == s1.slackBeforeEbb
-
-        diff = (s1.time - s2.time).total_seconds() / 60
-
-        if s1.slackBeforeEbb:
-            beforeEbbDiffs.append(diff)
-        else:
-            beforeFloodDiffs.append(diff)
-
-    print("Before ebb diffs: ", beforeEbbDiffs)
-    print("Before flood diffs: ", beforeFloodDiffs)
-
-    beforeEbbDiffs = np.array(beforeEbbDiffs)
-    beforeFloodDiffs = np.array(beforeFloodDiffs)
-
-    print("{} slacks before Ebb".format(len(beforeEbbDiffs)))
-    if len(beforeEbbDiffs) > 0:
-        print("\t{:.2f} avg slack difference from station1 to station2 in minutes".format(np.average(beforeEbbDiffs)))
-        print("\t{:.2f} median slack difference from station1 to station2 in minutes".format(np.median(beforeEbbDiffs)))
-        print("\t{:.2f} min slack difference from station1 to station2 in minutes".format(np.min(beforeEbbDiffs)))
-        print("\t{:.2f} max slack difference from station1 to station2 in minutes".format(np.max(beforeEbbDiffs)))
-        print("\t{:.2f} std deviation in slack difference from station1 to station2 in minutes".format(np.std(beforeEbbDiffs)))
-
-    print("{} slacks before Flood".format(len(beforeFloodDiffs)))
-    if len(beforeFloodDiffs) > 0:
-        print("\t{:.2f} avg slack difference from station1 to station2 in minutes".format(np.average(beforeFloodDiffs)))
-        print("\t{:.2f} median slack difference from station1 to station2 in minutes".format(np.median(beforeFloodDiffs)))
-        print("\t{:.2f} min slack difference from station1 to station2 in minutes".format(np.min(beforeFloodDiffs)))
-        print("\t{:.2f} max slack difference from station1 to station2 in minutes".format(np.max(beforeFloodDiffs)))
-        print("\t{:.2f} std deviation in slack difference from station1 to station2 in minutes".format(np.std(beforeFloodDiffs)))
+    result = compareSeries(series1, series2, args.max_gap)
+    print('{} slacks matched, {} of station1 and {} of station2 without a match within {} minutes'.format(
+        result['matched'], result['unmatched1'], result['unmatched2'], args.max_gap))
+    for ebb in TYPES:
+        printStats('Slacks ' + TYPES[ebb], result[TYPES[ebb]])
+    if args.by_month:
+        print('\n{:<8}{:>28}{:>28}'.format('Month', 'before ebb median (std)', 'before flood median (std)'))
+        for month, stats in monthlyStats(series1, series2, args.max_gap):
+            print('{:<8}{:>28}{:>28}'.format(month, *['{} ({})'.format(fmt(s, 'median'), fmt(s, 'std')) if s['count']
+                                                      else '' for s in stats.values()]))
 
 
 if __name__ == '__main__':
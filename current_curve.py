@@ -0,0 +1,163 @@
+'''
+Continuous current speed model around slacks, vectorised with NumPy.
+
+Predictions only give the slack times and the max current on either side of them, diveability has been judged from
+those speeds alone (Slack.isDiveable, Slack.speedSum). Between a slack and a max current the speed follows close to a
+quarter sine wave, so the curve between events is modelled as
+
+    cosine: speed = max * sin(pi/2 * u), u the fraction of the way from slack to max
+    thirds: the 50/90 rule of thumb, half the max speed a third of the way and 90% of it two thirds of the way
+
+From it the number of minutes the current stays below a speed on each side of a slack has a closed form, computed for
+a whole series of slacks at once. Stations with harmonic constants (harmonics.py) can instead be measured exactly on
+the dense predicted curve.
+
+Minimum currents that do not reach zero (XTide's min_flood / min_ebb, treated as slacks by the interpreters) are
+modelled as full slacks, the window found for them is an upper bound.
+'''
+
+import numpy as np
+
+SHAPES = ('cosine', 'thirds')
+DEFAULT_WINDOW_SPEED = 0.5  # knots, used for sites without a slack_window_speed
+QUARTER_PERIOD_MINUTES = 12.42 * 60 / 4  # slack to max of the M2 tide, for slacks without max current times
+
+# fraction of the max speed reached a fraction of the way from slack to max, for the rule of thirds
+_THIRDS_TIME = np.array([0.0, 1 / 3, 2 / 3, 1.0])
+_THIRDS_SPEED = np.array([0.0, 0.5, 0.9, 1.0])
+
+
+def window_speed(site: dict) -> float:
+    '''Returns the current speed at the station below which the site is diveable around slack.'''
+    return site.get('slack_window_speed', DEFAULT_WINDOW_SPEED)
+
+
+def _minutes(times) -> np.ndarray:
+    '''Returns minutes since the Unix epoch of naive datetimes, NaN for None.'''
+    return np.array([np.datetime64(t, 's').astype(np.int64) / 60 if t else np.nan for t in times])
+
+
+def slack_arrays(slacks: list) -> dict[str, np.ndarray]:
+    '''
+    Returns the slacks as parallel arrays: 'slack' time, 'pre_time' / 'post_time' of the max current before and after
+    it (minutes since the epoch) and 'pre_speed' / 'post_speed' (signed knots, flood positive).
+    '''
+    slack = _minutes([s.time for s in slacks])
+    beforeEbb = np.array([s.slackBeforeEbb for s in slacks], dtype=bool)
+    floodTime = _minutes([s.maxFloodTime for s in slacks])
+    ebbTime = _minutes([s.maxEbbTime for s in slacks])
+    floodSpeed = np.array([s.floodSpeed for s in slacks], dtype=float)
+    ebbSpeed = np.array([s.ebbSpeed for s in slacks], dtype=float)
+
+    preTime = np.where(beforeEbb, floodTime, ebbTime)
+    postTime = np.where(beforeEbb, ebbTime, floodTime)
+    preTime = np.where(np.isnan(preTime), slack - QUARTER_PERIOD_MINUTES, preTime)
+    postTime = np.where(np.isnan(postTime), slack + QUARTER_PERIOD_MINUTES, postTime)
+    return {'slack': slack, 'pre_time': preTime, 'post_time': postTime,
+            'pre_speed': np.where(beforeEbb, floodSpeed, ebbSpeed),
+            'post_speed': np.where(beforeEbb, ebbSpeed, floodSpeed)}
+
+
+def _rise(u: np.ndarray, shape: str) -> np.ndarray:
+    '''Returns the fraction of the max speed reached a fraction u of the way from slack to max.'''
+    if shape == 'cosine':
+        return np.sin(np.pi / 2 * u)
+    elif shape == 'thirds':
+        return np.interp(u, _THIRDS_TIME, _THIRDS_SPEED)
+    raise ValueError('Unknown curve shape {}, expected one of {}'.format(shape, SHAPES))
+
+
+def _rise_inverse(fraction: np.ndarray, shape: str) -> np.ndarray:
+    '''Returns the fraction of the way from slack to max at which the speed reaches fraction of the max.'''
+    fraction = np.clip(fraction, 0.0, 1.0)
+    if shape == 'cosine':
+        return np.arcsin(fraction) * 2 / np.pi
+    elif shape == 'thirds':
+        return np.interp(fraction, _THIRDS_SPEED, _THIRDS_TIME)
+    raise ValueError('Unknown curve shape {}, expected one of {}'.format(shape, SHAPES))
+
+
+class CurrentCurve:
+    '''
+    Modelled current speed at any time within a series of slacks.
+
+    Args:
+        slacks: Slack objects, e.g. from Interpreter.allSlacks or getSlacks over consecutive days.
+        shape: 'cosine' or 'thirds', see the module docstring.
+    '''
+
+    def __init__(self, slacks: list, shape: str = 'cosine') -> None:
+        if shape not in SHAPES:
+            raise ValueError('Unknown curve shape {}, expected one of {}'.format(shape, SHAPES))
+        self.shape = shape
+        a = slack_arrays(slacks)
+        times = np.concatenate([a['pre_time'], a['slack'], a['post_time']])
+        speeds = np.concatenate([a['pre_speed'], np.zeros(len(a['slack'])), a['post_speed']])
+        # the max current after one slack is the one before the next, keep each event once
+        self.times, first = np.unique(times, return_index=True)
+        self.speeds = speeds[first]
+
+    def speed(self, minutes) -> np.ndarray:
+        '''Returns the signed speed at the given minutes since the epoch, NaN outside the modelled events.'''
+        minutes = np.atleast_1d(np.asarray(minutes, dtype=float))
+        result = np.full(len(minutes), np.nan)
+        i = np.searchsorted(self.times, minutes, side='right') - 1
+        inside = (i >= 0) & (i < len(self.times) - 1)
+        i = i[inside]
+        t0, t1 = self.times[i], self.times[i + 1]
+        v0, v1 = self.speeds[i], self.speeds[i + 1]
+        u = (minutes[inside] - t0) / (t1 - t0)
+        result[inside] = np.where(v0 == 0, v1 * _rise(u, self.shape),
+                                  np.where(v1 == 0, v0 * _rise(1 - u, self.shape),
+                                           # between two extrema, e.g. a max and a weaker min current
+                                           v0 + (v1 - v0) * (1 - np.cos(np.pi * u)) / 2))
+        # exactly at the last event
+        result[minutes == self.times[-1]] = self.speeds[-1]
+        return result
+
+    def speed_at(self, times: list) -> np.ndarray:
+        '''Returns the signed speed at the given naive datetimes.'''
+        return self.speed(_minutes(times))
+
+
+def window_minutes(slacks: list, threshold, shape: str = 'cosine') -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns (minutes before, minutes after) each slack that the modelled current stays below threshold knots.
+    threshold is one speed or an array with one per slack.
+    '''
+    a = slack_arrays(slacks)
+    threshold = np.broadcast_to(np.asarray(threshold, dtype=float), a['slack'].shape)
+    sides = []
+    for time, speed in ((a['pre_time'], a['pre_speed']), (a['post_time'], a['post_speed'])):
+        speed = np.abs(speed)
+        # a side without current is below any threshold up to the next max
+        fraction = np.divide(threshold, speed, out=np.ones_like(speed), where=speed > 0)
+        sides.append(_rise_inverse(fraction, shape) * np.abs(a['slack'] - time))
+    return sides[0], sides[1]
+
+
+def harmonic_window_minutes(station, slacks: list, threshold, max_minutes: int = 240,
+                            step_minutes: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns (minutes before, minutes after) each slack that the current predicted by the harmonics.HarmonicStation
+    stays below threshold knots, to step_minutes and capped at max_minutes. Zero if the predicted current at the
+    slack time is already above threshold.
+    '''
+    import harmonics
+    hours = harmonics.to_hours([s.time for s in slacks], station.timezone)
+    offsets = np.arange(-max_minutes, max_minutes + step_minutes, step_minutes)
+    grid = hours[:, None] + offsets[None, :] / 60
+    speeds = station.predict_hours(grid.ravel()).reshape(grid.shape)
+    threshold = np.asarray(threshold, dtype=float).reshape(-1, 1)
+    below = np.abs(speeds) < threshold
+    center = max_minutes // step_minutes
+
+    def run(side: np.ndarray) -> np.ndarray:
+        # length of the run of True starting at the first column
+        return np.where(side.all(axis=1), side.shape[1], np.argmin(side, axis=1))
+
+    before = run(below[:, center::-1]) - 1
+    after = run(below[:, center:]) - 1
+    atSlack = below[:, center]
+    return (np.where(atSlack, before, 0) * step_minutes).astype(float), \
+        (np.where(atSlack, after, 0) * step_minutes).astype(float)
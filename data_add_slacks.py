@@ -1,47 +1,111 @@
 '''
 This program is used to identify and save the nearest period of slack current where the dives in the specified
 .csv file took place.
+
+Dives are grouped by the current station of their site. Each station's slack series is fetched once for every day
+with a dive (and the days either side), from the first source in SOURCES that returns slacks: harmonic
+predictions, the xtide-offline archive, XTide Docker, NOAA or Dairiki, read through the prediction cache. Sources
+that work by range (harmonic, XTide Docker) compute the whole date range of the station in one run. Every dive is
+then matched to the slack whose estimated meetup time is nearest, with a binary search over the sorted series, so
+thousands of dives are annotated in one pass.
 '''
 
 import dive_plan
 import data_query_old as dqo
 import interpreter as intp
 import data_collect
+import prediction_cache
+from dive_plan import stationKey
 
 from datetime import datetime as dt
 from datetime import timedelta as td
 import json, csv
+import numpy as np
+
+MEETUP_LEAD_MINUTES = 45  # takes ~45min to meet and gear up before the club entry time
+XTIDE_OFFLINE = 'XTide Offline'
 
-# For the site with the given data and the given mobilegeographics current url, returns the
-# Slack object with corrected time closest to the given meetup time.
-def getSlackForDive(meetTime, siteData, url):
-    m = intp.MobilegeographicsInterpreter(url)
-    slacks = m.getSlacks(meetTime, intp.TIME_FILTER_ALL)
 
-    estMeetupTimes = {}  # estimated meetup time for the slack -> slack
+# Returns the slack of the given slacks whose club entry time (see dive_plan.getEntryTimes) minus leadMinutes is
+# nearest to each of the given times, or None if there is none within maxGapMinutes. The slacks are sorted by that
+# estimated time once and each time is placed with a binary search.
+def getNearestSlacks(times, slacks, siteData, leadMinutes=0, maxGapMinutes=None):
+    estimated, candidates = [], []
     for slack in slacks:
-        times = dive_plan.getEntryTimes(slack, siteData)
-        if not times:
-            continue
-        estMeetupTimes[times[1] - td(minutes=45)] = slack  # takes ~45min to meet and gear up
-    # find the estMeetupTime closest to the actual meetup time. This gives the slack the dive was planned for.
-    minDelta, slackDove = td(hours=99999).total_seconds(), None
-    for estTime, slack in estMeetupTimes.items():
-        diff = abs((meetTime - estTime).total_seconds())
-        if diff < minDelta:
-            minDelta, slackDove = diff, slack
-    return slackDove
+        entryTimes = dive_plan.getEntryTimes(slack, siteData)
+        if entryTimes:
+            estimated.append((entryTimes[1] - td(minutes=leadMinutes)).timestamp() / 60)
+            candidates.append(slack)
+    if not candidates:
+        return [None] * len(times)
+    order = np.argsort(estimated, kind='stable')
+    estimated = np.array(estimated)[order]
+    minutes = np.array([t.timestamp() / 60 for t in times])
+    right = np.clip(np.searchsorted(estimated, minutes), 0, len(estimated) - 1)
+    left = np.clip(right - 1, 0, len(estimated) - 1)
+    nearest = np.where(np.abs(estimated[left] - minutes) <= np.abs(estimated[right] - minutes), left, right)
+    gaps = np.abs(estimated[nearest] - minutes)
+    return [candidates[order[i]] if maxGapMinutes is None or gap <= maxGapMinutes else None
+            for i, gap in zip(nearest, gaps)]
+
+
+# For the site with the given data, returns the Slack object with corrected time closest to the given meetup time
+# among the given slacks.
+def getSlackForDive(meetTime, siteData, slacks):
+    return getNearestSlacks([meetTime], slacks, siteData, MEETUP_LEAD_MINUTES)[0]
+
+
+# Returns [(interpreter, label)] of the sources for the station of the given site in the order of the given labels,
+# including the xtide-offline archive if it has the station
+def getSources(siteData, data, sources, cache, offline):
+    station, interpreters = dive_plan.getInterpreters(siteData, data, cache, offline)
+    if station and intp.TBoneSCOfflineInterpreter.hasArchive(station):
+        interpreters.append((intp.TBoneSCOfflineInterpreter(station.get('url_xtide_a', ''), station), XTIDE_OFFLINE))
+    ranked = []
+    for source in sources:
+        ranked += [(m, label) for m, label in interpreters if label.lower() == source.lower()]
+    return ranked
+
+
+# Returns (slacks, label) of all slacks on the given days and the days either side from the first source that has
+# any, or ([], None)
+def getSlackSeries(interpreters, days):
+    allDays = sorted({d + td(days=i) for d in days for i in (-1, 0, 1)})
+    for m, label in interpreters:
+        if hasattr(m, 'preload_range'):
+            missing = m.missingDays(allDays) if hasattr(m, 'missingDays') else allDays
+            if missing and not getattr(m, 'offline', False):
+                try:
+                    m.preload_range(missing[0], missing[-1])
+                except Exception as e:
+                    print('\tError preloading {}: {}'.format(label, repr(e)))
+                    continue
+        slacks = []
+        for day in allDays:
+            try:
+                slacks += [s for s in m.getSlacks(day, intp.TIME_FILTER_ALL) if isinstance(s, intp.Slack)]
+            except Exception as e:
+                print('\tError fetching {} on {}: {}'.format(label, dt.strftime(day, intp.DATEFMT), repr(e)))
+        if slacks:
+            return slacks, label
+    return [], None
+
 
 def main():
     inputFile = 'dive_meetup_data_old_format.csv'
     outputFile = inputFile.replace(".csv", "") + "_with_slacks.csv"
     PRINT_LOCATION_CLASSIFICATION = False
+    OVERWRITE_SLACKS = False  # recompute the slacks of a file that already has them
+    SOURCES = ['Harmonic', XTIDE_OFFLINE, 'XTide Docker', 'NOAA', 'Dairiki']  # in order of preference
+    USE_CACHE = True  # read through the prediction cache (see prefetch.py)
+    OFFLINE = False  # only use the prediction cache and local sources
+    MAX_GAP_MINUTES = 360  # leave a dive without a slack if none has an estimated meetup time this close
 
     print('Extracting dives from data file', inputFile)
     dives, slacks = dqo.getDives(inputFile)
 
-    if slacks:
-        print('Slacks already present in file {}, no need to run this program. Exiting now.')
+    if slacks and not OVERWRITE_SLACKS:
+        print('Slacks already present in file {}, no need to run this program. Exiting now.'.format(inputFile))
         exit(0)
 
     print('Classifying dive sites')
@@ -54,26 +118,50 @@ def main():
             for dive in vals:
                 print('\t', dive)
 
-    print('Identifying the nearest period of slack current for each dive')
+    # Group the dives of current sites by station
     data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    stations = {}  # station key -> [(siteData, [dives])]
     for site, sitedives in results.items():
         siteData = dqo.getSiteData(None, site, data)  # go through all sites
         if siteData == None:
             continue
+        if 'data_tides' in siteData:
+            print('Skipping tide site {}'.format(siteData['name']))
+            continue
+        stations.setdefault(stationKey(siteData), []).append((siteData, sitedives))
 
-        # for each dive at this location, find the slack that was dove
-        station = dive_plan.getStation(data['stations'], siteData['data'])
-        print('{} - {}\n{} - {}'.format(siteData['name'], siteData['data'], station['url'], station['coords']))
-        for dive in sitedives:
-            dive.slack = getSlackForDive(dive.date, siteData, station['url'])
-            print('\t', dive)
-            print('\t\t', dive.slack)
+    print('Identifying the nearest period of slack current for each dive')
+    cache = prediction_cache.PredictionCache() if USE_CACHE else None
+    numMatched = 0
+    for key, stationSites in stations.items():
+        days = {dt(d.date.year, d.date.month, d.date.day) for _, sitedives in stationSites for d in sitedives}
+        interpreters = getSources(stationSites[0][0], data, SOURCES, cache, OFFLINE)
+        series, label = getSlackSeries(interpreters, days)
+        print('{}: {} slacks for {} dives on {} days from {} to {} ({})'.format(
+            key[1], len(series), sum(len(d) for _, d in stationSites), len(days),
+            dt.strftime(min(days), intp.DATEFMT), dt.strftime(max(days), intp.DATEFMT), label))
+        for siteData, sitedives in stationSites:
+            matches = getNearestSlacks([d.date for d in sitedives], series, siteData, MEETUP_LEAD_MINUTES,
+                                       MAX_GAP_MINUTES)
+            for dive, slack in zip(sitedives, matches):
+                dive.slack = slack
+                numMatched += slack is not None
+                print('\t', dive)
+                print('\t\t', dive.slack)
+    if cache:
+        cache.flush()
+    print('Found slacks for {} of {} dives'.format(numMatched, len(dives)))
 
     print('Writing slacks to file', outputFile)
+    withSplash = any(dive.splash for dive in dives)
     with open(data_collect.absName(outputFile), 'w', encoding='utf-8', newline='\n') as f:
         w = csv.writer(f, delimiter=',')
         for dive in dives:
-            w.writerow([dt.strftime(dive.date, dqo.MEETUP_TIME_FORMAT), dive.title, dive.location, dive.address, dive.descr, dive.url, dive.slack])
+            row = [dt.strftime(dive.date, dqo.MEETUP_TIME_FORMAT), dive.title, dive.location, dive.address,
+                   dive.descr, dive.url, dive.slack]
+            if withSplash:
+                row.append(dt.strftime(dive.splash, dqo.MEETUP_TIME_FORMAT) if dive.splash else "")
+            w.writerow(row)
     print('Done writing to file', data_collect.absName(outputFile))
 
 if __name__ == "__main__":
@@ -3,7 +3,6 @@ This program is used to collect past dives from the Marker Buoy dive club
 Meetup page and save them to a .csv file.
 '''
 
-from selenium import webdriver
 from datetime import timedelta as td
 import pickle, time, datetime, os, csv
 
@@ -67,6 +66,7 @@ def parseDives(d, w):
             w.writerow([date, title, location, descr, linkText])
 
 def main():
+    from selenium import webdriver  # only the scraper needs selenium, other scripts import this module for absName
     d = webdriver.Firefox()
     d.get('https://secure.meetup.com/login')
 
@@ -0,0 +1,238 @@
+'''
+Materialised per-site diveability calendar: one row per site, source, day and slack (or tide window) with the
+diveable flag, the reason and the entry/exit times, so planners read answers instead of re-evaluating every window.
+
+Rows are computed from the interpreters (read through the prediction cache) and dive_sites.json, and stored in one
+JSON file per site and source under dive-calendar/, keyed by day. Windows are stored unfiltered (TIME_FILTER_ALL),
+the time filter is applied when reading, like the prediction cache.
+
+Refreshing only recomputes what changed: days not in the file yet are added, and a site whose config (thresholds,
+offsets, ...) or station config (the source urls and codes) changed since the file was written has every day
+recomputed, detected by a hash of both stored with the rows. Each day also stores a fingerprint of the cached
+predictions it was computed from (see PredictionCache.dayFingerprint), so a day refetched with different
+predictions (prefetch.py --refresh) is recomputed. Days the source returned nothing for (not cached yet offline, or
+fetch errors) are not stored, so a later refresh fills them in. Saving merges in the days other processes stored for
+the same config, under the same file lock as the prediction cache.
+
+rank_batch.py, next_dives.py, club_dates.py, dive_itinerary.py, expedition_planner.py, must_do_dives.py and
+rank_year_slacks.py read through the store by default (--no-calendar or USE_CALENDAR to turn it off, and --no-cache
+bypasses it), dive_plan.py with --calendar. Running this file refreshes it for every site ahead of time.
+
+Examples:
+    python3 dive_calendar.py -f 365 --sources harmonic --offline
+    python3 dive_calendar.py --sites "deception pass, skyline wall" -d 2026-05-01 -f 90
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import datetime as dt
+
+import data_collect
+import dive_plan
+import prediction_cache
+from prediction_cache import fileLock, slug, timeFromStr, timeToStr, windowFromDict, windowToDict, writeJson
+from interpreter_common import DATEFMT, TIME_FILTER_ALL, passes_time_filter
+
+CALENDAR_DIR = 'dive-calendar'
+CALENDAR_VERSION = 2
+
+
+def configHash(site, data):
+    '''Returns a hash of everything in dive_sites.json the diveability of the site depends on.'''
+    if 'data_tides' in site:
+        station = dive_plan.getStation(data['tide_stations'], site['data_tides'])
+    else:
+        station = dive_plan.getStation(data['stations'], site['data'])
+    config = json.dumps({'version': CALENDAR_VERSION, 'site': site, 'station': station}, sort_keys=True)
+    return hashlib.sha1(config.encode()).hexdigest()
+
+
+def _rowToDict(window, diveable, info, entryTime, exitTime):
+    return {'window': windowToDict(window), 'diveable': diveable, 'info': info, 'entry': timeToStr(entryTime),
+            'exit': timeToStr(exitTime)}
+
+
+def _rowFromDict(d):
+    return windowFromDict(d['window']), d['diveable'], d['info'], timeFromStr(d['entry']), timeFromStr(d['exit'])
+
+
+class _CalendarFile:
+    '''The materialised days of one site and source, loaded on first use.'''
+
+    def __init__(self, path, site, source):
+        self.path = path
+        self.dirty = False
+        self.header = {'version': CALENDAR_VERSION, 'site': site, 'source': source, 'hash': None}
+        self.checked = False  # the config hash was compared in this run
+        self.changed = set()  # days computed since the last save
+        self.rows = {}  # parsed rows of the days read so far
+        self.header['hash'], self.days, self.fingerprints = self._read()
+
+    def getRows(self, key):
+        '''Returns the rows of the day, parsed once, or None if the day is not stored.'''
+        if key not in self.rows:
+            dicts = self.days.get(key)
+            if dicts is None:
+                return None
+            self.rows[key] = [_rowFromDict(d) for d in dicts]
+        return self.rows[key]
+
+    def putRows(self, key, rows, fingerprint):
+        self.days[key] = [_rowToDict(*r) for r in rows]
+        self.rows[key] = rows
+        self.fingerprints[key] = fingerprint
+        self.changed.add(key)
+        self.dirty = True
+
+    def _read(self):
+        '''Returns the stored (hash, days, fingerprints), (None, {}, {}) if there is no readable file.'''
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    contents = json.load(f)
+                if contents.get('version') == CALENDAR_VERSION:
+                    return contents['hash'], contents['days'], contents['fingerprints']
+            except (OSError, ValueError, KeyError) as e:
+                print('Ignoring unreadable calendar file {}: {}'.format(self.path, repr(e)))
+        return None, {}, {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        with fileLock(self.path):
+            # keep the days another process (e.g. a rank_batch.py worker on another year) computed for the same config
+            diskHash, days, fingerprints = self._read()
+            if diskHash == self.header['hash']:
+                for day in self.changed:
+                    days[day] = self.days[day]
+                    fingerprints[day] = self.fingerprints.get(day)
+                self.days, self.fingerprints = days, fingerprints
+                self.rows = {key: rows for key, rows in self.rows.items() if key in self.changed}
+            writeJson(self.path, dict(self.header, days=self.days, fingerprints=self.fingerprints))
+        self.changed = set()
+        self.dirty = False
+
+
+class CalendarStore:
+    '''Store of the materialised diveability rows (window, diveable, info, entryTime, exitTime) of sites.'''
+
+    def __init__(self, directory=None):
+        self.directory = directory or data_collect.absName(CALENDAR_DIR)
+        self._files = {}
+
+    def _file(self, siteName, source) -> _CalendarFile:
+        key = (siteName, source)
+        if key not in self._files:
+            path = os.path.join(self.directory, slug(siteName), slug(source) + '.json')
+            self._files[key] = _CalendarFile(path, siteName, source)
+        return self._files[key]
+
+    def refresh(self, site, data, m, source, days):
+        '''
+        Materialises the rows of the site for the days not stored yet from the interpreter m labelled source, for the
+        days whose cached predictions changed since they were stored (if m reads through the prediction cache), or
+        for every day if the site's config changed. Returns the number of days computed.
+        '''
+        f = self._file(site['name'], source)
+        if not f.checked:
+            h = configHash(site, data)
+            if f.header['hash'] != h:
+                f.header['hash'] = h
+                f.days, f.fingerprints, f.rows, f.changed = {}, {}, {}, set()
+                f.dirty = True
+            f.checked = True
+        fingerprint = getattr(m, 'fingerprint', None)
+        computed = 0
+        for day in days:
+            key = dt.strftime(day, DATEFMT)
+            current = None
+            if key in f.days:
+                current = fingerprint(day) if fingerprint else None
+                if current is None or current == f.fingerprints.get(key):
+                    continue
+            try:
+                windows = m.getSlacks(day, TIME_FILTER_ALL)
+            except Exception as e:
+                print('Error fetching {} for {} on {}: {}'.format(source, site['name'], key, repr(e)))
+                continue
+            if not windows:
+                continue
+            rows = []
+            for w in windows:
+                diveable, info = dive_plan.isDiveable(w, site, False)
+                times = dive_plan.getEntryTimes(w, site)
+                rows.append((w, diveable, info) + (times[2:] if times else (None, None)))
+            if current is None and fingerprint:
+                current = fingerprint(day)  # a new day, fingerprinted once its predictions are cached
+            f.putRows(key, rows, current)
+            computed += 1
+        return computed
+
+    def getDay(self, siteName, source, day, timeFilter=TIME_FILTER_ALL):
+        '''Returns the rows of the day passing the time filter, or None if the day is not materialised.'''
+        rows = self._file(siteName, source).getRows(dt.strftime(day, DATEFMT))
+        if rows is None:
+            return None
+        return [r for r in rows if passes_time_filter(r[0].time, r[0].sunriseTime, r[0].sunsetTime, timeFilter)]
+
+    def getRows(self, siteName, source, days, timeFilter=TIME_FILTER_ALL):
+        '''Yields the rows of the days passing the time filter in time order, skipping days not materialised.'''
+        for day in days:
+            yield from self.getDay(siteName, source, day, timeFilter) or []
+
+    def getDiveIntervals(self, siteName, source, days, timeFilter=TIME_FILTER_ALL):
+        '''Returns [(entryTime, exitTime, window, info)] of the diveable rows, like must_do_dives.getDiveIntervals.'''
+        intervals = [(entryTime, exitTime, w, info)
+                     for w, diveable, info, entryTime, exitTime in self.getRows(siteName, source, days, timeFilter)
+                     if diveable and entryTime]
+        intervals.sort(key=lambda x: x[0])
+        return intervals
+
+    def flush(self):
+        '''Writes every modified file to disk.'''
+        for f in self._files.values():
+            f.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the materialised diveability calendar of every site')
+    parser.add_argument('--sites', default='', type=str,
+                        help='Comma-delimited site names, every site in dive_sites.json by default')
+    parser.add_argument('-d', '--start-date', dest='START', default=None, type=lambda d: dt.strptime(d, '%Y-%m-%d'),
+                        help='First day in the format yyyy-mm-dd, today by default')
+    parser.add_argument('-f', '--futuredays', dest='DAYS_IN_FUTURE', default=30, type=int,
+                        help='Number of days after the start date to materialise')
+    dive_plan.add_arguments(parser, timeFilter=False, days=False, noCache=False, calendar=False,
+                            sourcesHelp='Comma-delimited sources to materialise (e.g. "harmonic,noaa"), the first '
+                                        'source configured for each site by default')
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    sites = data['sites']
+    if args.sites:
+        names = dive_plan.parse_sites(args.sites, sites)
+        sites = [s for s in sites if s['name'] in names]
+    days = dive_plan.getAllDays(args.DAYS_IN_FUTURE, args.START or dt.now())
+
+    cache = prediction_cache.PredictionCache()
+    calendar = CalendarStore()
+    start = time.perf_counter()
+    for site in sites:
+        _, interpreters = dive_plan.getInterpreters(site, data, cache, args.OFFLINE)
+        if args.sources:
+            chosen = [(m, label) for m, label in interpreters if label.lower() in args.sources]
+        else:
+            chosen = interpreters[:1]
+        for m, label in chosen:
+            computed = calendar.refresh(site, data, m, label, days)
+            print('{} ({}): {} of {} days computed'.format(site['name'], label, computed, len(days)))
+    cache.flush()
+    calendar.flush()
+    print('Refreshed {} sites in {:0.1f}s'.format(len(sites), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
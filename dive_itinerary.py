@@ -0,0 +1,181 @@
+'''
+Finds the best same-day itinerary of dives at several current or tide sites, e.g. Deception Pass, Skyline Wall and
+Sares Head, or Gabriola Pass and Dodd Narrows, for every day in a date range.
+
+The diveable entry/exit windows of each site (from _getEntryTimes, read from the materialised rows of
+dive_calendar.py) are built once for the whole range. For each day a dynamic program over the windows in entry order,
+extended one dive at a time, finds the sequence with the most dives, then the weakest total current (speed sum, or
+height change for tide sites), then the least waiting between dives. A dive can follow another when its entry is at
+least the surface interval and the transfer time between the two sites after the other's exit. Each site is dived at
+most once a day unless --allow-repeat is given.
+
+Transfer times in minutes come from pairs under transfer_times in dive_sites.json, or a --transfers file, in the
+same format as must_do_dives:
+    [{"name1": "Deception Pass", "name2": "Skyline Wall", "minutes": 40}, ...]
+Pairs without a time use --default-transfer.
+
+Examples:
+    python3 dive_itinerary.py --sites "deception pass, skyline wall, sares head" -f 90
+    python3 dive_itinerary.py --sites "gabriola pass, dodd narrows" -d 2026-05-01 -f 180 -w --surface-interval 60
+'''
+
+import argparse
+import json
+from datetime import datetime as dt
+
+import data_collect
+import dive_calendar
+import dive_plan
+import prediction_cache
+from dive_plan import pickInterpreter, stationKey
+from interpreter_common import DATEFMT, TIMEFMT
+from must_do_dives import getDiveIntervals, getSite
+
+
+def getTransferTimes(pairs):
+    '''Returns {(name1, name2): minutes} in both directions for the given transfer_times pairs.'''
+    transfers = {}
+    for pair in pairs:
+        transfers[(pair['name1'], pair['name2'])] = pair['minutes']
+        transfers[(pair['name2'], pair['name1'])] = pair['minutes']
+    return transfers
+
+
+def bestItinerary(windows, surfaceInterval, transfer, maxDives=3, allowRepeat=False):
+    '''
+    Returns the best itinerary [(site name, (entryTime, exitTime, window, info))] for one day's windows, given as
+    [(site name, interval)] sorted by entry time, and its score (dives, -total magnitude, -total minutes waiting).
+    transfer(site1, site2) returns the minutes to get from one site to the other.
+
+    States are (last dive, sites dived) with the best score reaching them. Each round extends every state of the
+    previous round by one later compatible dive, so the work is O(maxDives * states * windows) per day.
+    '''
+    best = None
+    # state -> (score, path), where state is (index of the last dive, frozenset of sites dived)
+    states = {}
+    for j, (name, interval) in enumerate(windows):
+        score = (1, -interval[2].magnitude(), 0.0)
+        states[(j, frozenset([name]))] = (score, [j])
+    for _ in range(maxDives):
+        nextStates = {}
+        for (i, visited), (score, path) in states.items():
+            if best is None or score > best[0]:
+                best = (score, path)
+            if len(path) == maxDives:
+                continue
+            prevName, prevInterval = windows[i]
+            for j in range(i + 1, len(windows)):
+                name, interval = windows[j]
+                if name in visited and not allowRepeat:
+                    continue
+                gap = (interval[0] - prevInterval[1]).total_seconds() / 60
+                if gap < max(surfaceInterval, transfer(prevName, name)):
+                    continue
+                newScore = (score[0] + 1, score[1] - interval[2].magnitude(), score[2] - gap)
+                key = (j, visited | {name})
+                if key not in nextStates or newScore > nextStates[key][0]:
+                    nextStates[key] = (newScore, path + [j])
+        states = nextStates
+        if not states:
+            break
+    if best is None:
+        return [], None
+    return [windows[j] for j in best[1]], best[0]
+
+
+def planItineraries(siteNames, intervals, surfaceInterval, transfer, maxDives=3, allowRepeat=False):
+    '''Returns [(day, itinerary, score)] with the best itinerary of every day that has a diveable window, by day.'''
+    days = {}
+    for name in siteNames:
+        for interval in intervals[name]:
+            days.setdefault(dt.strftime(interval[0], DATEFMT), []).append((name, interval))
+    result = []
+    for day, windows in sorted(days.items(), key=lambda d: min(w[1][0] for w in d[1])):
+        windows.sort(key=lambda w: w[1][0])
+        itinerary, score = bestItinerary(windows, surfaceInterval, transfer, maxDives, allowRepeat)
+        result.append((day, itinerary, score))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the best same-day multi-site dive itinerary for each day')
+    parser.add_argument('--sites', required=True, type=str, help='Comma-delimited site names')
+    parser.add_argument('-d', '--start-date', dest='START', default=None, type=lambda d: dt.strptime(d, '%Y-%m-%d'),
+                        help='First day in the format yyyy-mm-dd, today by default')
+    parser.add_argument('-f', '--futuredays', dest='DAYS_IN_FUTURE', default=30, type=int,
+                        help='Number of days after the start date to plan')
+    parser.add_argument('--surface-interval', default=45, type=int,
+                        help='Minimum minutes between the exit of one dive and the entry of the next')
+    parser.add_argument('--transfers', default=None, type=str,
+                        help='JSON file of {name1, name2, minutes} transfer times, added to transfer_times in '
+                             'dive_sites.json')
+    parser.add_argument('--default-transfer', default=60, type=int,
+                        help='Transfer minutes between sites without a transfer time')
+    parser.add_argument('--max-dives', default=3, type=int, help='Most dives in a day')
+    parser.add_argument('--min-dives', default=2, type=int, help='Only print days with at least this many dives')
+    parser.add_argument('--allow-repeat', action='store_true', default=False,
+                        help='Allow diving the same site more than once a day')
+    parser.add_argument('--sort', action='store_true', default=False,
+                        help='Print the days from the best itinerary to the worst instead of by date')
+    dive_plan.add_arguments(parser)
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    siteNames = dive_plan.parse_sites(args.sites, data['sites'])
+
+    pairs = data.get('transfer_times', [])
+    if args.transfers:
+        pairs = pairs + json.loads(open(args.transfers).read())
+    transfers = getTransferTimes(pairs)
+
+    def transfer(name1, name2):
+        if name1 == name2:
+            return 0
+        return transfers.get((name1, name2), args.default_transfer)
+
+    days = dive_plan.getDiveDays(args.DAYS_IN_FUTURE, args.START or dt.now(), args.INCLUDE_WORKDAYS,
+                                 args.INCLUDE_FRIDAYS)
+    cache = None if args.NO_CACHE else prediction_cache.PredictionCache()
+    calendar = None if args.NO_CACHE or args.NO_CALENDAR else dive_calendar.CalendarStore()
+
+    # Diveable windows of each site for the whole range, sites on the same station share an interpreter
+    interpreters = {}
+    intervals = {}
+    for name in siteNames:
+        site = getSite(data['sites'], name)
+        key = stationKey(site)
+        if key not in interpreters:
+            _, choices = dive_plan.getInterpreters(site, data, cache, args.OFFLINE)
+            interpreters[key] = pickInterpreter(choices, args.sources)
+        m, label = interpreters[key]
+        if m and calendar:
+            calendar.refresh(site, data, m, label, days)
+            intervals[name] = calendar.getDiveIntervals(name, label, days, args.TIME_FILTER)
+        else:
+            intervals[name] = getDiveIntervals(site, m, days, args.TIME_FILTER) if m else []
+        print('{}: {} diveable windows ({})'.format(name, len(intervals[name]), label))
+    if cache:
+        cache.flush()
+    if calendar:
+        calendar.flush()
+
+    plans = [p for p in planItineraries(siteNames, intervals, args.surface_interval, transfer, args.max_dives,
+                                        args.allow_repeat)
+             if p[2] and p[2][0] >= args.min_dives]
+    if args.sort:
+        plans.sort(key=lambda p: p[2], reverse=True)
+    print('{} days with an itinerary of at least {} dives'.format(len(plans), args.min_dives))
+    for day, itinerary, score in plans:
+        steps = []
+        prev = None
+        for name, (entryTime, exitTime, window, _) in itinerary:
+            if prev:
+                steps.append('{:0.0f}min'.format((entryTime - prev).total_seconds() / 60))
+            steps.append('{} {}-{} ({:0.1f})'.format(name, dt.strftime(entryTime, TIMEFMT),
+                                                     dt.strftime(exitTime, TIMEFMT), window.magnitude()))
+            prev = exitTime
+        print('{}: {}'.format(day, ' -> '.join(steps)))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,11 @@ specified by dive_sites.json
 import data_collect
 import interpreter as intp
 import interpreter_tides as intp_tides
-from interpreter_common import DiveWindow
+import prediction_cache
+import profiling
+import us_holidays
+from interpreter_common import DiveWindow, has_harmonic_constants
 import argparse
-from pandas.tseries.holiday import USFederalHolidayCalendar
 from datetime import datetime as dt
 from datetime import timedelta as td
 import json
@@ -54,9 +56,6 @@ def getNonWorkDays(futureDays: int, start=dt.now()) -> list[dt]:
     start = dt(start.year, start.month, start.day)
     end = start + td(days=futureDays)
 
-    cal = USFederalHolidayCalendar()  # does not include some business holidays like black friday
-    holidays = cal.holidays(start=start, end=end).to_pydatetime()
-
     delta = td(days=1)
     d = start
     workdays = {0, 1, 2, 3, 4}
@@ -64,7 +63,7 @@ def getNonWorkDays(futureDays: int, start=dt.now()) -> list[dt]:
     while d <= end:
         if d.weekday() not in workdays:
             nonWorkDays.append(d)
-        elif d in holidays:
+        elif us_holidays.isHoliday(d):  # does not include some business holidays like black friday
             nonWorkDays.append(d)
         d += delta
     return nonWorkDays
@@ -102,9 +101,6 @@ def getDiveDays(futureDays: int, start=dt.now(), include_workdays: bool = True,
     start = dt(start.year, start.month, start.day)
     end = start + td(days=futureDays)
 
-    cal = USFederalHolidayCalendar()
-    holidays = cal.holidays(start=start, end=end).to_pydatetime()
-
     # Weekdays to exclude: Mon=0, Tue=1, Wed=2, Thu=3, Fri=4
     # If include_fridays, only exclude Mon-Thu
     workdays_to_exclude = {0, 1, 2, 3} if include_fridays else {0, 1, 2, 3, 4}
@@ -115,7 +111,7 @@ def getDiveDays(futureDays: int, start=dt.now(), include_workdays: bool = True,
     while d <= end:
         if d.weekday() not in workdays_to_exclude:
             diveDays.append(d)
-        elif d in holidays:
+        elif us_holidays.isHoliday(d):
             diveDays.append(d)
         d += delta
     return diveDays
@@ -137,13 +133,16 @@ def printDive(s: DiveWindow, site: dict, titleMessage: str) -> None:
 # Returns true if the given dive window is diveable within the parameters of the given site.
 # Also returns description of reasoning the decision was made.
 def isDiveable(s: DiveWindow, site: dict, ignoreMaxSpeed: bool) -> (bool, str):
-    return s.isDiveable(site, ignoreMaxSpeed)
+    with profiling.timed('evaluation.is_diveable'):
+        return s.isDiveable(site, ignoreMaxSpeed)
 
 
 # Checks the given list of DiveWindows if a dive is possible. If so, prints information about the dive.
-def printDiveDay(windows: list[DiveWindow], site: dict, printAll: bool, ignoreMaxSpeed: bool, title: str) -> bool:
+# verdicts optionally gives the (diveable, info) of each window already evaluated, e.g. read from dive_calendar.py.
+def printDiveDay(windows: list[DiveWindow], site: dict, printAll: bool, ignoreMaxSpeed: bool, title: str,
+                 verdicts: list = None) -> bool:
     printed = False
-    for s in windows:
+    for i, s in enumerate(windows):
         # Current-specific sanity checks
         if isinstance(s, intp.Slack):
             if s.ebbSpeed > 0.0:
@@ -151,7 +150,7 @@ def printDiveDay(windows: list[DiveWindow], site: dict, printAll: bool, ignoreMa
             if s.floodSpeed < 0.0:
                 print('WARNING - FLOOD SPEED IS NEGATIVE')
         # Check if diveable or not
-        diveable, info = isDiveable(s, site, ignoreMaxSpeed)
+        diveable, info = verdicts[i] if verdicts is not None else isDiveable(s, site, ignoreMaxSpeed)
         if not printed and (diveable or printAll):
             print('\t' + title)
             printed = True
@@ -170,6 +169,23 @@ def isDiveSite(site: str, sitesData: list) -> bool:
     return False
 
 
+# Returns (names, unknown) for the comma-delimited site names in the given text, matched to the names in the given json
+# dive site data ignoring capitals and extra whitespace. Unknown holds the entries that match no site.
+def parseSiteNames(text: str, sitesData: list[dict]) -> (list[str], list[str]):
+    byKey = {' '.join(s['name'].lower().split()): s['name'] for s in sitesData}
+    names, unknown = [], []
+    for item in text.split(','):
+        key = ' '.join(item.lower().split())
+        if not key:
+            continue
+        if key in byKey:
+            if byKey[key] not in names:
+                names.append(byKey[key])
+        else:
+            unknown.append(item.strip())
+    return names, unknown
+
+
 # returns comma-separated list of dive site name in the given json dive site data
 def listDiveSites(sitesData: list[dict]) -> str:
     r = ""
@@ -180,6 +196,131 @@ def listDiveSites(sitesData: list[dict]) -> str:
     return r
 
 
+# Returns the names of the comma-delimited site names in the given text (see parseSiteNames). Exits listing the dive
+# sites if any of them is unknown.
+def parse_sites(text: str, sitesData: list[dict]) -> list[str]:
+    names, unknown = parseSiteNames(text, sitesData)
+    if unknown:
+        print('Unknown site {}, choose from: {}'.format(', '.join(unknown), listDiveSites(sitesData)))
+        exit(1)
+    return names
+
+
+# Returns the lowercase source labels in the given comma-delimited text, the form pickInterpreter takes
+def parseSources(text: str) -> list[str]:
+    return [s.strip().lower() for s in text.split(',') if s.strip()]
+
+
+# Adds the options the planning tools share to their argument parser, like profiling.add_arguments: --sources (parsed
+# with parseSources, the given comma-delimited labels by default) and --offline, and unless turned off -t (timeFilter),
+# -w and --fridays (days), --no-cache (noCache) and --no-calendar (calendar)
+def add_arguments(parser: argparse.ArgumentParser, sources: str = '', timeFilter: bool = True, days: bool = True,
+                  noCache: bool = True, calendar: bool = True,
+                  sourcesHelp: str = 'Comma-delimited sources in order of preference (e.g. "harmonic,noaa"), the '
+                                     'first source configured for each station is used by default') -> None:
+    parser.add_argument('--sources', default=sources, type=parseSources, help=sourcesHelp)
+    if timeFilter:
+        parser.add_argument('-t', '--time-filter', choices=['day', 'night', 'early_night', 'all'], default='day',
+                            dest='TIME_FILTER', help='Filter slacks by time of day')
+    if days:
+        parser.add_argument('-w', '--includeworkdays', action='store_true', default=False, dest='INCLUDE_WORKDAYS',
+                            help='Consider dives on any day, otherwise only weekends and holidays')
+        parser.add_argument('--fridays', action='store_true', default=False, dest='INCLUDE_FRIDAYS',
+                            help='Also consider Fridays when not including workdays')
+    parser.add_argument('--offline', action='store_true', default=False, dest='OFFLINE',
+                        help='Only use predictions already in the prediction cache (fill it with prefetch.py)')
+    if noCache:
+        parser.add_argument('--no-cache', action='store_true', default=False, dest='NO_CACHE',
+                            help='Always fetch from the sources, bypassing the prediction cache' +
+                                 (' and the calendar' if calendar else ''))
+    if calendar:
+        parser.add_argument('--no-calendar', action='store_true', default=False, dest='NO_CALENDAR',
+                            help='Evaluate every window instead of reading the materialised calendar (see '
+                                 'dive_calendar.py)')
+
+
+# Returns (station, [(interpreter, label)]) with every configured data source for the given site, or (None, []) if the
+# site's station is not found in the given json data. Tide-based sites use their tide station, current-based sites get
+# one interpreter per current source on their station. If a PredictionCache is given, each interpreter reads through
+# it (and never fetches if offline is set).
+def getInterpreters(siteData: dict, data: dict, cache=None, offline: bool = False) -> (dict, list):
+    if 'data_tides' in siteData:
+        # Tide-based site: look up station in tide_stations
+        station = getStation(data['tide_stations'], siteData['data_tides'])
+        if not station:
+            print(f"Error: No tide station found for site '{siteData['name']}' (data_tides='{siteData['data_tides']}')")
+            return None, []
+        interpreters = getTideStationInterpreters(station)
+    else:
+        # Current-based site: look up station in stations
+        station = getStation(data['stations'], siteData['data'])
+        if not station:
+            print(f"Error: No station found for site '{siteData['name']}'")
+            return None, []
+        interpreters = getStationInterpreters(station)
+
+    if cache is not None:
+        interpreters = [(prediction_cache.CachedInterpreter(m, label, station, cache, offline), label)
+                        for m, label in interpreters]
+    return station, interpreters
+
+
+# Returns (station list key, station name) of the station the given site's windows come from
+def stationKey(siteData: dict) -> (str, str):
+    if 'data_tides' in siteData:
+        return 'tide_stations', siteData['data_tides']
+    return 'stations', siteData['data']
+
+
+# Returns the (interpreter, label) of the first of the given lowercase source labels found in the given interpreters,
+# the first interpreter if no sources are given, or (None, None)
+def pickInterpreter(interpreters: list, sources: list[str]) -> tuple:
+    if not sources:
+        return interpreters[0] if interpreters else (None, None)
+    for source in sources:
+        for m, label in interpreters:
+            if label.lower() == source:
+                return m, label
+    return None, None
+
+
+# Returns [(interpreter, label)] for the given tide station
+def getTideStationInterpreters(station: dict) -> list:
+    interpreters = [(intp_tides.get_tide_interpreter(station), "Tide")]
+    # Offline harmonic prediction, only for stations with tide constants in harmonics.json (none ship)
+    if has_harmonic_constants(station, 'tide'):
+        interpreters.append((intp_tides.HarmonicTideInterpreter('', station), "Harmonic Tide"))
+    return interpreters
+
+
+# Returns [(interpreter, label)] for every source configured for the given current station
+def getStationInterpreters(station: dict) -> list:
+    interpreters = []
+    # Dairiki interpreter - works for both US and Canadian stations if configured
+    if 'url_dairiki' in station and station['url_dairiki']:
+        interpreters.append((intp.DairikiInterpreter(station['url_dairiki'], station), "Dairiki"))
+
+    # Canadian station: add Canada interpreters
+    if 'ca_code' in station and station['ca_code']:
+        # NOTE: for really good current days, the pdf may have a * for weak current instead of max/turn - then no output is provided!
+        interpreters.append((intp.CanadaPDFInterpreter(station['ca_code'], station), "Canada PDF"))
+        interpreters.append((intp.CanadaAPIInterpreter('', station), "Canada API"))
+    # US station: add XTide-based interpreter (only if not a Canadian station)
+    elif 'xtide_name' in station and station['xtide_name']:
+        interpreters.append((intp.XTideDockerInterpreter(station['name'], station), "XTide Docker"))
+    elif 'url_xtide_a' in station and station['url_xtide_a']:
+        interpreters.append((intp.TBoneSCInterpreter(station['url_xtide_a'], station), "XTide"))
+
+    # NOAA interpreter
+    if 'url_noaa_api' in station and station['url_noaa_api']:
+        interpreters.append((intp.NoaaAPIInterpreter(station['url_noaa_api'], station), "NOAA"))
+
+    # Offline harmonic prediction for stations with constants in harmonics.json
+    if intp.HarmonicInterpreter.hasConstants(station):
+        interpreters.append((intp.HarmonicInterpreter(station['name'], station), "Harmonic"))
+    return interpreters
+
+
 def main():
     # Dive site and current station data file
     data = json.loads(open(data_collect.absName('dive_sites.json')).read())
@@ -207,22 +348,19 @@ def main():
 
     parser.add_argument("--sites", default='', type=str, help="Comma-delimited list of dive sites from dive_sites.json "
                                                               "({})".format(listDiveSites(data['sites'])))
+    parser.add_argument('--offline', action='store_true', default=False, dest='OFFLINE',
+                        help='Only use predictions already in the prediction cache (fill it with prefetch.py)')
+    parser.add_argument('--no-cache', action='store_true', default=False, dest='NO_CACHE',
+                        help='Always fetch from the sources, bypassing the prediction cache')
+    parser.add_argument('--calendar', action='store_true', default=False, dest='CALENDAR',
+                        help='Read diveability from the materialised calendar, refreshing it first (see '
+                             'dive_calendar.py)')
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.start_from_args(args)
 
     # Parse site list - allow indeterminate whitespace and capitals
-    SITES = []
-    for item in args.sites.split(','):
-        if not item:
-            continue
-        words = item.split()
-        n = len(words)
-        if n == 1:
-            SITES.append(words[0].capitalize())
-        elif n > 1:
-            site = words[0].capitalize()
-            for i in range(1, n):
-                site += ' ' + words[i].capitalize()
-            SITES.append(site)
+    SITES, unknownSites = parseSiteNames(args.sites, data['sites'])
 
     # ---------------------------------- MANUALLY CONFIGURABLE PARAMETERS ---------------------------------------------
     if not SITES:
@@ -332,59 +470,27 @@ def main():
         print('No dive sites were specified')
         parser.print_help()
         exit(2)
-    for site in SITES:
+    for site in unknownSites + SITES:
         if not isDiveSite(site, data['sites']):
             print('{} is not a valid dive site'.format(site))
             parser.print_help()
             exit(3)
 
     # Get slacks/tide windows for each site and each day and print the data and splash times
+    cache = None if args.NO_CACHE else prediction_cache.PredictionCache()
+    calendar = None
+    if args.CALENDAR and not args.IGNORE_MAX_SPEED:
+        import dive_calendar  # imports this module, only load it when asked for
+        calendar = dive_calendar.CalendarStore()
     for i in range(len(data['sites'])):
         siteData = data['sites'][i]
         if SITES and siteData['name'] not in SITES:
             continue
 
-        # Determine if this is a tide-based or current-based site
-        is_tide_site = 'data_tides' in siteData
-
-        interpreters = []
-        if is_tide_site:
-            # Tide-based site: look up station in tide_stations
-            station = getStation(data['tide_stations'], siteData['data_tides'])
-            if not station:
-                print(f"Error: No tide station found for site '{siteData['name']}' (data_tides='{siteData['data_tides']}')")
-                continue
-            print(siteData['name'])
-
-            tide_interp = intp_tides.get_tide_interpreter(station)
-            interpreters.append((tide_interp, "Tide"))
-
-        else:
-            # Current-based site: look up station in stations (existing behavior)
-            station = getStation(data['stations'], siteData['data'])
-            if not station:
-                print(f"Error: No station found for site '{siteData['name']}'")
-                continue
-            print(siteData['name'])
-
-            # Dairiki interpreter - works for both US and Canadian stations if configured
-            if 'url_dairiki' in station and station['url_dairiki']:
-                interpreters.append((intp.DairikiInterpreter(station['url_dairiki'], station), "Dairiki"))
-
-            # Canadian station: add Canada interpreters
-            if 'ca_code' in station and station['ca_code']:
-                # NOTE: for really good current days, the pdf may have a * for weak current instead of max/turn - then no output is provided!
-                interpreters.append((intp.CanadaPDFInterpreter(station['ca_code'], station), "Canada PDF"))
-                interpreters.append((intp.CanadaAPIInterpreter('', station), "Canada API"))
-            # US station: add XTide-based interpreter (only if not a Canadian station)
-            elif 'xtide_name' in station and station['xtide_name']:
-                interpreters.append((intp.XTideDockerInterpreter(station['name'], station), "XTide Docker"))
-            elif 'url_xtide_a' in station and station['url_xtide_a']:
-                interpreters.append((intp.TBoneSCInterpreter(station['url_xtide_a'], station), "XTide"))
-
-            # NOAA interpreter
-            if 'url_noaa_api' in station and station['url_noaa_api']:
-                interpreters.append((intp.NoaaAPIInterpreter(station['url_noaa_api'], station), "NOAA"))
+        station, interpreters = getInterpreters(siteData, data, cache, args.OFFLINE)
+        if not station:
+            continue
+        print(siteData['name'])
 
         if not interpreters:
             print(f"Error: No interpreters could be configured for station '{station['name']}'")
@@ -398,12 +504,24 @@ def main():
                 if url:
                     print(url)
 
+        if calendar is not None:
+            for interpreter, label in interpreters:
+                calendar.refresh(siteData, data, interpreter, label, possibleDiveDays)
+
         for day in possibleDiveDays:
             canDive = False
             for interpreter, label in interpreters:
                 try:
-                    slacks = interpreter.getSlacks(day, args.TIME_FILTER)
-                    canDive |= printDiveDay(slacks, siteData, not args.IGNORE_NON_DIVEABLE, args.IGNORE_MAX_SPEED, label)
+                    if calendar is not None:
+                        # days the source returned nothing for during the refresh are not materialised
+                        rows = calendar.getDay(siteData['name'], label, day, args.TIME_FILTER) or []
+                        slacks = [r[0] for r in rows]
+                        verdicts = [(r[1], r[2]) for r in rows]
+                    else:
+                        slacks = interpreter.getSlacks(day, args.TIME_FILTER)
+                        verdicts = None
+                    canDive |= printDiveDay(slacks, siteData, not args.IGNORE_NON_DIVEABLE, args.IGNORE_MAX_SPEED, label,
+                                            verdicts)
                 except Exception as e:
                     print(f'Error fetching and reading slacks from {label}: ' + repr(e))
 
@@ -411,8 +529,14 @@ def main():
                 print('\tNot diveable on {}'.format(dt.strftime(day, intp.DATEFMT)))
 
         for interpreter, label in interpreters:
-            if hasattr(interpreter, 'numAPICalls') and interpreter.numAPICalls > 0:
+            if interpreter.numAPICalls > 0:
                 print(f'{label} API calls: {interpreter.numAPICalls}')
 
+    if cache is not None:
+        cache.flush()
+    if calendar is not None:
+        calendar.flush()
+    profiling.report_from_args(args)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,217 @@
+'''
+Plans multi-day expeditions to remote current sites like Browning Pass, Nakwakto, Weynton Pass and Seymour Narrows,
+where a trip runs over several consecutive days with boat or drive legs between the sites.
+
+For every start date in the season and every trip length, a search over the time ordered diveable windows of the
+candidate sites finds the best sequence of dives: the most sites covered, then the most dives, then the weakest
+current and the most daylight. A dive can follow another when its entry is at least the surface interval and the
+travel leg between the two sites after the other's exit, with at most --dives-per-day dives a day. The search is
+memoised on (last dive, sites covered, dives that day, trip end), which trips of different lengths ending on the
+same day share, and pruned by starting on the start day and never idling more than --max-idle-hours between dives
+beyond the travel leg.
+
+Slacks come from the Canada PDF tables by default (then Dairiki, the Canada API and harmonic predictions), read
+through the prediction cache and the diveability calendar (see dive_calendar.py), so a season prefetched with
+prefetch.py plans in seconds.
+
+Legs in minutes come from pairs under transfer_times in dive_sites.json, or a --legs file, in the same format as
+must_do_dives:
+    [{"name1": "Nakwakto", "name2": "Browning Pass", "minutes": 240}, ...]
+
+Examples:
+    python3 expedition_planner.py --sites "browning pass, nakwakto, weynton pass, whiskey point" \\
+        --season 2026-06-01:2026-09-30 --trip-days 4-6 --legs bc_legs.json
+'''
+
+import argparse
+import bisect
+import heapq
+import json
+from datetime import datetime as dt
+from datetime import timedelta as td
+from functools import lru_cache
+
+import data_collect
+import dive_calendar
+import dive_plan
+import prediction_cache
+from dive_itinerary import getTransferTimes
+from dive_plan import pickInterpreter, stationKey
+from interpreter_common import DATEFMT, TIMEFMT
+from must_do_dives import getDiveIntervals, getSite
+
+DEFAULT_SOURCES = ['Canada PDF', 'Dairiki', 'Canada API', 'Harmonic']
+
+
+def parseRange(text):
+    '''Returns (first, last) of "4-6", or (4, 4) for "4".'''
+    parts = [int(p) for p in text.split('-')]
+    return parts[0], parts[-1]
+
+
+def daylightHours(interval):
+    '''Returns the hours between the dive and the nearer of sunrise and sunset, negative if it is in the dark.'''
+    entryTime, exitTime, window, _ = interval
+    if not window.sunriseTime or not window.sunsetTime:
+        return 0.0
+    return min((entryTime - window.sunriseTime).total_seconds(), (window.sunsetTime - exitTime).total_seconds()) / 3600
+
+
+class Expeditions:
+    '''
+    Searches the best expedition for each start date and trip length over the diveable windows of the sites.
+
+    Args:
+        intervals: {site name: [(entryTime, exitTime, window, info)]} sorted by entry time.
+        leg: leg(name1, name2) returns the travel minutes between two sites, 0 for the same site.
+        surfaceInterval: Minimum minutes between the exit of one dive and the entry of the next.
+        divesPerDay: Most dives in a day.
+        daylightWeight: Knots of current strength one hour of daylight margin is worth.
+        maxIdleHours: Most hours between two dives beyond the travel leg.
+    '''
+
+    def __init__(self, intervals, leg, surfaceInterval=60, divesPerDay=2, daylightWeight=0.1, maxIdleHours=24):
+        self.names = list(intervals)
+        self.windows = sorted(((i[0], i[1], n, i) for n in self.names for i in intervals[n]), key=lambda w: w[0])
+        self.days = [w[0].toordinal() for w in self.windows]
+        self.leg = leg
+        self.surfaceInterval = surfaceInterval
+        self.divesPerDay = divesPerDay
+        self.maxIdle = td(hours=maxIdleHours)
+        # past the longest leg plus the idle limit no later window can follow a dive
+        longest = max([surfaceInterval] + [leg(a, b) for a in self.names for b in self.names])
+        self.searchLimit = self.maxIdle + td(minutes=longest)
+        # value of each dive, higher is better: weak current and a wide margin to dark
+        self.values = [-w[3][2].magnitude() + daylightWeight * daylightHours(w[3]) for w in self.windows]
+        self.best = lru_cache(maxsize=None)(self._best)
+
+    def _best(self, i, visited, divesToday, hi):
+        '''
+        Returns ((new sites, dives, value), [window indices]) of the best continuation after dive i among the windows
+        before index hi, where visited is the frozenset of sites covered so far including dive i.
+        '''
+        best = ((0, 0, 0.0), [])
+        entryI, exitI, nameI, _ = self.windows[i]
+        for j in range(i + 1, hi):
+            entryJ, _, nameJ, _ = self.windows[j]
+            gap = entryJ - exitI
+            minutes = max(self.surfaceInterval, self.leg(nameI, nameJ))
+            if gap > self.searchLimit:
+                break  # windows are in entry order, every later one idles longer
+            if gap < td(minutes=minutes) or gap > self.maxIdle + td(minutes=minutes):
+                continue
+            sameDay = self.days[j] == self.days[i]
+            if sameDay and divesToday >= self.divesPerDay:
+                continue
+            (newSites, dives, value), path = self.best(j, visited | {nameJ}, divesToday + 1 if sameDay else 1, hi)
+            score = (newSites + (nameJ not in visited), dives + 1, value + self.values[j])
+            if score > best[0]:
+                best = (score, [j] + path)
+        return best
+
+    def plan(self, start, tripDays):
+        '''Returns ((sites, dives, value), [intervals with site names]) of the best trip starting on the start day.'''
+        first = start.toordinal()
+        lo = bisect.bisect_left(self.days, first)
+        hi = bisect.bisect_left(self.days, first + tripDays)
+        best = None
+        for i in range(lo, hi):
+            if self.days[i] != first:
+                break
+            name = self.windows[i][2]
+            (newSites, dives, value), path = self.best(i, frozenset([name]), 1, hi)
+            score = (newSites + 1, dives + 1, value + self.values[i])
+            if best is None or score > best[0]:
+                best = (score, [i] + path)
+        if best is None:
+            return None, []
+        return best[0], [(self.windows[k][2], self.windows[k][3]) for k in best[1]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan the best multi-day expeditions to a set of current sites')
+    parser.add_argument('--sites', required=True, type=str, help='Comma-delimited candidate site names')
+    parser.add_argument('--season', required=True, type=str,
+                        help='First and last possible trip days in the format yyyy-mm-dd:yyyy-mm-dd')
+    parser.add_argument('--trip-days', default='4', type=str, help='Trip length in days, e.g. "5" or "4-6"')
+    parser.add_argument('--dives-per-day', default=2, type=int, help='Most dives in a day')
+    parser.add_argument('--surface-interval', default=60, type=int,
+                        help='Minimum minutes between the exit of one dive and the entry of the next')
+    parser.add_argument('--legs', default=None, type=str,
+                        help='JSON file of {name1, name2, minutes} travel legs, added to transfer_times in '
+                             'dive_sites.json')
+    parser.add_argument('--default-leg', default=120, type=int, help='Travel minutes between sites without a leg')
+    parser.add_argument('--daylight-weight', default=0.1, type=float,
+                        help='Knots of current strength that one hour of margin to sunrise/sunset is worth')
+    parser.add_argument('--max-idle-hours', default=24, type=float,
+                        help='Most hours between two dives beyond the travel leg')
+    parser.add_argument('--top', default=10, type=int, help='Number of expeditions to print')
+    dive_plan.add_arguments(parser, sources=','.join(DEFAULT_SOURCES), days=False,
+                            sourcesHelp='Comma-delimited sources in order of preference')
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    siteNames = dive_plan.parse_sites(args.sites, data['sites'])
+    seasonStart, seasonEnd = [dt.strptime(d, '%Y-%m-%d') for d in args.season.split(':')]
+    shortest, longest = parseRange(args.trip_days)
+
+    pairs = data.get('transfer_times', [])
+    if args.legs:
+        pairs = pairs + json.loads(open(args.legs).read())
+    legs = getTransferTimes(pairs)
+
+    def leg(name1, name2):
+        if name1 == name2:
+            return 0
+        return legs.get((name1, name2), args.default_leg)
+
+    # Diveable windows of each site over the season, sites on the same station share an interpreter
+    days = dive_plan.getAllDays((seasonEnd - seasonStart).days, seasonStart)
+    cache = None if args.NO_CACHE else prediction_cache.PredictionCache()
+    calendar = None if args.NO_CACHE or args.NO_CALENDAR else dive_calendar.CalendarStore()
+    interpreters = {}
+    intervals = {}
+    for name in siteNames:
+        site = getSite(data['sites'], name)
+        key = stationKey(site)
+        if key not in interpreters:
+            _, choices = dive_plan.getInterpreters(site, data, cache, args.OFFLINE)
+            interpreters[key] = pickInterpreter(choices, args.sources)
+        m, label = interpreters[key]
+        if m and calendar:
+            calendar.refresh(site, data, m, label, days)
+            intervals[name] = calendar.getDiveIntervals(name, label, days, args.TIME_FILTER)
+        else:
+            intervals[name] = getDiveIntervals(site, m, days, args.TIME_FILTER) if m else []
+        print('{}: {} diveable windows ({})'.format(name, len(intervals[name]), label))
+    if cache:
+        cache.flush()
+    if calendar:
+        calendar.flush()
+
+    expeditions = Expeditions(intervals, leg, args.surface_interval, args.dives_per_day, args.daylight_weight,
+                              args.max_idle_hours)
+    plans = []
+    for start in days:
+        for tripDays in range(shortest, longest + 1):
+            if start + td(days=tripDays - 1) > seasonEnd:
+                continue
+            score, itinerary = expeditions.plan(start, tripDays)
+            if score:
+                plans.append((score, -tripDays, start, itinerary))
+    print('Searched {} start dates and trip lengths, {} memoised states'.format(
+        len(days) * (longest - shortest + 1), expeditions.best.cache_info().currsize))
+
+    for score, negDays, start, itinerary in heapq.nlargest(args.top, plans, key=lambda p: p[:2]):
+        sites, dives, value = score
+        print()
+        print('{} for {} days: {} sites, {} dives, value {:0.1f}'.format(dt.strftime(start, DATEFMT), -negDays, sites,
+                                                                        dives, value))
+        for name, (entryTime, exitTime, window, _) in itinerary:
+            print('\t{}: {:<24} {}-{}\t{}'.format(dt.strftime(entryTime, DATEFMT), name,
+                                                  dt.strftime(entryTime, TIMEFMT), dt.strftime(exitTime, TIMEFMT),
+                                                  window))
+
+
+if __name__ == '__main__':
+    main()
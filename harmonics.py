@@ -0,0 +1,613 @@
+'''
+Offline harmonic tide and current prediction, vectorised with NumPy.
+
+A station is a set of harmonic constituents (amplitude and Greenwich phase, the same constants XTide and NOAA
+predict from) plus a datum. The prediction at UTC time t is
+
+    datum + sum of f * amplitude * cos(V0 + u - phase)
+
+over the constituents, with the equilibrium arguments V0 from the mean longitudes of the moon and sun and the
+nodal corrections f, u from the longitude of the moon's node (Schureman, Manual of Harmonic Analysis and Prediction
+of Tides). Hydraulic current stations (e.g. Deception Pass type narrows) predict the signed square root of the sum,
+like XTide does.
+
+Constants are loaded from harmonics.json. Stations are added to it either by fitting constituents to the XTide
+predictions saved in xtide-offline/ (the harmonics XTide itself uses are in a binary TCD file) or by importing a
+NOAA harcon.json export:
+
+    python3 harmonics.py --fit-offline "hale passage"
+    python3 harmonics.py --import-noaa harcon.json --name "Seattle, Puget Sound, Washington" --kind tide --datum 6.58
+    python3 harmonics.py --fit-noaa-hilo hilo-2020-2029.json --name "Bowman Bay"
+    python3 harmonics.py --check "hale passage"
+
+Fitting to an xtide-offline file holds out its last HOLDOUT_YEARS: the constants are fit to the years before and
+checked against the held-out years only, so the stored check is out of sample. The check result and the span of the
+file (the valid range) are stored with the constants. dive_plan.py only offers the Harmonic source for stations
+whose check is within the limits in interpreter_common (slack p95 error and spurious or missed events), so poor fits
+such as XTide subordinate stations stay out of the plans until refit, and HarmonicInterpreter warns when asked for
+days outside the valid range.
+'''
+
+import argparse
+import json
+import os
+import re
+from datetime import datetime as dt
+from datetime import timedelta as td
+from functools import lru_cache
+
+import numpy as np
+import pytz
+
+import data_collect
+from interpreter_common import harmonic_check_passes
+
+HARMONICS_FILE = 'harmonics.json'
+HARMONICS_VERSION = 1
+DEFAULT_TIMEZONE = 'US/Pacific'
+HOLDOUT_YEARS = 2  # years at the end of an xtide-offline file kept out of the fit and checked against
+
+EPOCH = dt(2000, 1, 1, 12)  # J2000, times are passed around as float hours since this UTC instant
+HOURS_PER_CENTURY = 36525 * 24
+
+# Mean longitudes in degrees as (value at J2000, degrees per Julian century)
+_MOON = (218.3164477, 481267.88123421)       # s
+_SUN = (280.46646, 36000.76983)              # h
+_LUNAR_PERIGEE = (83.3532465, 4069.0137287)  # p
+_LUNAR_NODE = (125.04452, -1934.136261)      # N
+_SOLAR_PERIGEE = (282.93735, 1.71946)        # p1
+
+# name: ((T, s, h, p, p1) multipliers of the equilibrium argument V0, constant degrees, node factor)
+# T is the hour angle of the mean sun. The node factor names the rule in _node_factors.
+CONSTITUENTS = {
+    'M2': ((2, -2, 2, 0, 0), 0, 'M2'),
+    'S2': ((2, 0, 0, 0, 0), 0, None),
+    'N2': ((2, -3, 2, 1, 0), 0, 'M2'),
+    'K1': ((1, 0, 1, 0, 0), 90, 'K1'),
+    'M4': ((4, -4, 4, 0, 0), 0, 'M2^2'),
+    'O1': ((1, -2, 1, 0, 0), 270, 'O1'),
+    'M6': ((6, -6, 6, 0, 0), 0, 'M2^3'),
+    'MK3': ((3, -2, 3, 0, 0), 90, 'M2*K1'),
+    'S4': ((4, 0, 0, 0, 0), 0, None),
+    'MN4': ((4, -5, 4, 1, 0), 0, 'M2^2'),
+    'NU2': ((2, -3, 4, -1, 0), 0, 'M2'),
+    'S6': ((6, 0, 0, 0, 0), 0, None),
+    'MU2': ((2, -4, 4, 0, 0), 0, 'M2'),
+    '2N2': ((2, -4, 2, 2, 0), 0, 'M2'),
+    'OO1': ((1, 2, 1, 0, 0), 90, 'OO1'),
+    'LAM2': ((2, -1, 0, 1, 0), 180, 'M2'),
+    'S1': ((1, 0, 0, 0, 0), 180, None),
+    'M1': ((1, -1, 1, 0, 0), 90, 'O1'),
+    'J1': ((1, 1, 1, -1, 0), 90, 'J1'),
+    'MM': ((0, 1, 0, -1, 0), 0, 'Mm'),
+    'SSA': ((0, 0, 2, 0, 0), 0, None),
+    'SA': ((0, 0, 1, 0, 0), 0, None),
+    'MSF': ((0, 2, -2, 0, 0), 0, 'M2'),
+    'MF': ((0, 2, 0, 0, 0), 0, 'Mf'),
+    'RHO': ((1, -3, 3, -1, 0), 270, 'O1'),
+    'Q1': ((1, -3, 1, 1, 0), 270, 'O1'),
+    'T2': ((2, 0, -1, 0, 1), 0, None),
+    'R2': ((2, 0, 1, 0, -1), 180, None),
+    '2Q1': ((1, -4, 1, 2, 0), 270, 'O1'),
+    'P1': ((1, 0, -1, 0, 0), 270, None),
+    '2SM2': ((2, 2, -2, 0, 0), 0, 'M2'),
+    'M3': ((3, -3, 3, 0, 0), 180, 'M2^1.5'),
+    'L2': ((2, -1, 2, -1, 0), 180, 'M2'),
+    '2MK3': ((3, -4, 3, 0, 0), 270, 'M2^2/K1'),
+    'K2': ((2, 0, 2, 0, 0), 0, 'K2'),
+    'M8': ((8, -8, 8, 0, 0), 0, 'M2^4'),
+    'MS4': ((4, -2, 2, 0, 0), 0, 'M2'),
+}
+
+# Rates of change in degrees per hour of T, s, h, p and p1
+_RATES = np.array([15.0, _MOON[1] / HOURS_PER_CENTURY, _SUN[1] / HOURS_PER_CENTURY,
+                   _LUNAR_PERIGEE[1] / HOURS_PER_CENTURY, _SOLAR_PERIGEE[1] / HOURS_PER_CENTURY])
+
+
+def speed(name: str) -> float:
+    '''Returns the speed of the constituent in degrees per hour.'''
+    return float(np.dot(CONSTITUENTS[name][0], _RATES))
+
+
+# ----------------------------------------- time conversion ----------------------------------------------------------
+def to_hours(times, timezone: str = DEFAULT_TIMEZONE) -> np.ndarray:
+    '''Returns hours since J2000 UTC for a datetime or list of datetimes. Naive datetimes are local to timezone.'''
+    if isinstance(times, dt):
+        times = [times]
+    tz = pytz.timezone(timezone)
+    utc = [(t if t.tzinfo else tz.localize(t)).astimezone(pytz.utc).replace(tzinfo=None) for t in times]
+    return np.array([(t - EPOCH).total_seconds() / 3600 for t in utc])
+
+
+def from_hours(hours, timezone: str = DEFAULT_TIMEZONE) -> list[dt]:
+    '''Returns naive local datetimes, rounded to the second, for hours since J2000 UTC.'''
+    tz = pytz.timezone(timezone)
+    result = []
+    for h in np.asarray(hours, dtype=float):
+        t = pytz.utc.localize(EPOCH + td(seconds=round(float(h) * 3600)))
+        result.append(t.astimezone(tz).replace(tzinfo=None))
+    return result
+
+
+# ----------------------------------------- astronomy ----------------------------------------------------------------
+def _astro(hours: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Returns the (n, 5) degrees of T, s, h, p, p1 and the (n,) node longitude N at the given hours.'''
+    centuries = hours / HOURS_PER_CENTURY
+    s = _MOON[0] + _MOON[1] * centuries
+    h = _SUN[0] + _SUN[1] * centuries
+    p = _LUNAR_PERIGEE[0] + _LUNAR_PERIGEE[1] * centuries
+    p1 = _SOLAR_PERIGEE[0] + _SOLAR_PERIGEE[1] * centuries
+    T = 15.0 * hours  # hour angle of the mean sun, 0 at noon UTC (EPOCH is at noon)
+    return np.stack([T, s, h, p, p1], axis=-1), _LUNAR_NODE[0] + _LUNAR_NODE[1] * centuries
+
+
+def _node_factors(rule, N: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Returns the nodal amplitude factor f and phase correction u (degrees) for a node factor rule.'''
+    if rule is None:
+        return np.ones_like(N), np.zeros_like(N)
+    n = np.radians(N)
+    if rule == 'M2':
+        return (1.0004 - 0.0373 * np.cos(n) + 0.0002 * np.cos(2 * n),
+                -2.14 * np.sin(n))
+    if rule == 'K1':
+        return (1.0060 + 0.1150 * np.cos(n) - 0.0088 * np.cos(2 * n) + 0.0006 * np.cos(3 * n),
+                -8.86 * np.sin(n) + 0.68 * np.sin(2 * n) - 0.07 * np.sin(3 * n))
+    if rule == 'O1':
+        return (1.0089 + 0.1871 * np.cos(n) - 0.0147 * np.cos(2 * n) + 0.0014 * np.cos(3 * n),
+                10.80 * np.sin(n) - 1.34 * np.sin(2 * n) + 0.19 * np.sin(3 * n))
+    if rule == 'K2':
+        return (1.0241 + 0.2863 * np.cos(n) + 0.0083 * np.cos(2 * n) - 0.0015 * np.cos(3 * n),
+                -17.74 * np.sin(n) + 0.68 * np.sin(2 * n) - 0.04 * np.sin(3 * n))
+    if rule == 'J1':
+        return (1.0129 + 0.1676 * np.cos(n) - 0.0170 * np.cos(2 * n) + 0.0016 * np.cos(3 * n),
+                -12.94 * np.sin(n) + 1.34 * np.sin(2 * n) - 0.19 * np.sin(3 * n))
+    if rule == 'OO1':
+        return (1.1027 + 0.6504 * np.cos(n) + 0.0317 * np.cos(2 * n) - 0.0014 * np.cos(3 * n),
+                -36.68 * np.sin(n) + 4.02 * np.sin(2 * n) - 0.57 * np.sin(3 * n))
+    if rule == 'Mf':
+        return (1.043 + 0.414 * np.cos(n),
+                -23.74 * np.sin(n) + 2.68 * np.sin(2 * n) - 0.38 * np.sin(3 * n))
+    if rule == 'Mm':
+        return 1.0 - 0.130 * np.cos(n), np.zeros_like(N)
+    # compound constituents
+    fm2, um2 = _node_factors('M2', N)
+    if rule == 'M2^1.5':
+        return fm2 ** 1.5, 1.5 * um2
+    if rule == 'M2^2':
+        return fm2 ** 2, 2 * um2
+    if rule == 'M2^3':
+        return fm2 ** 3, 3 * um2
+    if rule == 'M2^4':
+        return fm2 ** 4, 4 * um2
+    fk1, uk1 = _node_factors('K1', N)
+    if rule == 'M2*K1':
+        return fm2 * fk1, um2 + uk1
+    if rule == 'M2^2/K1':
+        return fm2 ** 2 * fk1, 2 * um2 - uk1
+    raise ValueError('Unknown node factor rule ' + rule)
+
+
+@lru_cache(maxsize=None)
+def _constituent_arrays(names: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray, tuple]:
+    '''Returns the (k, 5) V0 multipliers, (k,) constant degrees, (k,) speeds in radians/hour and rules for names.'''
+    multipliers = np.array([CONSTITUENTS[n][0] for n in names], dtype=float).reshape(len(names), 5)
+    offsets = np.array([CONSTITUENTS[n][1] for n in names], dtype=float)
+    return multipliers, offsets, np.radians(multipliers @ _RATES), tuple(CONSTITUENTS[n][2] for n in names)
+
+
+def _arguments(names: tuple, hours: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Returns the (n, k) nodal factors f and arguments V0 + u in radians of the constituents at the given hours.'''
+    multipliers, offsets, _, rules = _constituent_arrays(names)
+    astro, _ = _astro(hours)
+    # The node factors follow the 18.6 year nodal cycle, once per day (at noon) is exact to well under 0.01 degrees
+    days = np.floor(hours / 24)
+    firstDay = days.min() if len(days) else 0.0
+    dayIndex = (days - firstDay).astype(np.int64)
+    _, N = _astro(firstDay * 24 + 12 + 24 * np.arange(dayIndex.max() + 1 if len(days) else 0))
+    f = np.empty((len(N), len(names)))
+    u = np.empty((len(N), len(names)))
+    byRule = {}
+    for i, rule in enumerate(rules):
+        if rule not in byRule:
+            byRule[rule] = _node_factors(rule, N)
+        f[:, i], u[:, i] = byRule[rule]
+    return f[dayIndex], np.radians(astro @ multipliers.T + offsets + u[dayIndex])
+
+
+# ----------------------------------------- stations -----------------------------------------------------------------
+class HarmonicStation:
+    '''
+    Harmonic constants of one tide or current station.
+
+    Args:
+        name: Station name as in dive_sites.json.
+        constituents: {constituent name: (amplitude, Greenwich phase in degrees)}.
+        datum: Constant added to the sum, e.g. mean sea level above chart datum for tides.
+        kind: 'current' (knots, flood positive) or 'tide' (height).
+        hydraulic: Predict the signed square root of the sum, for XTide's hydraulic current stations.
+        timezone: Timezone of the naive local datetimes passed in and returned.
+        check: The last check_offline result of a station fit to XTide predictions, see
+            interpreter_common.harmonic_check_passes.
+        valid: (first, last) 'yyyy-mm-dd' days of the XTide predictions the station was fit and checked against.
+    '''
+
+    def __init__(self, name: str, constituents: dict, datum: float = 0.0, kind: str = 'current',
+                 hydraulic: bool = False, timezone: str = DEFAULT_TIMEZONE, units: str = None,
+                 source: str = None, check: dict = None, valid: tuple = None) -> None:
+        unknown = [c for c in constituents if c not in CONSTITUENTS]
+        if unknown:
+            raise ValueError('Unknown constituents for {}: {}'.format(name, unknown))
+        self.name = name
+        self.names = tuple(constituents)
+        self.amplitudes = np.array([constituents[c][0] for c in self.names], dtype=float)
+        self.phases = np.radians([constituents[c][1] for c in self.names])
+        self.datum = datum
+        self.kind = kind
+        self.hydraulic = hydraulic
+        self.timezone = timezone
+        self.units = units or ('knots' if kind == 'current' else 'feet')
+        self.source = source
+        self.check = check
+        self.valid = tuple(valid) if valid else None
+
+    def to_dict(self) -> dict:
+        d = {'kind': self.kind, 'units': self.units, 'hydraulic': self.hydraulic, 'timezone': self.timezone,
+             'datum': round(self.datum, 6), 'source': self.source}
+        if self.check:
+            d['check'] = self.check
+        if self.valid:
+            d['valid'] = list(self.valid)
+        d['constituents'] = {c: [round(float(a), 6), round(float(np.degrees(p)) % 360, 4)]
+                             for c, a, p in zip(self.names, self.amplitudes, self.phases)}
+        return d
+
+    @classmethod
+    def from_dict(cls, name: str, d: dict) -> 'HarmonicStation':
+        return cls(name, {c: tuple(v) for c, v in d['constituents'].items()}, d.get('datum', 0.0),
+                   d.get('kind', 'current'), d.get('hydraulic', False), d.get('timezone', DEFAULT_TIMEZONE),
+                   d.get('units'), d.get('source'), d.get('check'), d.get('valid'))
+
+    def _sums(self, hours: np.ndarray, derivatives: tuple = (0,)) -> list[np.ndarray]:
+        '''Returns the harmonic sum (0) and its first (1) and second (2) time derivatives per hour, as requested.'''
+        # Evaluated in chunks to bound the (n, constituents) temporaries on multi-decade grids
+        _, _, speeds, _ = _constituent_arrays(self.names)
+        results = [np.empty(len(hours)) for _ in derivatives]
+        for lo in range(0, len(hours), 200_000):
+            chunk = hours[lo:lo + 200_000]
+            f, arg = _arguments(self.names, chunk)
+            arg -= self.phases
+            fcos = fsin = None
+            for result, d in zip(results, derivatives):
+                if d % 2 == 0 and fcos is None:
+                    fcos = f * np.cos(arg)
+                elif d % 2 == 1 and fsin is None:
+                    fsin = f * np.sin(arg)
+                if d == 0:
+                    result[lo:lo + len(chunk)] = self.datum + fcos @ self.amplitudes
+                elif d == 1:
+                    result[lo:lo + len(chunk)] = -fsin @ (self.amplitudes * speeds)
+                else:
+                    result[lo:lo + len(chunk)] = -fcos @ (self.amplitudes * speeds ** 2)
+        return results
+
+    def predict_hours(self, hours) -> np.ndarray:
+        '''Returns the speed or height at the given hours since J2000 UTC.'''
+        raw, = self._sums(np.atleast_1d(np.asarray(hours, dtype=float)))
+        return np.sign(raw) * np.sqrt(np.abs(raw)) if self.hydraulic else raw
+
+    def predict(self, times) -> np.ndarray:
+        '''Returns the speed or height at the given naive local datetimes.'''
+        return self.predict_hours(to_hours(times, self.timezone))
+
+    def events_hours(self, start_hours: float, end_hours: float, step_minutes: float = 10.0) -> tuple:
+        '''
+        Returns (hours, kinds, values) arrays of the events in [start_hours, end_hours), in time order.
+
+        Currents have the XTide event kinds 'slack_flood', 'slack_ebb', 'max_flood', 'max_ebb', 'min_flood' and
+        'min_ebb', tides have 'high' and 'low'. Events are bracketed on a grid of step_minutes and refined by
+        Newton's method to well under a second, so the grid only has to be finer than the closest pair of events.
+        '''
+        step = step_minutes / 60
+        grid = np.arange(start_hours, end_hours + step, step)
+        value, = self._sums(grid)
+
+        times, kinds, values = [], [], []
+        # extrema: the differences between grid points change sign, the slope is only evaluated at the brackets
+        change = np.signbit(np.diff(value))
+        i = np.nonzero(change[:-1] != change[1:])[0]
+        lo, hi = grid[i], grid[i + 2]
+        slopeLo, slopeHi = np.split(self._sums(np.concatenate([lo, hi]), (1,))[0], 2)
+        t = self._refine(lo, hi, slopeLo, slopeHi, 1)
+        v, = self._sums(t)
+        rising = ~change[i]  # rises then falls: a maximum of the sum
+        if self.kind == 'tide':
+            k = np.where(rising, 'high', 'low')
+        else:
+            k = np.where(v >= 0, np.where(rising, 'max_flood', 'min_flood'), np.where(rising, 'min_ebb', 'max_ebb'))
+        times.append(t)
+        kinds.append(k)
+        values.append(v)
+        if self.kind == 'current':
+            # slacks: the current changes sign
+            i = np.nonzero(np.signbit(value[:-1]) != np.signbit(value[1:]))[0]
+            times.append(self._refine(grid[i], grid[i + 1], value[i], value[i + 1], 0))
+            kinds.append(np.where(np.signbit(value[i]), 'slack_flood', 'slack_ebb'))
+            values.append(np.zeros(len(i)))
+
+        t, k, v = np.concatenate(times), np.concatenate(kinds), np.concatenate(values)
+        keep = (t >= start_hours) & (t < end_hours)
+        t, k, v = t[keep], k[keep], v[keep]
+        order = np.argsort(t, kind='stable')
+        t, k, v = t[order], k[order], v[order]
+        if self.kind == 'current':
+            # min ebb/flood that dip across zero are reported as slacks, like XTide
+            keep = ~(np.isin(k, ('min_ebb', 'min_flood')) & (v == 0))
+            t, k, v = t[keep], k[keep], v[keep]
+        if self.hydraulic:
+            v = np.sign(v) * np.sqrt(np.abs(v))
+        return t, k, v
+
+    def events(self, start: dt, end: dt, step_minutes: float = 10.0) -> list[tuple]:
+        '''Returns [(naive local time, kind, speed or height)] for the events from start to end (local times).'''
+        startHours, endHours = to_hours([start, end], self.timezone)
+        t, k, v = self.events_hours(startHours, endHours, step_minutes)
+        return list(zip(from_hours(t, self.timezone), k.tolist(), v.tolist()))
+
+    def _refine(self, lo: np.ndarray, hi: np.ndarray, at_lo: np.ndarray, at_hi: np.ndarray, derivative: int,
+                iterations: int = 3) -> np.ndarray:
+        # Roots of the sum (derivative 0) or its slope (derivative 1) in brackets [lo, hi] where it changes sign.
+        # Starts from linear interpolation and takes Newton steps kept inside the bracket, each step squares the
+        # error so 3 steps from a 10 minute bracket are far below a second.
+        t = lo + (hi - lo) * at_lo / np.where(at_lo == at_hi, 1.0, at_lo - at_hi)
+        for _ in range(iterations):
+            y, dy = self._sums(t, (derivative, derivative + 1))
+            t = np.clip(t - y / np.where(dy == 0, np.inf, dy), lo, hi)
+        return t
+
+
+# ----------------------------------------- constants file -----------------------------------------------------------
+def _read_file(path: str) -> dict:
+    if not os.path.exists(path):
+        return {'version': HARMONICS_VERSION, 'stations': {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def load_stations(path: str = None) -> dict[str, HarmonicStation]:
+    '''Returns {station name: HarmonicStation} from the constants file, empty if the file doesn't exist.'''
+    contents = _read_file(path or data_collect.absName(HARMONICS_FILE))
+    return {name: HarmonicStation.from_dict(name, d) for name, d in contents['stations'].items()}
+
+
+def get_station(name: str, path: str = None) -> HarmonicStation:
+    '''Returns the HarmonicStation for the station name, or None if there are no constants for it.'''
+    return load_stations(path).get(name)
+
+
+def save_station(station: HarmonicStation, path: str = None) -> None:
+    '''Adds or replaces the station in the constants file.'''
+    path = path or data_collect.absName(HARMONICS_FILE)
+    contents = _read_file(path)
+    contents['version'] = HARMONICS_VERSION
+    contents['stations'][station.name] = station.to_dict()
+    contents['stations'] = dict(sorted(contents['stations'].items()))
+    with open(path, 'w') as f:
+        json.dump(contents, f, indent=1)
+        f.write('\n')
+    load_stations.cache_clear()
+
+
+def read_noaa_harcon(path: str, name: str, kind: str, datum: float = 0.0, hydraulic: bool = False,
+                     timezone: str = DEFAULT_TIMEZONE) -> HarmonicStation:
+    '''
+    Returns the station for a NOAA CO-OPS harcon.json export (mdapi .../stations/<id>/harcon.json). Tide stations
+    list amplitude and phase_GMT, current stations majorAmplitude and majorPhaseGMT along the flood direction.
+    NOAA's harmonic constants are relative to mean sea level, pass the datum to predict above chart datum.
+    '''
+    with open(path, 'r') as f:
+        contents = json.load(f)
+    constituents = {}
+    for c in contents['HarmonicConstituents']:
+        cname = c['name'].upper().replace('RHO1', 'RHO')
+        if cname not in CONSTITUENTS:
+            print('Skipping constituent {} not known to harmonics.py'.format(c['name']))
+            continue
+        if 'majorAmplitude' in c:
+            constituents[cname] = (c['majorAmplitude'], c['majorPhaseGMT'])
+        else:
+            constituents[cname] = (c['amplitude'], c['phase_GMT'])
+    return HarmonicStation(name, constituents, datum, kind, hydraulic, timezone, source='NOAA harcon ' + path)
+
+
+# ----------------------------------------- fitting to saved predictions ---------------------------------------------
+def _design(names: tuple, hours: np.ndarray, derivative: bool = False) -> np.ndarray:
+    # Least squares columns f*cos(V0+u), f*sin(V0+u) per constituent: a*cos + b*sin = A*cos(V0+u - phase)
+    _, _, speeds, _ = _constituent_arrays(names)
+    f, arg = _arguments(names, hours)
+    if derivative:
+        return np.hstack([-f * np.sin(arg) * speeds, f * np.cos(arg) * speeds])
+    return np.hstack([f * np.cos(arg), f * np.sin(arg)])
+
+
+def fit_events(name: str, hours: np.ndarray, kinds: list[str], values: np.ndarray, kind: str = 'current',
+               hydraulic: bool = False, names: tuple = tuple(CONSTITUENTS), timezone: str = DEFAULT_TIMEZONE,
+               source: str = None) -> HarmonicStation:
+    '''
+    Returns the station whose constituents best reproduce the given events by least squares: the predicted value
+    at each event (zero at slacks) and a zero slope at each max/min or high/low.
+    '''
+    values = np.asarray(values, dtype=float)
+    if hydraulic:
+        values = values * np.abs(values)  # hydraulic stations are harmonic in speed squared
+    extrema = np.array([not k.startswith('slack') for k in kinds])  # max/min currents, high and low tides
+    a = _design(names, hours)
+    b = _design(names, hours[extrema], derivative=True)
+    k = len(names)
+    rows = np.vstack([np.hstack([a, np.ones((len(a), 1))]), np.hstack([b, np.zeros((len(b), 1))])])
+    rhs = np.concatenate([values, np.zeros(len(b))])
+    solution, *_ = np.linalg.lstsq(rows, rhs, rcond=None)
+    cosine, sine, datum = solution[:k], solution[k:2 * k], solution[-1]
+    constituents = {n: (float(np.hypot(c, s)), float(np.degrees(np.arctan2(s, c))) % 360)
+                    for n, c, s in zip(names, cosine, sine)}
+    return HarmonicStation(name, constituents, float(datum), kind, hydraulic, timezone, source=source)
+
+
+_OFFLINE_LINE = re.compile(r'^(\d{4}-\d\d-\d\d)\s+(\d\d:\d\d)\s+(\w+)\s+(-?[\d.]+)\s+knots\s+(.*)$')
+_OFFLINE_KINDS = {'max flood': 'max_flood', 'max ebb': 'max_ebb', 'slack, flood begins': 'slack_flood',
+                  'slack, ebb begins': 'slack_ebb', 'min flood': 'min_flood', 'min ebb': 'min_ebb'}
+_UTC_OFFSETS = {'pst': 8, 'pdt': 7, 'hst': 10, 'akst': 9, 'akdt': 8}
+
+
+def read_offline_events(path: str) -> tuple[np.ndarray, list[str], np.ndarray]:
+    '''Returns (hours since J2000 UTC, kinds, speeds) of the current events in an xtide-offline file.'''
+    hours, kinds, values = [], [], []
+    with open(path, 'r') as f:
+        for line in f:
+            m = _OFFLINE_LINE.match(line.strip())
+            if not m or m.group(5) not in _OFFLINE_KINDS:
+                continue
+            local = dt.strptime(m.group(1) + ' ' + m.group(2), '%Y-%m-%d %H:%M')
+            utc = local + td(hours=_UTC_OFFSETS[m.group(3).lower()])
+            hours.append((utc - EPOCH).total_seconds() / 3600)
+            kinds.append(_OFFLINE_KINDS[m.group(5)])
+            values.append(0.0 if kinds[-1].startswith('slack') else float(m.group(4)))
+    return np.array(hours), kinds, np.array(values)
+
+
+def read_noaa_hilo(path: str, timezone: str = DEFAULT_TIMEZONE) -> tuple[np.ndarray, list[str], np.ndarray]:
+    '''
+    Returns (hours since J2000 UTC, kinds, heights) of the highs and lows in a NOAA datagetter
+    product=predictions&interval=hilo json response (local times with time_zone=lst_ldt, up to 10 years per request).
+    '''
+    with open(path, 'r') as f:
+        predictions = json.load(f)['predictions']
+    times = [dt.strptime(p['t'], '%Y-%m-%d %H:%M') for p in predictions]
+    kinds = ['high' if p['type'] == 'H' else 'low' for p in predictions]
+    return to_hours(times, timezone), kinds, np.array([float(p['v']) for p in predictions])
+
+
+def _offline_stations(filters: list[str]) -> list[dict]:
+    import xtide_saver
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    stations = []
+    for station in data['stations']:
+        if filters and not any(f in station['name'].lower() for f in filters):
+            continue
+        path = data_collect.absName(xtide_saver.getFileName(station['name']))
+        if os.path.exists(path) and all(s['name'] != station['name'] for s in stations):
+            stations.append(dict(station, offlineFile=path))
+    return stations
+
+
+def holdout_start(hours: np.ndarray) -> float:
+    '''Returns the first hour of the last HOLDOUT_YEARS of the given event hours, the span kept out of fits.'''
+    return hours[-1] - HOLDOUT_YEARS * 365.25 * 24
+
+
+def check_offline(station: HarmonicStation, path: str) -> dict:
+    '''
+    Returns how far the station's slacks and max currents are from the XTide predictions in the last HOLDOUT_YEARS of
+    the offline file, the span fit_offline leaves out.
+    '''
+    hours, kinds, values = read_offline_events(path)
+    held = hours >= holdout_start(hours)
+    hours, values, kinds = hours[held], values[held], [k for k, h in zip(kinds, held) if h]
+    t, k, v = station.events_hours(hours[0], hours[-1])
+    first, last = from_hours([hours[0], hours[-1]], station.timezone)
+    result = {'from': str(first.date()), 'to': str(last.date())}
+    for label, selected in (('slack', ('slack_flood', 'slack_ebb')), ('max', ('max_flood', 'max_ebb'))):
+        ours = np.isin(k, selected)
+        theirs = np.isin(kinds, selected)
+        ourTimes, ourValues = t[ours], v[ours]
+        j = np.clip(np.searchsorted(ourTimes, hours[theirs]), 1, len(ourTimes) - 1)
+        nearest = np.where(np.abs(ourTimes[j] - hours[theirs]) < np.abs(ourTimes[j - 1] - hours[theirs]), j, j - 1)
+        minutes = np.abs(ourTimes[nearest] - hours[theirs]) * 60
+        result[label] = {'events': int(theirs.sum()), 'predicted': int(ours.sum()),
+                         'median_minutes': round(float(np.median(minutes)), 2),
+                         'p95_minutes': round(float(np.percentile(minutes, 95)), 2)}
+        if label == 'max':
+            result[label]['median_knots'] = round(float(np.median(np.abs(ourValues[nearest] - values[theirs]))), 3)
+    return result
+
+
+def fit_offline(name: str, path: str, hydraulic: bool = False) -> HarmonicStation:
+    '''
+    Returns the station fit to the XTide predictions in the offline file, except its last HOLDOUT_YEARS, with the
+    check against those years and the span of the file as its valid range.
+    '''
+    hours, kinds, values = read_offline_events(path)
+    fit = hours < holdout_start(hours)
+    first, fitLast, last = from_hours([hours[0], hours[fit][-1], hours[-1]])
+    source = 'fit to {} {} to {}'.format(os.path.basename(path), first.date(), fitLast.date())
+    station = fit_events(name, hours[fit], [k for k, f in zip(kinds, fit) if f], values[fit], hydraulic=hydraulic,
+                         source=source)
+    station.valid = (str(first.date()), str(last.date()))
+    station.check = check_offline(station, path)
+    return station
+
+
+def _check_summary(check: dict) -> str:
+    return '{} ({})'.format(check, 'offered as the Harmonic source' if harmonic_check_passes(check) else
+                            'too far from XTide, not offered as a source')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the harmonic constants in ' + HARMONICS_FILE)
+    parser.add_argument('--fit-offline', dest='FIT', default=None, type=str,
+                        help='Comma-delimited station name substrings (or "all") to fit to their xtide-offline files, '
+                             'all but the last {} years, which are checked against'.format(HOLDOUT_YEARS))
+    parser.add_argument('--hydraulic', default=None, type=str,
+                        help='Comma-delimited station name substrings to fit as hydraulic current stations')
+    parser.add_argument('--check', dest='CHECK', default=None, type=str,
+                        help='Comma-delimited station name substrings (or "all") to compare to the last {} years of '
+                             'their xtide-offline files, the result is stored with the constants'.format(HOLDOUT_YEARS))
+    parser.add_argument('--import-noaa', dest='NOAA', default=None, type=str, help='NOAA harcon.json file to import')
+    parser.add_argument('--fit-noaa-hilo', dest='HILO', default=None, type=str,
+                        help='NOAA hilo tide predictions json file to fit tide constants to')
+    parser.add_argument('--name', dest='NAME', default=None, type=str,
+                        help='Station name for --import-noaa and --fit-noaa-hilo')
+    parser.add_argument('--kind', dest='KIND', choices=['current', 'tide'], default='current')
+    parser.add_argument('--datum', dest='DATUM', default=0.0, type=float, help='Datum offset for --import-noaa')
+    args = parser.parse_args()
+
+    def selected(arg):
+        return _offline_stations([] if arg.strip().lower() == 'all' else
+                                 [s.strip().lower() for s in arg.split(',') if s.strip()])
+
+    if args.NOAA:
+        if not args.NAME:
+            parser.error('--import-noaa requires --name')
+        station = read_noaa_harcon(args.NOAA, args.NAME, args.KIND, args.DATUM)
+        save_station(station)
+        print('Imported {} constituents for {}'.format(len(station.names), station.name))
+    if args.HILO:
+        if not args.NAME:
+            parser.error('--fit-noaa-hilo requires --name')
+        hours, kinds, heights = read_noaa_hilo(args.HILO)
+        first, last = from_hours([hours[0], hours[-1]])
+        source = 'fit to {} {} to {}'.format(os.path.basename(args.HILO), first.date(), last.date())
+        station = fit_events(args.NAME, hours, kinds, heights, kind='tide', source=source)
+        save_station(station)
+        t, k, v = station.events_hours(hours[0], hours[-1])
+        print('Fit {} to {} highs and lows, predicted {}'.format(station.name, len(hours), len(t)))
+    if args.FIT:
+        hydraulic = [s.strip().lower() for s in (args.hydraulic or '').split(',') if s.strip()]
+        for s in selected(args.FIT):
+            isHydraulic = any(h in s['name'].lower() for h in hydraulic)
+            station = fit_offline(s['name'], s['offlineFile'], isHydraulic)
+            save_station(station)
+            print('Fit {} ({}): {}'.format(s['name'], station.source, _check_summary(station.check)))
+    if args.CHECK:
+        for s in selected(args.CHECK):
+            station = get_station(s['name'])
+            if not station:
+                print('No harmonic constants for ' + s['name'])
+                continue
+            station.check = check_offline(station, s['offlineFile'])
+            save_station(station)
+            print('{}: {}'.format(s['name'], _check_summary(station.check)))
+
+
+if __name__ == '__main__':
+    main()
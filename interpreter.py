@@ -1,19 +1,21 @@
+# Source specific dependencies (requests, bs4, urllib.request, dateutil, pdfplumber) are imported inside the
+# interpreter methods that use them so that startup only pays for the sources actually queried
 import json
-import urllib.request
+import os
+from array import array
 from astral.sun import sun
 from astral import LocationInfo
 from astral import moon
-from bs4 import BeautifulSoup
 import datetime
 from datetime import datetime as dt
 from datetime import timedelta as td
 from pytz import timezone
-import requests
 import re
-from dateutil import parser
 import pytz
 import subprocess
 import canada_pdf_lib
+import profiling
+from range_cache import RangeCache, day_start
 from interpreter_common import (
     TIMEPARSEFMT,
     TIMEPARSEFMT_TBONE,
@@ -30,6 +32,8 @@ from interpreter_common import (
     date_str,
     time_str,
     get_canada_station_id_local,
+    harmonic_check_passes,
+    has_harmonic_constants,
     DiveWindow,
 )
 
@@ -151,11 +155,14 @@ class Slack(DiveWindow):
 
 # Base class to download and parse current data from various websites
 class Interpreter:
+    # source name used for this interpreter's profiling timers and cache counters
+    PROFILE_SOURCE = 'web'
 
     def __init__(self, baseUrl, station):
         self.baseUrl = baseUrl
         self.station = station
         self._webLines = None
+        self.numAPICalls = 0  # number of web requests, PDF downloads or XTide runs made by this instance
         # https://astral.readthedocs.io/en/latest
         self._astralCity = LocationInfo("Seattle", "Washington", "America/Los_Angeles", 47.6, -122.3)
 
@@ -178,6 +185,14 @@ class Interpreter:
         raise NotImplementedError
     # ----------------------- end stub functions -----------------------------------------------------------------------
 
+    # Sets the sunrise, sunset and moon phase of the given slack from the calendar day of its time
+    def _addSunMoonData(self, s):
+        with profiling.timed('ephemeris.sun_moon'):
+            sunData = sun(self._astralCity.observer, date=s.time, tzinfo=timezone('US/Pacific'))
+            s.sunriseTime = sunData['sunrise'].replace(tzinfo=None)
+            s.sunsetTime = sunData['sunset'].replace(tzinfo=None)
+            s.moonPhase = moon.phase(s.time)
+
     # Returns the line before index i in lines that contains an ebb or flood current speed prediction. Returns None if
     # no such prediction exists before index i.
     def _getCurrentBefore(self, i, lines):
@@ -269,32 +284,39 @@ class Interpreter:
     # Returns a list of slacks for the given day, retrieves new web data if the current data doesn't have info for day.
     # time_filter: 'day' for daytime only, 'night' for nighttime only, 'all' for all times
     def getSlacks(self, day, time_filter):
-        if not self._canReuseWebData(day):
+        if self._canReuseWebData(day):
+            profiling.cache_hit(self.PROFILE_SOURCE)
+        else:
+            profiling.cache_miss(self.PROFILE_SOURCE)
             if not self.baseUrl:
                 print('Base url empty')  # comment this out if it's annoying
                 return []
             # print('making another API call')
             url = self.getDayUrl(self.baseUrl, day)
+            self.numAPICalls += 1
             self._webLines = self._getWebLines(url, day)
         if not self._webLines:
             print('Error getting web data')
             return []
         # Note: astral sunrise and sunset times do account for daylight savings
-        sunData = sun(self._astralCity.observer, date=day, tzinfo=timezone('US/Pacific'))
+        with profiling.timed('ephemeris.sun_moon'):
+            sunData = sun(self._astralCity.observer, date=day, tzinfo=timezone('US/Pacific'))
+            moonPhase = moon.phase(day)
         # remove time zone info to compare with other local times
         sunrise = sunData['sunrise'].replace(tzinfo=None)
         sunset = sunData['sunset'].replace(tzinfo=None)
-        if time_filter == TIME_FILTER_ALL:
-            slackIndexes = self._getAllDaySlacks(self._webLines)
-        else:
-            # For both DAY and NIGHT, we get day slacks first, then filter
-            # For DAY_ONLY, we use the existing _getDaySlacks which filters to sunrise-sunset
-            # For NIGHT_ONLY, we get all slacks and filter in _getSlackData
-            slackIndexes = self._getDaySlacks(self._webLines, sunrise, sunset) if time_filter == TIME_FILTER_DAY else self._getAllDaySlacks(self._webLines)
-        if not slackIndexes:
-            print('ERROR: no slacks for {} found in webLines: {}'.format(day, self._webLines))
-            return []
-        slacks = self._getSlackData(self._webLines, slackIndexes, sunrise, sunset, moon.phase(day))
+        with profiling.timed('slack_build.' + self.PROFILE_SOURCE):
+            if time_filter == TIME_FILTER_ALL:
+                slackIndexes = self._getAllDaySlacks(self._webLines)
+            else:
+                # For both DAY and NIGHT, we get day slacks first, then filter
+                # For DAY_ONLY, we use the existing _getDaySlacks which filters to sunrise-sunset
+                # For NIGHT_ONLY, we get all slacks and filter in _getSlackData
+                slackIndexes = self._getDaySlacks(self._webLines, sunrise, sunset) if time_filter == TIME_FILTER_DAY else self._getAllDaySlacks(self._webLines)
+            if not slackIndexes:
+                print('ERROR: no slacks for {} found in webLines: {}'.format(day, self._webLines))
+                return []
+            slacks = self._getSlackData(self._webLines, slackIndexes, sunrise, sunset, moonPhase)
         # Apply time filter
         return [s for s in slacks if _passesTimeFilter(s, time_filter)]
 
@@ -302,6 +324,7 @@ class Interpreter:
 # Class to retrieve and parse current data from mobilegeographics website
 # NOTE: As of 11/2020, website down for weeks, deprecated and replaced by TBoneSCInterpreter
 class MobilegeographicsInterpreter(Interpreter):
+    PROFILE_SOURCE = 'mobilegeographics'
 
     # Returns the datetime object parsed from the given data line from MobileGeographics website
     def _parseTime(self, tokens):
@@ -315,8 +338,11 @@ class MobilegeographicsInterpreter(Interpreter):
 
     # Returns the mobilegeographics current data from the given url
     def _getWebLines(self, url, day):
-        with urllib.request.urlopen(url) as response:
+        import urllib.request
+        from bs4 import BeautifulSoup
+        with profiling.timed('network.' + self.PROFILE_SOURCE), urllib.request.urlopen(url) as response:
             html = response.read()
+        with profiling.timed('html_parse.' + self.PROFILE_SOURCE):
             soup = BeautifulSoup(html, 'html.parser')
             predictions = soup.find('pre', {'class': 'predictions-table'})
             lines = predictions.text.lower().splitlines()
@@ -369,6 +395,7 @@ class MobilegeographicsInterpreter(Interpreter):
 # Class to retrieve and parse current data from tbone.biol.sc.edu website
 # as of 12-9-2023 this class also works for tide.arthroinfo.org
 class TBoneSCInterpreter(Interpreter):
+    PROFILE_SOURCE = 'tbone'
 
     # Returns the datetime object parsed from the given data line from tbone.biol.sc.edu website
     def _parseTime(self, tokens):
@@ -386,9 +413,12 @@ class TBoneSCInterpreter(Interpreter):
 
     # Returns the tbone.biol.sc.edu current data from the given url
     def _getWebLines(self, url, day):
+        import urllib.request
+        from bs4 import BeautifulSoup
         req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req) as response:
+        with profiling.timed('network.' + self.PROFILE_SOURCE), urllib.request.urlopen(req) as response:
             html = response.read()
+        with profiling.timed('html_parse.' + self.PROFILE_SOURCE):
             soup = BeautifulSoup(html, 'html.parser')
             predictions = soup.find('pre')
             lines = predictions.text.lower().splitlines()
@@ -440,8 +470,10 @@ class TBoneSCInterpreter(Interpreter):
 
 
 class TBoneSCOfflineInterpreter(TBoneSCInterpreter):
+    PROFILE_SOURCE = 'xtide_offline'
     # taken from xtide_saver.py
-    def __getFileName(self, stationName):
+    @staticmethod
+    def _getFileName(stationName):
         # remove chars before first comma
         match = re.match(r'^([^,]+)', stationName.lower())
         filename = match.group(1)
@@ -452,10 +484,15 @@ class TBoneSCOfflineInterpreter(TBoneSCInterpreter):
         filename = filename.strip()
         filename = filename.replace('.', '')
         filename = filename.replace(' ', '-')
-        return 'xtide-offline/' + filename + '.txt'
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xtide-offline', filename + '.txt')
+
+    # Returns true if xtide-offline has saved predictions for the station
+    @staticmethod
+    def hasArchive(station):
+        return os.path.exists(TBoneSCOfflineInterpreter._getFileName(station['name']))
 
     def _getWebLines(self, url, day):
-        xtideFile = self.__getFileName(self.station['name'])
+        xtideFile = self._getFileName(self.station['name'])
         with open(xtideFile, 'r') as f:
             lines = f.read().splitlines()
         targetDayStr = dt.strftime(day, DATEFMT)
@@ -466,8 +503,86 @@ class TBoneSCOfflineInterpreter(TBoneSCInterpreter):
         raise Exception('did not find date {} in offline xtide data'.format(targetDayStr))
 
 
+# NOAA current predictions parsed once into parallel typed arrays. Each day maps to the range of its event indexes
+# and each event to the nearest max current before and after it, so getting the slacks of any fetched day is a dict
+# lookup with no list copies or re-parsing. Only the days from first to last are covered, the events of the padding
+# days around them are only there to give the slacks at the edges their max currents.
+class _NoaaEvents:
+    SLACK, FLOOD, EBB = 0, 1, 2
+    KINDS = {'slack': SLACK, 'flood': FLOOD, 'ebb': EBB}
+
+    def __init__(self, cp, first, last):
+        self.first = datetime.date(first.year, first.month, first.day)
+        self.last = datetime.date(last.year, last.month, last.day)
+        self.times = []                   # datetime of each event
+        self.kinds = array('b')           # SLACK, FLOOD or EBB
+        self.speeds = array('d')          # knots, negative on the ebb
+        self.days = {}                    # date -> (first event index, last event index + 1)
+        for event in cp:
+            t = dt.fromisoformat(event['Time'])
+            self.times.append(t)
+            self.kinds.append(self.KINDS[event['Type']])
+            self.speeds.append(round(event['Velocity_Major'], 2))
+            d = t.date()
+            first, _ = self.days.get(d, (len(self.times) - 1, 0))
+            self.days[d] = (first, len(self.times))
+
+        n = len(self.times)
+        self.prevMax = array('l', [-1]) * n  # index of the max current before each event, -1 if none
+        self.nextMax = array('l', [-1]) * n  # index of the max current after each event, -1 if none
+        last = -1
+        for i in range(n):
+            self.prevMax[i] = last
+            if self.kinds[i] != self.SLACK:
+                last = i
+        last = -1
+        for i in range(n - 1, -1, -1):
+            self.nextMax[i] = last
+            if self.kinds[i] != self.SLACK:
+                last = i
+        # slack, or a min ebb/flood (NOAA has no 'min ebb', only 3 ebbs in a row)
+        kinds = self.kinds
+        self.isSlack = array('b', [kinds[i] == self.SLACK or
+                                   (0 < i < n - 1 and kinds[i - 1] == kinds[i] == kinds[i + 1]) for i in range(n)])
+
+    # Returns (first event index, last event index + 1) of the day, None if the day is not covered
+    def dayRange(self, day):
+        d = datetime.date(day.year, day.month, day.day)
+        return self.days.get(d) if self.first <= d <= self.last else None
+
+    # Returns Slack objects for the slack events with indexes in [first, end) that have a max current on either side
+    def slacks(self, first, end, sunrise, sunset, moonPhase):
+        slacks = []
+        for i in range(first, end):
+            if not self.isSlack[i]:
+                continue
+            pre, post = self.prevMax[i], self.nextMax[i]
+            if pre < 0 or post < 0:
+                continue
+            s = Slack()
+            s.time = self.times[i]
+            s.sunriseTime = sunrise
+            s.sunsetTime = sunset
+            s.moonPhase = moonPhase
+            s.slackBeforeEbb = self.kinds[post] == self.EBB
+            if s.slackBeforeEbb:
+                s.floodSpeed, s.maxFloodTime = self.speeds[pre], self.times[pre]
+                s.ebbSpeed, s.maxEbbTime = self.speeds[post], self.times[post]
+            else:
+                s.ebbSpeed, s.maxEbbTime = self.speeds[pre], self.times[pre]
+                s.floodSpeed, s.maxFloodTime = self.speeds[post], self.times[post]
+            slacks.append(s)
+        return slacks
+
+
 # Class to retrieve and parse current data from Noaa API
 class NoaaAPIInterpreter(Interpreter):
+    PROFILE_SOURCE = 'noaa'
+    REQUEST_DAYS = 15  # days covered by one request
+
+    def __init__(self, baseUrl, station):
+        super().__init__(baseUrl, station)
+        self._events = None  # _NoaaEvents of the last request, covering REQUEST_DAYS days
 
     # Returns the datetime object parsed from the given data line from Noaa website
     def _parseTime(self, tokens):
@@ -477,76 +592,82 @@ class NoaaAPIInterpreter(Interpreter):
     # Returns the day-specific URL for the current base URL
     @staticmethod
     def getDayUrl(baseUrl, day):
-        # yesterday = (day - datetime.timedelta(days=1)).strftime(DATEFMT).replace("-", "")
         today = day.strftime(DATEFMT).replace("-", "")
-        # tomorrow = (day + datetime.timedelta(days=1)).strftime(DATEFMT).replace("-", "")
         twoWeeks = (day + datetime.timedelta(days=14)).strftime(DATEFMT).replace("-", "")
         return baseUrl + f'&begin_date={today}&end_date={twoWeeks}'
 
-    # Returns the noaa current data from the given url
-    def _getWebLines(self, url, day):
-        urlFinal = self.getDayUrl(url, day)
-        response = requests.get(urlFinal)
+    # Returns the noaa current_predictions json response for the REQUEST_DAYS days starting with day, padded with a day
+    # on each side so the slacks at the edges of those days have the max currents before and after them
+    def _getJson(self, day):
+        import requests
+        begin = (day + datetime.timedelta(days=-1)).strftime('%Y%m%d')
+        end = (day + datetime.timedelta(days=self.REQUEST_DAYS)).strftime('%Y%m%d')
+        with profiling.timed('network.noaa'):
+            response = requests.get(self.baseUrl + f'&begin_date={begin}&end_date={end}')
         if response.status_code != 200:
             raise Exception('NOAA API is down: ' + str(response))
 
-        if 'current_predictions' not in response.json():
-            raise Exception('NOAA API response unexpected format: ' + str(response) + "\n" + str(response.json()))
-        jsonArray = response.json()['current_predictions']['cp']
-
-        # convert json array to array of weblines - not ideal, fits into existing Interpreter functions better for now
-        weblines = []
-        for event in jsonArray:
-            weblines.append("{} {} {:.2f}".format(event['Time'], event['Type'], event['Velocity_Major']))
-        return weblines
-
-    # Returns a list of Slack objects corresponding to the slack indexes within the list of data lines
-    def _getSlackData(self, lines, indexes, sunrise, sunset, moonPhase):
-        slacks = []
-        for i in indexes:
-            s = Slack()
-            s.sunriseTime = sunrise
-            s.sunsetTime = sunset
-            s.moonPhase = moonPhase
-
-            preMax = self._getCurrentBefore(i, lines)
-            if not preMax:
-                continue
-            tokens1 = preMax.split()
-
-            postMax = self._getCurrentAfter(i, lines)
-            if not postMax:
-                continue
-            tokens2 = postMax.split()
+        jsonData = response.json()
+        if 'current_predictions' not in jsonData:
+            raise Exception('NOAA API response unexpected format: ' + str(response) + "\n" + str(jsonData))
+        return jsonData
 
-            s.slackBeforeEbb = 'ebb' in postMax
+    # Returns the parsed events of the given NOAA current_predictions json response requested for day
+    def _eventsFromJson(self, jsonData, day):
+        return _NoaaEvents(jsonData['current_predictions']['cp'], day,
+                           day + datetime.timedelta(days=self.REQUEST_DAYS - 1))
 
-            if s.slackBeforeEbb:
-                s.floodSpeed = float(tokens1[3])
-                s.maxFloodTime = self._parseTime(tokens1)
-                s.ebbSpeed = float(tokens2[3])
-                s.maxEbbTime = self._parseTime(tokens2)
-            else:
-                s.ebbSpeed = float(tokens1[3])
-                s.maxEbbTime = self._parseTime(tokens1)
-                s.floodSpeed = float(tokens2[3])
-                s.maxFloodTime = self._parseTime(tokens2)
+    # Returns all slacks retrieved from the API beginning with the startDay
+    def allSlacks(self, startDay):
+        events = self._eventsFromJson(self._getJson(startDay), startDay)
+        ranges = [r for r in (events.dayRange(startDay + datetime.timedelta(days=i))
+                              for i in range(self.REQUEST_DAYS)) if r]
+        return events.slacks(ranges[0][0], ranges[-1][1], None, None, -1) if ranges else []
 
-            s.time = self._parseTime(lines[i].split())
-            slacks.append(s)
-        return slacks
+    # Returns a list of slacks for the given day, requests REQUEST_DAYS days of predictions if the last request doesn't
+    # cover it
+    def getSlacks(self, day, time_filter):
+        dayRange = self._events.dayRange(day) if self._events else None
+        if dayRange:
+            profiling.cache_hit(self.PROFILE_SOURCE)
+        else:
+            profiling.cache_miss(self.PROFILE_SOURCE)
+            if not self.baseUrl:
+                print('Base url empty')  # comment this out if it's annoying
+                return []
+            self.numAPICalls += 1
+            jsonData = self._getJson(day)
+            with profiling.timed('slack_build.noaa'):
+                self._events = self._eventsFromJson(jsonData, day)
+            dayRange = self._events.dayRange(day)
+        if not dayRange:
+            print('ERROR: no NOAA predictions for {}'.format(dt.strftime(day, DATEFMT)))
+            return []
+        # Note: astral sunrise and sunset times do account for daylight savings
+        with profiling.timed('ephemeris.sun_moon'):
+            sunData = sun(self._astralCity.observer, date=day, tzinfo=timezone('US/Pacific'))
+            moonPhase = moon.phase(day)
+        sunrise = sunData['sunrise'].replace(tzinfo=None)
+        sunset = sunData['sunset'].replace(tzinfo=None)
+        with profiling.timed('slack_build.noaa'):
+            slacks = self._events.slacks(dayRange[0], dayRange[1], sunrise, sunset, moonPhase)
+        if not slacks:
+            print('ERROR: no slacks for {} found in NOAA predictions'.format(dt.strftime(day, DATEFMT)))
+            return []
+        return [s for s in slacks if _passesTimeFilter(s, time_filter)]
 
 # Class to retrieve and parse current data from Canada Currents REST API
 # Uses the wcp1-events time series which provides SLACK, EXTREMA_FLOOD, and EXTREMA_EBB events
 class CanadaAPIInterpreter(Interpreter):
-    numAPICalls = 0
+    PROFILE_SOURCE = 'canada_api'
+    # Extra days fetched past a missing day, keeps each request at the ~15 day window the API has always been queried with
+    LOOKAHEAD_DAYS = 12
 
     def __init__(self, baseUrl, station):
         super().__init__(baseUrl, station)
         self._internal_station_id = None  # Cache for station ID lookup
-        self._cached_slacks = []  # All slacks fetched from API
-        self._cache_start = None  # Start date of cached range (datetime.date)
-        self._cache_end = None    # End date of cached range (datetime.date)
+        # All slacks fetched from the API and the local days they fully cover
+        self._cache = RangeCache(key=lambda s: (s.time, s.slackBeforeEbb), lookahead_days=self.LOOKAHEAD_DAYS)
 
     def _get_station_id(self):
         """Get the internal station ID, looking it up from ca_code if needed."""
@@ -557,6 +678,7 @@ class CanadaAPIInterpreter(Interpreter):
 
     # Returns the datetime object from the given time
     def _parseTime(self, timeStr):
+        from dateutil import parser
         # convert UTC iso time string to local one
         parsed = parser.parse(timeStr)
         # confirmed 3/10/24 that this conversion will account for daylight savings
@@ -572,31 +694,31 @@ class CanadaAPIInterpreter(Interpreter):
         return baseUrl + '&from={}T00:00:00Z&to={}T00:30:00Z'.format(start, twoWeeks)
 
     def __getJsonResponse(self, url):
-        r = requests.get(url)
+        import requests
+        with profiling.timed('network.canada_api'):
+            r = requests.get(url)
         if r.status_code != 200:
             raise Exception(f'Canada currents API request failed: {r.status_code} - {r.text[:200]}')
         return r.json()
 
-    def _cache_covers_day(self, day):
-        """Check if the cache already has data for the given day."""
-        if not self._cached_slacks or not self._cache_start or not self._cache_end:
-            return False
-        day_date = day.date() if hasattr(day, 'date') else day
-        # Don't use the last day in cache as it may be incomplete
-        return self._cache_start <= day_date < self._cache_end
-
     def _fetchAndCacheSlacks(self, day):
-        """Fetch slacks from API for a 14-day window starting from day-1 and cache them."""
+        """Fetch slacks from the API for the uncovered days from day through the look-ahead and cache them."""
         station_id = self._get_station_id()
         if not station_id:
             return
+        fetchRange = self._cache.fetch_range(day)
+        if not fetchRange:
+            return
+        fetchStart, fetchEnd = fetchRange
 
-        CanadaAPIInterpreter.numAPICalls += 1
-        start = (day + datetime.timedelta(days=-1))
-        end = (day + datetime.timedelta(days=14))
+        self.numAPICalls += 1
+        # The API works in UTC. Pad a day on each side so the slacks at the edges of the local days have the max
+        # currents before and after them.
+        start = fetchStart + datetime.timedelta(days=-1)
+        end = fetchEnd + datetime.timedelta(days=1)
 
         from_str = f"{start.strftime('%Y-%m-%d')}T00:00:00Z"
-        to_str = f"{end.strftime('%Y-%m-%d')}T00:30:00Z"
+        to_str = f"{end.strftime('%Y-%m-%d')}T00:00:00Z"
 
         url = (
             f"{CANADA_API_BASE_URL}/stations/{station_id}/data"
@@ -614,7 +736,7 @@ class CanadaAPIInterpreter(Interpreter):
             # Find the first extrema event to center our direction query around
             first_extrema = next((e for e in eventsResponse if e['value'] > 0.0), None)
             if first_extrema:
-                CanadaAPIInterpreter.numAPICalls += 1
+                self.numAPICalls += 1
                 # Fetch just one day of direction data around the first extrema
                 # (the wcdp1 API limits continuous data queries to short windows)
                 extrema_date = first_extrema['eventDate'][:10]  # e.g. "2026-03-12"
@@ -631,13 +753,12 @@ class CanadaAPIInterpreter(Interpreter):
                 except Exception as e:
                     print(f"Warning: Could not fetch direction data: {e}")
 
-        slacks = self.__parseSlacks(eventsResponse, moon.phase(day), directionData)
+        with profiling.timed('slack_build.canada_api'):
+            slacks = self.__parseSlacks(eventsResponse, moon.phase(day), directionData)
 
-        # Update cache
-        self._cached_slacks = slacks
+        # Nothing is marked covered on an empty response so the next request retries
         if slacks:
-            self._cache_start = slacks[0].time.date()
-            self._cache_end = slacks[-1].time.date()
+            self._cache.add(fetchStart, fetchEnd, slacks)
 
     def __parseSlacks(self, eventsResponse, moonPhase, directionData=None):
         """
@@ -708,7 +829,8 @@ class CanadaAPIInterpreter(Interpreter):
                 s.maxFloodTime = self._parseTime(nextExtrema['eventDate'])
 
             # Add sunrise/sunset data
-            sunData = sun(self._astralCity.observer, date=s.time, tzinfo=timezone('US/Pacific'))
+            with profiling.timed('ephemeris.sun_moon'):
+                sunData = sun(self._astralCity.observer, date=s.time, tzinfo=timezone('US/Pacific'))
             s.sunriseTime = sunData['sunrise'].replace(tzinfo=None)
             s.sunsetTime = sunData['sunset'].replace(tzinfo=None)
 
@@ -804,7 +926,8 @@ class CanadaAPIInterpreter(Interpreter):
                 s.maxFloodTime = self._parseTime(nextExtrema['eventDate'])
 
             # Add sunrise/sunset data
-            sunData = sun(self._astralCity.observer, date=s.time, tzinfo=timezone('US/Pacific'))
+            with profiling.timed('ephemeris.sun_moon'):
+                sunData = sun(self._astralCity.observer, date=s.time, tzinfo=timezone('US/Pacific'))
             s.sunriseTime = sunData['sunrise'].replace(tzinfo=None)
             s.sunsetTime = sunData['sunset'].replace(tzinfo=None)
 
@@ -851,37 +974,37 @@ class CanadaAPIInterpreter(Interpreter):
 
     def _getSlacksOnDay(self, day, time_filter):
         """Get slacks from cache for the specified day, applying time filter."""
-        day_str = dt.strftime(day, DATEFMT)
-        result = []
-        for s in self._cached_slacks:
-            if dt.strftime(s.time, DATEFMT) == day_str:
-                if _passesTimeFilter(s, time_filter):
-                    result.append(s)
-        return result
+        return [s for s in self._cache.on_day(day) if _passesTimeFilter(s, time_filter)]
 
     def getSlacks(self, day, time_filter):
         """
         Returns a list of slacks for the given day.
 
-        Uses cached data if available, otherwise fetches a 14-day window from the API.
+        Uses cached data if available, otherwise fetches the missing days through the look-ahead from the API.
         """
         station_id = self._get_station_id()
         if not station_id:
             return []
 
         # Fetch new data if cache doesn't cover the requested day
-        if not self._cache_covers_day(day):
+        if self._cache.covers_day(day):
+            profiling.cache_hit('canada_api')
+        else:
+            profiling.cache_miss('canada_api')
             self._fetchAndCacheSlacks(day)
 
         return self._getSlacksOnDay(day, time_filter)
 
 class XTideDockerInterpreter(Interpreter):
+    PROFILE_SOURCE = 'xtide_docker'
+    DESCRIPTION = 'XTide via Docker'  # for error messages
+    # Extra days computed past a missing day so a day by day walk needs one container run per month
+    LOOKAHEAD_DAYS = 30
+
     def __init__(self, baseUrl, station):
         super().__init__(baseUrl, station)
-        self._events_cache = None  # list of parsed events across a cached range
-        self._slacks_cache = None  # list[Slack] built from cached events
-        self._cache_start = None   # datetime.date
-        self._cache_end = None     # datetime.date
+        # Slacks built from every XTide run and the days they fully cover
+        self._cache = RangeCache(key=lambda s: (s.time, s.slackBeforeEbb), lookahead_days=self.LOOKAHEAD_DAYS)
 
     @staticmethod
     def getDayUrl(baseUrl, day):
@@ -912,8 +1035,10 @@ class XTideDockerInterpreter(Interpreter):
             '-b', begin,
             '-e', end
         ]
+        self.numAPICalls += 1
         try:
-            completed = subprocess.run(cmd, capture_output=True, text=False, check=True)
+            with profiling.timed('docker.xtide'):
+                completed = subprocess.run(cmd, capture_output=True, text=False, check=True)
         except Exception as e:
             raise Exception('XTide Docker invocation failed: {}'.format(repr(e)))
         def _safe_decode(b):
@@ -928,42 +1053,6 @@ class XTideDockerInterpreter(Interpreter):
         _ = _safe_decode(completed.stderr)  # keep for potential debugging
         return stdout_text.splitlines()
 
-    def _run_xtide_for_day(self, day):
-        # Query a wider range to ensure we capture max currents that occur just before/after midnight
-        # This handles edge cases like a slack at 3 AM with preMax at 11 PM previous day,
-        # or a slack at 10 PM with postMax at 1 AM next day
-        prev_day = day - td(days=1)
-        next_day = day + td(days=1)
-        begin = dt.strftime(prev_day, '%Y-%m-%d') + ' 12:00'  # Start at noon previous day
-        end = dt.strftime(next_day, '%Y-%m-%d') + ' 12:00'    # End at noon next day
-        location = self.station['xtide_name'] if 'xtide_name' in self.station else self.station['name']
-        cmd = [
-            'docker', 'run', '--rm',
-            'xtide',
-            '-l', location,
-            '-b', begin,
-            '-e', end
-        ]
-        try:
-            # Capture raw bytes and decode manually to handle non-UTF8 output (degree symbol, etc.)
-            completed = subprocess.run(cmd, capture_output=True, text=False, check=True)
-        except Exception as e:
-            raise Exception('XTide Docker invocation failed: {}'.format(repr(e)))
-        # Try utf-8 first, then fall back to latin-1 which safely decodes b'\xb0' to '°'
-        def _safe_decode(b):
-            try:
-                return b.decode('utf-8')
-            except UnicodeDecodeError:
-                try:
-                    return b.decode('latin-1')
-                except Exception:
-                    return b.decode('utf-8', errors='replace')
-        stdout_text = _safe_decode(completed.stdout)
-        stderr_text = _safe_decode(completed.stderr)
-        # print('XTide Docker output: {}'.format(stdout_text))
-        # print('XTide Docker error: {}'.format(stderr_text))
-        return stdout_text.splitlines()
-
     def _parse_xtide_events(self, lines):
         # Return list of tuples (index, kind, time, speed)
         # kind in {'max_flood','max_ebb','slack_flood','slack_ebb','min_ebb','min_flood'}
@@ -1070,17 +1159,10 @@ class XTideDockerInterpreter(Interpreter):
             if not preMax or not postMax:
                 continue
 
-            # sunrise/sunset for the slack's calendar day
-            sunData = sun(self._astralCity.observer, date=t, tzinfo=timezone('US/Pacific'))
-            sunrise = sunData['sunrise'].replace(tzinfo=None)
-            sunset = sunData['sunset'].replace(tzinfo=None)
-            mphase = moon.phase(t)
-
             s = Slack()
             s.time = t
-            s.sunriseTime = sunrise
-            s.sunsetTime = sunset
-            s.moonPhase = mphase
+            # sunrise/sunset for the slack's calendar day
+            self._addSunMoonData(s)
             s.slackBeforeEbb = slackBeforeEbb
             if slackBeforeEbb:
                 s.floodSpeed = preMax[3] if preMax[1] == 'max_flood' else abs(preMax[3])
@@ -1095,68 +1177,103 @@ class XTideDockerInterpreter(Interpreter):
             slacks.append(s)
         return slacks
 
-    def preload_range(self, start_day, end_day):
-        # Normalize to dates without time
-        start = dt(year=start_day.year, month=start_day.month, day=start_day.day)
-        end = dt(year=end_day.year, month=end_day.month, day=end_day.day)
-        lines = self._run_xtide_range(start, end)
+    # Runs XTide for the days [start, end) and caches the slacks. The run is padded by a day on each side so the
+    # slacks near midnight at either end have the max currents before and after them.
+    def _loadRange(self, start, end):
+        lines = self._run_xtide_range(start - td(days=1), end)
         events = self._parse_xtide_events(lines)
         if not events:
             raise Exception('No XTide events parsed for range {} - {}'.format(start, end))
-        self._events_cache = events
-        self._slacks_cache = self._build_slacks_from_events(events)
-        self._cache_start = start
-        self._cache_end = end
+        with profiling.timed('slack_build.xtide_docker'):
+            slacks = self._build_slacks_from_events(events)
+        self._cache.add(start, end, slacks)
 
-    def _covers_date(self, day):
-        if not self._cache_start or not self._cache_end:
-            return False
-        d = dt(year=day.year, month=day.month, day=day.day)
-        return self._cache_start <= d <= self._cache_end
-
-    def _filter_cached_slacks_for_day(self, day, time_filter):
-        if not self._slacks_cache:
-            return []
-        day_str = dt.strftime(day, DATEFMT)
-        result = []
-        for s in self._slacks_cache:
-            if dt.strftime(s.time, DATEFMT) != day_str:
-                continue
-            if _passesTimeFilter(s, time_filter):
-                result.append(s)
-        return result
+    # Loads every day from start_day through end_day (inclusive) that isn't cached yet in one container run
+    def preload_range(self, start_day, end_day):
+        start = day_start(start_day)
+        end = day_start(end_day) + td(days=1)
+        missing = self._cache.gaps(start, end)
+        if missing:
+            self._loadRange(missing[0][0], missing[-1][1])
 
     def getSlacks(self, day, time_filter):
-        # Fast path: if we have a cached range that covers this day, just filter
-        if self._covers_date(day):
-            return self._filter_cached_slacks_for_day(day, time_filter)
-
-        # Fallback: single-day execution (preserves old behavior if preload_range not used)
-        try:
-            lines = self._run_xtide_for_day(day)
-        except Exception as e:
-            print('Error running XTide via Docker: {}'.format(repr(e)))
-            return []
-        events = self._parse_xtide_events(lines)
-        if not events:
-            print('ERROR: no events parsed for {} from XTide'.format(day))
-            return []
-        # Build full-day slacks using the same logic but with day-specific sun times
-        # reuse builder with events from just this day
-        temp_slacks = self._build_slacks_from_events(events)
-        # filter for the requested calendar day and time_filter
-        res = []
-        day_str = dt.strftime(day, DATEFMT)
-        for s in temp_slacks:
-            if dt.strftime(s.time, DATEFMT) != day_str:
-                continue
-            if _passesTimeFilter(s, time_filter):
-                res.append(s)
-        if not res:
-            print('ERROR: no slacks constructed for {} from XTide'.format(day))
+        if self._cache.covers_day(day):
+            profiling.cache_hit(self.PROFILE_SOURCE)
+        else:
+            profiling.cache_miss(self.PROFILE_SOURCE)
+            start, end = self._cache.fetch_range(day)
+            try:
+                self._loadRange(start, end)
+            except Exception as e:
+                print('Error running {}: {}'.format(self.DESCRIPTION, repr(e)))
+                return []
+        res = [s for s in self._cache.on_day(day) if _passesTimeFilter(s, time_filter)]
+        if not res and time_filter == TIME_FILTER_ALL:
+            print('ERROR: no slacks constructed for {} from {}'.format(day, self.DESCRIPTION))
         return res
 
 
+# Predicts the current events in process from the harmonic constants in harmonics.json (see harmonics.py) instead of
+# running XTide: no Docker or network, and a year of slacks takes well under a second. Slacks are built from the
+# events the same way as for XTide Docker.
+class HarmonicInterpreter(XTideDockerInterpreter):
+    PROFILE_SOURCE = 'harmonic'
+    DESCRIPTION = 'harmonic prediction'
+    LOOKAHEAD_DAYS = 366
+
+    def __init__(self, baseUrl, station):
+        super().__init__(baseUrl, station)
+        self._harmonics = None  # harmonics.HarmonicStation, loaded on first use
+        self._valid = None  # (first, last) day the constants were checked against, () once warned or if unknown
+
+    # Returns true if harmonics.json has current constants for the station
+    @staticmethod
+    def hasConstants(station):
+        return has_harmonic_constants(station, 'current')
+
+    @staticmethod
+    def getDayUrl(baseUrl, day):
+        return 'No url for local harmonic predictions'
+
+    def _loadRange(self, start, end):
+        import harmonics
+        if not self._harmonics:
+            self._harmonics = harmonics.get_station(self.station['name'])
+            if not self._harmonics:
+                raise Exception('No harmonic constants for {} in {}'.format(self.station['name'],
+                                                                            harmonics.HARMONICS_FILE))
+            if not harmonic_check_passes(self._harmonics.check):
+                self._harmonics = None
+                raise Exception('Harmonic constants for {} are too far from XTide, refit them with harmonics.py '
+                                '--fit-offline'.format(self.station['name']))
+        self.numAPICalls += 1
+        with profiling.timed('slack_build.harmonic'):
+            # padded by a day on each side so the slacks near midnight have the max currents around them
+            events = self._harmonics.events(start - td(days=1), end + td(days=1))
+            events = [(i, kind, t, round(speed, 2)) for i, (t, kind, speed) in enumerate(events)]
+            slacks = self._build_slacks_from_events(events)
+        self._cache.add(start, end, slacks)
+
+    # Prints a warning the first time days outside the span the constants were fit and checked against are asked for
+    def _checkValid(self, first, last):
+        if self._valid is None:
+            import harmonics
+            station = harmonics.get_station(self.station['name'])
+            self._valid = tuple(dt.strptime(d, DATEFMT) for d in station.valid) if station and station.valid else ()
+        if self._valid and (day_start(first) < self._valid[0] or day_start(last) > self._valid[1]):
+            print('WARNING: harmonic predictions for {} were only checked against XTide from {} to {}'.format(
+                self.station['name'], *(dt.strftime(d, DATEFMT) for d in self._valid)))
+            self._valid = ()
+
+    def preload_range(self, start_day, end_day):
+        self._checkValid(start_day, end_day)
+        super().preload_range(start_day, end_day)
+
+    def getSlacks(self, day, time_filter):
+        self._checkValid(day, day)
+        return super().getSlacks(day, time_filter)
+
+
 # Class to retrieve and parse current data from Canadian Hydrographic Service (CHS) PDF files
 # These PDFs contain the annual current predictions for Canadian current stations
 class CanadaPDFInterpreter(Interpreter):
@@ -1169,12 +1286,12 @@ class CanadaPDFInterpreter(Interpreter):
 
     Requires the station to have a 'ca_code' field (e.g., "08108" for Seymour Narrows).
     """
+    PROFILE_SOURCE = 'canada_pdf'
 
     def __init__(self, baseUrl, station):
         super().__init__(baseUrl, station)
         self._cachedSlacks = []  # Cache of all slacks from the PDF
         self._cachedYear = None  # Year for which we have cached data
-        self.numAPICalls = 0  # Track number of PDF downloads (for compatibility)
 
     def _getStationCode(self):
         """Get the CHS station code for PDF download."""
@@ -1185,7 +1302,9 @@ class CanadaPDFInterpreter(Interpreter):
     def _ensureCachedData(self, year):
         """Ensure we have cached data for the requested year."""
         if self._cachedYear == year and self._cachedSlacks:
+            profiling.cache_hit('canada_pdf')
             return True
+        profiling.cache_miss('canada_pdf')
 
         station_code = self._getStationCode()
         if not station_code:
@@ -1202,10 +1321,7 @@ class CanadaPDFInterpreter(Interpreter):
 
             # Add sunrise/sunset times to each slack
             for slack in slacks:
-                sunData = sun(self._astralCity.observer, date=slack.time, tzinfo=timezone('US/Pacific'))
-                slack.sunriseTime = sunData['sunrise'].replace(tzinfo=None)
-                slack.sunsetTime = sunData['sunset'].replace(tzinfo=None)
-                slack.moonPhase = moon.phase(slack.time)
+                self._addSunMoonData(slack)
 
             self._cachedSlacks = slacks
             self._cachedYear = year
@@ -1300,12 +1416,12 @@ class DairikiInterpreter(Interpreter):
 
     Requires the station to have a 'url_dairiki' field.
     """
+    PROFILE_SOURCE = 'dairiki'
 
     def __init__(self, baseUrl, station):
         super().__init__(baseUrl, station)
         self._cachedSlacks = []  # Cache of all slacks from the page
         self._cachedYearMonth = None  # (year, month) tuple for which we have cached data
-        self.numAPICalls = 0  # Track number of page downloads (for compatibility)
 
     def _parseTime(self, tokens):
         """Not used for Dairiki parsing, but required by base class."""
@@ -1384,13 +1500,27 @@ class DairikiInterpreter(Interpreter):
         self.numAPICalls += 1
 
         try:
-            req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-            with urllib.request.urlopen(req) as response:
-                html = response.read()
-                soup = BeautifulSoup(html, 'html.parser')
+            html = self._getMonthHtml(url)
         except Exception as e:
             print(f"Error fetching Dairiki page {url}: {e}")
             return {}
+        return self._parseMonthHtml(html, url)
+
+    def _getMonthHtml(self, url):
+        """Download the raw html of a monthly page."""
+        import urllib.request
+        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+        with profiling.timed('network.dairiki'), urllib.request.urlopen(req) as response:
+            return response.read()
+
+    def _parseMonthHtml(self, html, url):
+        """
+        Parse the events (turns and maxes) from the html of a monthly page.
+        Returns a dict mapping date_key to {'turns': [...], 'maxes': [...], 'date': datetime}.
+        """
+        from bs4 import BeautifulSoup
+        with profiling.timed('html_parse.dairiki'):
+            soup = BeautifulSoup(html, 'html.parser')
 
         # Find the tide table
         table = soup.find('table', {'class': 'tidetable'})
@@ -1583,10 +1713,11 @@ class DairikiInterpreter(Interpreter):
             current_date = events['date']
 
             # Get sunrise/sunset for this date
-            sunData = sun(self._astralCity.observer, date=current_date, tzinfo=timezone('US/Pacific'))
+            with profiling.timed('ephemeris.sun_moon'):
+                sunData = sun(self._astralCity.observer, date=current_date, tzinfo=timezone('US/Pacific'))
+                moonPhase = moon.phase(current_date)
             sunrise = sunData['sunrise'].replace(tzinfo=None)
             sunset = sunData['sunset'].replace(tzinfo=None)
-            moonPhase = moon.phase(current_date)
 
             for turn_time in turns:
                 # Find the max current before this slack
@@ -1657,13 +1788,16 @@ class DairikiInterpreter(Interpreter):
     def _ensureCachedData(self, year, month):
         """Ensure we have cached data for the requested year/month."""
         if self._cachedYearMonth == (year, month) and self._cachedSlacks:
+            profiling.cache_hit('dairiki')
             return True
+        profiling.cache_miss('dairiki')
 
         if not self.baseUrl:
             print("Error: Station does not have 'url_dairiki' configured")
             return False
 
-        slacks = self._fetchAndParseMonth(year, month)
+        with profiling.timed('slack_build.dairiki'):
+            slacks = self._fetchAndParseMonth(year, month)
         if slacks:
             self._cachedSlacks = slacks
             self._cachedYearMonth = (year, month)
@@ -5,8 +5,8 @@ Common constants and utilities shared between interpreter.py and interpreter_tid
 from abc import ABC, abstractmethod
 from datetime import datetime as dt
 from datetime import timedelta as td
+from functools import lru_cache
 from typing import Optional, Any
-import requests
 import json
 import os
 
@@ -55,6 +55,8 @@ def get_canada_station_id(
         return None
     station_name = station.get('name', 'unknown')
 
+    import requests  # only Canada station lookups need it, keep it off the startup path
+
     try:
         url = f"{CANADA_API_BASE_URL}/stations?code={station_code}"
         response = requests.get(url)
@@ -127,6 +129,47 @@ def get_canada_station_id_local(
         return None
 
 
+# A station fit to XTide predictions is only offered as a source if its stored check (harmonics.py --check) is within
+# these limits. Subordinate stations (XTide offsets from a reference station) fit poorly and spawn spurious maxima.
+HARMONIC_MAX_SLACK_P95_MINUTES = 10.0
+HARMONIC_MAX_EVENT_COUNT_ERROR = 0.02  # predicted vs XTide slacks and maxima, as a fraction
+
+
+def harmonic_check_passes(check: Optional[dict[str, Any]]) -> bool:
+    """
+    Returns True if the stored harmonics.py --check result of a station is within the limits above. Stations without
+    a check (imported from official NOAA constants) pass.
+    """
+    if not check:
+        return True
+    for label in ('slack', 'max'):
+        events, predicted = check.get(label, {}).get('events', 0), check.get(label, {}).get('predicted', 0)
+        if abs(predicted - events) > HARMONIC_MAX_EVENT_COUNT_ERROR * events:
+            return False
+    return check.get('slack', {}).get('p95_minutes', 0) <= HARMONIC_MAX_SLACK_P95_MINUTES
+
+
+@lru_cache(maxsize=None)
+def _harmonic_station_kinds() -> dict[str, str]:
+    try:
+        with open(os.path.join(os.path.dirname(__file__), 'harmonics.json'), 'r') as f:
+            stations = json.load(f)['stations']
+        return {name: s.get('kind', 'current') for name, s in stations.items()
+                if harmonic_check_passes(s.get('check'))}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def has_harmonic_constants(station: dict[str, Any], kind: str) -> bool:
+    """
+    Returns True if harmonics.json has constants of the given kind ('current' or 'tide') for the station that pass
+    their stored check (see harmonic_check_passes).
+
+    Reads the file directly so that checking which sources a station has doesn't import numpy (see harmonics.py).
+    """
+    return _harmonic_station_kinds().get(station.get('name')) == kind
+
+
 def passes_time_filter(event_time, sunrise_time, sunset_time, time_filter):
     """
     Returns True if the event passes the given time filter.
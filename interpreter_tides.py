@@ -7,23 +7,33 @@ from various data sources.
 Supported data sources:
 - NOAA API (NoaaTideInterpreter) - US tide stations
 - Canadian API (CanadaTideInterpreter) - Placeholder for future BC tide stations
+- Local harmonic constants (HarmonicTideInterpreter) - offline, see harmonics.py
 
 Usage:
     interpreter = get_tide_interpreter(station_config)
     tides = interpreter.getTides(start_day, days_in_future=7, time_filter=TIME_FILTER_DAY)
+
+The height between a high and a low is interpolated with a half cosine or the rule of twelfths, see
+interpolate_tides(). dive_heights() applies it to whole lists of TideDiveWindows at once, for sites with a
+min_entry_height.
 """
 
 from __future__ import annotations
 
 import datetime
-from datetime import datetime as dt, date
+from datetime import datetime as dt
+from functools import lru_cache
 from typing import Optional, Any
-import requests
+import math
+# numpy is imported by the functions that use it, so dive_plan.py starts without loading it
 from astral.sun import sun
 from astral import LocationInfo
 from astral import moon
 from pytz import timezone
 
+import profiling
+from range_cache import RangeCache, day_start
+
 from interpreter_common import (
     TIMEPARSEFMT_TBONE,
     DATEFMT,
@@ -43,6 +53,16 @@ from interpreter_common import TIME_FILTER_DAY, TIME_FILTER_NIGHT, TIME_FILTER_E
 # Type alias for station config dict
 StationConfig = dict[str, Any]
 
+# Height curves between a high and a low tide, see interpolate_tides()
+TIDE_SHAPES = ('cosine', 'twelfths')
+
+
+@lru_cache(maxsize=None)
+def _twelfths() -> tuple:
+    """Rule of twelfths: 1, 2, 3, 3, 2 and 1 twelfths of the range in each sixth of the time between high and low."""
+    import numpy as np
+    return np.linspace(0.0, 1.0, 7), np.array([0, 1, 3, 6, 9, 11, 12]) / 12
+
 
 def print_tides_dive_fmt(tides: list['Tide']) -> None:
     """
@@ -68,6 +88,88 @@ def print_tides_dive_fmt(tides: list['Tide']) -> None:
         print()  # End final day
 
 
+def interpolate_tides(event_times, event_heights, query_times, shape: str = 'cosine') -> tuple:
+    """
+    Interpolate the tide height between consecutive high and low tides at many times at once.
+
+    Args:
+        event_times: Times of the highs and lows in order (datetimes or datetime64)
+        event_heights: Heights of the highs and lows in feet
+        query_times: Times to interpolate at (datetimes or datetime64)
+        shape: 'cosine' for a half cosine between each high and low, 'twelfths' for the rule of twelfths
+
+    Returns:
+        (heights in feet, rates of change in feet per hour) as NumPy arrays, NaN outside the events
+    """
+    if shape not in TIDE_SHAPES:
+        raise ValueError('Unknown tide shape {}, expected one of {}'.format(shape, TIDE_SHAPES))
+    import numpy as np
+    times = np.asarray(event_times, dtype='datetime64[s]').astype(np.int64) / 3600.0
+    heights = np.asarray(event_heights, dtype=float)
+    query = np.atleast_1d(np.asarray(query_times, dtype='datetime64[s]')).astype(np.int64) / 3600.0
+    result = np.full(len(query), np.nan)
+    rates = np.full(len(query), np.nan)
+    if len(times) < 2:
+        return result, rates
+
+    i = np.searchsorted(times, query, side='right') - 1
+    # exactly at the last event, use the segment before it
+    i = np.where(query == times[-1], len(times) - 2, i)
+    inside = (i >= 0) & (i < len(times) - 1)
+    i = i[inside]
+    t0, duration = times[i], times[i + 1] - times[i]
+    h0, change = heights[i], heights[i + 1] - heights[i]
+    u = (query[inside] - t0) / duration
+    if shape == 'cosine':
+        result[inside] = h0 + change * (1 - np.cos(np.pi * u)) / 2
+        rates[inside] = change * np.pi / 2 * np.sin(np.pi * u) / duration
+    else:
+        twelfths_time, twelfths_height = _twelfths()
+        result[inside] = h0 + change * np.interp(u, twelfths_time, twelfths_height)
+        sixth = np.minimum((u * 6).astype(int), 5)
+        rates[inside] = change * np.diff(twelfths_height)[sixth] * 6 / duration
+    return result, rates
+
+
+def dive_heights(windows: list['TideDiveWindow'], site: dict, shape: str = 'cosine') -> tuple:
+    """
+    Tide heights of the dives planned for the windows at the site, for all windows at once. Heights are interpolated
+    between each window's tide and its neighbors, so windows read back from the prediction cache work too.
+
+    Returns:
+        (height at entry, height at exit, lowest height during the dive) as NumPy arrays in feet, NaN where the
+        entry or exit time falls outside the window's neighboring tides or the site lacks the timing keys
+    """
+    import numpy as np
+    from interpreter import _getEntryTimes
+    tides = {}
+    for w in windows:
+        for tide in (w.prevTide, w.tide, w.nextTide):
+            if tide:
+                tides[tide.time] = tide.height
+    event_times = sorted(tides)
+    event_heights = [tides[t] for t in event_times]
+
+    entry_times, exit_times = [], []
+    for w in windows:
+        times = _getEntryTimes(w, site)
+        entry_times.append(times[2] if times else None)
+        exit_times.append(times[3] if times else None)
+    if not windows:
+        return np.array([]), np.array([]), np.array([])
+    entry, _ = interpolate_tides(event_times, event_heights, entry_times, shape)
+    exit_height, _ = interpolate_tides(event_times, event_heights, exit_times, shape)
+
+    # The low of a dive across low tide is the low tide itself
+    tide_times = np.array([w.time for w in windows], dtype='datetime64[s]')
+    low_inside = np.array([not w.slackBeforeEbb for w in windows]) & \
+        (np.array(entry_times, dtype='datetime64[s]') <= tide_times) & \
+        (tide_times <= np.array(exit_times, dtype='datetime64[s]'))
+    lowest = np.fmin(entry, exit_height)
+    lowest = np.where(low_inside, np.fmin(lowest, [w.tide.height for w in windows]), lowest)
+    return entry, exit_height, lowest
+
+
 class Tide:
     """
     Represents a single tide event (high or low tide).
@@ -179,6 +281,7 @@ class TideDiveWindow(DiveWindow):
         - max_flood = max allowed rise height (low→high change in feet)
         - max_ebb = max allowed fall height (high→low change in feet)
         - max_total_height = max allowed total height change
+        - min_entry_height = min tide height in feet over the dive (optional), see dive_heights()
         """
         if self.slackBeforeEbb and not site['diveable_before_ebb']:
             return False, 'Not diveable at high tide'
@@ -195,6 +298,10 @@ class TideDiveWindow(DiveWindow):
             if self.riseHeight + self.fallHeight > max_total:
                 return False, 'Total height change too large ({:.1f}ft > {:.1f}ft max)'.format(
                     self.riseHeight + self.fallHeight, max_total)
+        if 'min_entry_height' in site:
+            _, _, lowest = dive_heights([self], site)
+            if lowest[0] < site['min_entry_height']:
+                return False, 'Too shallow ({:.1f}ft < {:.1f}ft min)'.format(lowest[0], site['min_entry_height'])
         return True, 'Diveable'
 
     def printDive(self, site: dict, titleMessage: str, Color) -> None:
@@ -226,6 +333,11 @@ class TideDiveWindow(DiveWindow):
             print('\t\t\t{}'.format(self.logStringWithSpeed()))
             print('\t\t\tHeight change = {:.1f} ft (rise={:.1f}, fall={:.1f})'.format(
                 self.magnitude(), self.riseHeight, self.fallHeight))
+            if 'min_entry_height' in site:
+                entry, exit_height, lowest = dive_heights([self], site)
+                if not math.isnan(lowest[0]):
+                    print('\t\t\tHeight at entry = {:.1f} ft, exit = {:.1f} ft, lowest = {:.1f} ft'.format(
+                        entry[0], exit_height[0], lowest[0]))
 
 
 class TideInterpreter:
@@ -234,6 +346,10 @@ class TideInterpreter:
 
     Child classes must implement _fetchTides() to handle their specific data source.
     """
+    # source name used for profiling timers and cache counters
+    PROFILE_SOURCE: str = 'tides'
+    # extra days fetched past a missing range so that walking day by day hits the cache
+    LOOKAHEAD_DAYS: int = 14
 
     def __init__(self, base_url: str, station: StationConfig) -> None:
         """
@@ -245,18 +361,19 @@ class TideInterpreter:
         """
         self.base_url: str = base_url
         self.station: StationConfig = station
-        self._cached_tides: list[Tide] = []
-        self._cache_start: Optional[date] = None
-        self._cache_end: Optional[date] = None
+        # all fetched tides and the days they cover
+        self._cache: RangeCache = RangeCache(key=lambda t: (t.time, t.isHighTide), lookahead_days=self.LOOKAHEAD_DAYS)
+        self.numAPICalls: int = 0
         # For sunrise/sunset calculations
         self._astral_city: LocationInfo = LocationInfo("Seattle", "Washington", "America/Los_Angeles", 47.6, -122.3)
 
     def _add_sun_moon_data(self, tide: Tide) -> None:
         """Add sunrise, sunset, and moon phase data to a Tide object."""
-        sun_data = sun(self._astral_city.observer, date=tide.time, tzinfo=timezone('US/Pacific'))
-        tide.sunriseTime = sun_data['sunrise'].replace(tzinfo=None)
-        tide.sunsetTime = sun_data['sunset'].replace(tzinfo=None)
-        tide.moonPhase = moon.phase(tide.time)
+        with profiling.timed('ephemeris.sun_moon'):
+            sun_data = sun(self._astral_city.observer, date=tide.time, tzinfo=timezone('US/Pacific'))
+            tide.sunriseTime = sun_data['sunrise'].replace(tzinfo=None)
+            tide.sunsetTime = sun_data['sunset'].replace(tzinfo=None)
+            tide.moonPhase = moon.phase(tide.time)
 
     def _fetchTides(self, start_day: dt, days_in_future: int) -> list[Tide]:
         """
@@ -273,14 +390,6 @@ class TideInterpreter:
         """
         raise NotImplementedError("Child classes must implement _fetchTides()")
 
-    def _cache_covers_range(self, start_day: dt, end_day: dt) -> bool:
-        """Check if the cache covers the requested date range."""
-        if not self._cached_tides or not self._cache_start or not self._cache_end:
-            return False
-        start_date = start_day.date() if hasattr(start_day, 'date') else start_day
-        end_date = end_day.date() if hasattr(end_day, 'date') else end_day
-        return self._cache_start <= start_date and end_date <= self._cache_end
-
     def getTides(self, start_day: dt, days_in_future: int = 7, time_filter: str = TIME_FILTER_ALL) -> list[Tide]:
         """
         Get tide predictions for the specified date range.
@@ -298,40 +407,31 @@ class TideInterpreter:
         if not self.base_url:
             return []
 
-        end_day = start_day + datetime.timedelta(days=days_in_future)
+        # The range covers the whole start and end days
+        start = day_start(start_day)
+        end = start + datetime.timedelta(days=days_in_future + 1)
 
-        # Fetch new data if cache doesn't cover the range
-        if not self._cache_covers_range(start_day, end_day):
-            raw_tides = self._fetchTides(start_day, days_in_future)
+        # Fetch only the days the cache doesn't cover yet, plus the look-ahead
+        fetch_range = self._cache.fetch_range(start, days_in_future + 1)
+        if fetch_range is None:
+            profiling.cache_hit(self.PROFILE_SOURCE)
+        else:
+            profiling.cache_miss(self.PROFILE_SOURCE)
+            self.numAPICalls += 1
+            fetch_start, fetch_end = fetch_range
+            raw_tides = self._fetchTides(fetch_start, (fetch_end - fetch_start).days - 1)
 
             # Add sun/moon data to each tide
             for tide in raw_tides:
                 self._add_sun_moon_data(tide)
 
-            self._cached_tides = raw_tides
+            # Nothing is marked covered on an empty response so the next request retries
             if raw_tides:
-                self._cache_start = raw_tides[0].time.date()
-                self._cache_end = raw_tides[-1].time.date()
+                self._cache.add(fetch_start, fetch_end, raw_tides)
 
-        # Filter cached tides by date range and time filter
-        start_str = dt.strftime(start_day, DATEFMT)
-        end_str = dt.strftime(end_day, DATEFMT)
-
-        result: list[Tide] = []
-        for tide in self._cached_tides:
-            tide_date_str = dt.strftime(tide.time, DATEFMT)
-
-            # Check date range
-            if tide_date_str < start_str or tide_date_str > end_str:
-                continue
-
-            # Check time filter
-            if not passes_time_filter(tide.time, tide.sunriseTime, tide.sunsetTime, time_filter):
-                continue
-
-            result.append(tide)
-
-        return result
+        # Filter cached tides by time filter
+        return [tide for tide in self._cache.between(start, end)
+                if passes_time_filter(tide.time, tide.sunriseTime, tide.sunsetTime, time_filter)]
 
     def getSlacks(self, day: dt, time_filter: str = TIME_FILTER_ALL) -> list[TideDiveWindow]:
         """
@@ -385,6 +485,7 @@ class NoaaTideInterpreter(TideInterpreter):
     Uses the NOAA CO-OPS API to fetch tide predictions.
     API documentation: https://api.tidesandcurrents.noaa.gov/api/prod/
     """
+    PROFILE_SOURCE = 'noaa_tides'
 
     def _fetchTides(self, start_day: dt, days_in_future: int) -> list[Tide]:
         """
@@ -397,7 +498,9 @@ class NoaaTideInterpreter(TideInterpreter):
         url = f"{self.base_url}&begin_date={start_str}&end_date={end_str}"
 
         # Fetch from API
-        response = requests.get(url)
+        import requests
+        with profiling.timed('network.noaa_tides'):
+            response = requests.get(url)
         if response.status_code != 200:
             raise Exception(f'NOAA Tide API request failed: {response.status_code}')
 
@@ -426,6 +529,7 @@ class CanadaTideInterpreter(TideInterpreter):
 
     Station codes can be found at https://tides.gc.ca/en/stations
     """
+    PROFILE_SOURCE = 'canada_tides'
 
     METERS_TO_FEET = 3.28084
 
@@ -488,8 +592,10 @@ class CanadaTideInterpreter(TideInterpreter):
             f"&to={end_str}"
         )
 
+        import requests
         try:
-            response = requests.get(url)
+            with profiling.timed('network.canada_tides'):
+                response = requests.get(url)
             if response.status_code != 200:
                 raise Exception(f'Canada Tide API request failed: {response.status_code} - {response.text}')
 
@@ -555,6 +661,63 @@ class CanadaTideInterpreter(TideInterpreter):
                 tide.isHighTide = tide.height > tides[i - 1].height and tide.height > tides[i + 1].height
 
 
+class HarmonicTideInterpreter(TideInterpreter):
+    """
+    Computes high and low tides in process from the harmonic constants in harmonics.json (see harmonics.py).
+
+    There is no network round trip, so each miss predicts a whole year: the heights are evaluated on a 10 minute grid
+    with NumPy and every high and low is refined to well under a second.
+    """
+    PROFILE_SOURCE = 'harmonic_tides'
+    LOOKAHEAD_DAYS = 366
+
+    def __init__(self, base_url: str, station: StationConfig) -> None:
+        # Nothing is downloaded, pass a placeholder so the base class getTides check passes
+        super().__init__(base_url or 'harmonics.json', station)
+        self._harmonics = None  # harmonics.HarmonicStation, loaded on first use
+
+    def _get_harmonics(self):
+        import harmonics
+        if not self._harmonics:
+            self._harmonics = harmonics.get_station(self.station['name'])
+            if not self._harmonics or self._harmonics.kind != 'tide':
+                raise Exception('No harmonic tide constants for {} in {}'.format(self.station['name'],
+                                                                                 harmonics.HARMONICS_FILE))
+        return self._harmonics
+
+    def getTideArrays(self, start_day: dt, days: int) -> tuple:
+        """
+        Returns the highs and lows of the days starting at start_day as NumPy arrays, for analyses over many years
+        without building Tide objects.
+
+        Returns:
+            (times as local datetime64[s], heights in feet, True for high tides)
+        """
+        import harmonics
+        import numpy as np
+        station = self._get_harmonics()
+        start = day_start(start_day)
+        start_hours, end_hours = harmonics.to_hours([start, start + datetime.timedelta(days=days)], station.timezone)
+        with profiling.timed('slack_build.' + self.PROFILE_SOURCE):
+            hours, kinds, heights = station.events_hours(start_hours, end_hours)
+        times = np.array(harmonics.from_hours(hours, station.timezone), dtype='datetime64[s]')
+        return times, heights, kinds == 'high'
+
+    def _fetchTides(self, start_day: dt, days_in_future: int) -> list[Tide]:
+        station = self._get_harmonics()
+        start = day_start(start_day)
+        with profiling.timed('slack_build.' + self.PROFILE_SOURCE):
+            events = station.events(start, start + datetime.timedelta(days=days_in_future + 1))
+        tides: list[Tide] = []
+        for time, kind, height in events:
+            tide = Tide()
+            tide.time = time
+            tide.height = height
+            tide.isHighTide = kind == 'high'
+            tides.append(tide)
+        return tides
+
+
 def get_tide_interpreter(station_config: StationConfig) -> TideInterpreter:
     """
     Factory function to create the appropriate TideInterpreter for a station.
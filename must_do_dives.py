@@ -1,24 +1,34 @@
 '''
 This program is used to identify if days in the future (or past) are considered
 diveable for a subset of dive sites specified by dive_sites.json
+
+Every pair under must_do_dives and might_do_dives in dive_sites.json is checked:
+two dives at the same site, or one at each of two sites, on the same day. The
+diveable entry/exit intervals of each site are built once for the whole horizon,
+then a sorted sweep finds every pair of dives on a day that don't overlap, with
+the transfer time between them.
 '''
 
+import bisect
 import data_collect
 import interpreter as intp
 import dive_plan
+import prediction_cache
 
 from datetime import datetime as dt
+from datetime import timedelta as td
 import json
 
 
-# returns list of tuples [slack, info str] of the slacks for the given site that are diveable
+# returns list of tuples [slack, info str] of the slacks (or tide windows) for the given site that are diveable
 def getDiveable(slacks, site):
     diveableSlacks = []
     for s in slacks:
-        if s.ebbSpeed > 0.0:
-            print('WARNING - EBB SPEED IS POSITIVE')
-        if s.floodSpeed < 0.0:
-            print('WARNING - FLOOD SPEED IS NEGATIVE')
+        if isinstance(s, intp.Slack):
+            if s.ebbSpeed > 0.0:
+                print('WARNING - EBB SPEED IS POSITIVE')
+            if s.floodSpeed < 0.0:
+                print('WARNING - FLOOD SPEED IS NEGATIVE')
 
         # Check if diveable or not
         diveable, info = dive_plan.isDiveable(s, site, False)
@@ -33,6 +43,56 @@ def getSite(sites, name):
         if siteData['name'] == name:
             return siteData
 
+# returns the pairs {name1, name2} under the given keys of the json data, without duplicates
+def getPairs(data, keys):
+    pairs = []
+    for key in keys:
+        for pair in data.get(key, []):
+            if (pair['name1'], pair['name2']) not in [(p['name1'], p['name2']) for p in pairs]:
+                pairs.append(pair)
+    return pairs
+
+# returns [(entryTime, exitTime, window, info)] of every diveable window at the site over the given days, sorted by
+# entry time. Days the source fails to return are logged and skipped.
+def getDiveIntervals(site, m, days, timeFilter):
+    intervals = []
+    for day in days:
+        try:
+            windows = m.getSlacks(day, timeFilter)
+        except Exception as e:
+            print('Error fetching {} on {}: {}'.format(site['name'], dt.strftime(day, intp.DATEFMT), repr(e)))
+            continue
+        for s, info in getDiveable(windows, site):
+            times = dive_plan.getEntryTimes(s, site)
+            if times:
+                _, _, entryTime, exitTime = times
+                intervals.append((entryTime, exitTime, s, info))
+    intervals.sort(key=lambda x: x[0])
+    return intervals
+
+# returns [(first, second, transfer minutes)] for every dive in the sorted intervals `second` that starts at least
+# minTransfer minutes after a dive in `first` ends and on the same day. One binary search per dive in `first`, so
+# the cost is O((n + combinations) log n) instead of comparing every pair of dives.
+def getSchedules(first, second, minTransfer=0):
+    entries = [x[0] for x in second]
+    schedules = []
+    for a in first:
+        dayEnd = dt(a[0].year, a[0].month, a[0].day) + td(days=1)
+        lo = bisect.bisect_left(entries, a[1] + td(minutes=minTransfer))
+        hi = bisect.bisect_left(entries, dayEnd, lo)
+        for b in second[lo:hi]:
+            schedules.append((a, b, (b[0] - a[1]).total_seconds() / 60))
+    return schedules
+
+# returns [(first, second, transfer minutes, swapped)] schedules of two dives for the pair, sorted by the first entry
+# time. For different sites both orders are checked, swapped is True when the second site of the pair is dived first.
+def getPairSchedules(intervals1, intervals2, sameSite, minTransfer=0):
+    schedules = [(a, b, t, False) for a, b, t in getSchedules(intervals1, intervals2, minTransfer)]
+    if not sameSite:
+        schedules += [(a, b, t, True) for a, b, t in getSchedules(intervals2, intervals1, minTransfer)]
+    schedules.sort(key=lambda x: (x[0][0], x[1][0]))
+    return schedules
+
 def main():
 
     # ---------------------------------- CONFIGURABLE PARAMETERS -----------------------------------------------------------
@@ -49,7 +109,12 @@ def main():
         # dt(2019, 3, 3)
     ]
 
-    NOAA = False
+    PAIR_LISTS = ['must_do_dives', 'might_do_dives']  # keys of the site pairs in dive_sites.json
+    SOURCES = []  # preferred sources, e.g. ['Harmonic', 'NOAA'], the first one configured for each site by default
+    MIN_TRANSFER = 0  # minutes needed between the exit of the first dive and the entry of the second
+    PRINT_DIVES = False  # print the full dive plan of both dives of each schedule
+    USE_CACHE = True  # read through the prediction cache (see prefetch.py)
+    USE_CALENDAR = True  # read diveability from the materialised calendar (needs USE_CACHE), see dive_calendar.py
     # ----------------------------------------------------------------------------------------------------------------------
 
 
@@ -60,70 +125,56 @@ def main():
             possibleDiveDays = dive_plan.getAllDays(DAYS_IN_FUTURE, START)
 
     data = json.loads(open(data_collect.absName('dive_sites.json')).read())
-
-    for i in range(len(data['must_do_dives'])):
-        site1 = getSite(data['sites'], data['must_do_dives'][i]['name1'])
-        site2 = getSite(data['sites'], data['must_do_dives'][i]['name2'])
-
-        station1 = dive_plan.getStation(data['stations'], site1['data'])
-        station2 = dive_plan.getStation(data['stations'], site2['data'])
-
-        if NOAA:
-            m1 = intp.NoaaInterpreter(station1['url_noaa'])
-            m2 = intp.NoaaInterpreter(station2['url_noaa'])
+    cache = prediction_cache.PredictionCache() if USE_CACHE else None
+    calendar = None
+    if USE_CALENDAR and USE_CACHE:
+        import dive_calendar
+        calendar = dive_calendar.CalendarStore()
+    pairs = getPairs(data, PAIR_LISTS)
+
+    # Diveable intervals of every site in a pair, once for the whole horizon. Sites on the same station share an
+    # interpreter and its cache.
+    interpreters = {}
+    intervals = {}
+    for name in dict.fromkeys(n for p in pairs for n in (p['name1'], p['name2'])):
+        site = getSite(data['sites'], name)
+        if not site:
+            print('Unknown site {} in the site pairs'.format(name))
+            continue
+        key = dive_plan.stationKey(site)
+        if key not in interpreters:
+            _, choices = dive_plan.getInterpreters(site, data, cache)
+            interpreters[key] = dive_plan.pickInterpreter(choices, [s.lower() for s in SOURCES])
+        m, label = interpreters[key]
+        if m and calendar:
+            calendar.refresh(site, data, m, label, possibleDiveDays)
+            intervals[name] = calendar.getDiveIntervals(name, label, possibleDiveDays, TIME_FILTER)
         else:
-            m1 = intp.TBoneSCInterpreter(station1['url_xtide_a'], station1)
-            m2 = intp.TBoneSCInterpreter(station2['url_xtide_a'], station2)
-
-
-        print('{} - {}'.format(site1['name'], site2['name']))
-
-        for day in possibleDiveDays:
-            if site1 == site2:
-                slacks = m1.getSlacks(day, TIME_FILTER)
-                diveableSlacks = getDiveable(slacks, site1)
-                if len(diveableSlacks) >= 2:
-                    for s, info in diveableSlacks:
-                        dive_plan.printDive(s, site1, info)
-            else:
-                slacks1 = m1.getSlacks(day, TIME_FILTER)
-                diveableSlacks1 = getDiveable(slacks1, site1)
-
-                slacks2 = m2.getSlacks(day, TIME_FILTER)
-                diveableSlacks2 = getDiveable(slacks2, site2)
-
-                if len(diveableSlacks2) >= 2 or len(diveableSlacks1) >= 2:
-                    if len(diveableSlacks1) >= 2:
-                        print('WOW: {} is diveable twice today!'.format(site1['name']))
-                    else:
-                        print('WOW: {} is diveable twice today!'.format(site2['name']))
-                    for s, info in diveableSlacks1:
-                        dive_plan.printDive(s, site1, info)
-                    for s, info in diveableSlacks2:
-                        dive_plan.printDive(s, site2, info)
-
-                if len(diveableSlacks1) == 0:
-                    continue
-                if len(diveableSlacks2) == 0:
-                    continue
-
-                # each site is diveable once this day, print them if they don't overlap with each other
-                _, _, entryTime1, exitTime1 = dive_plan.getEntryTimes(diveableSlacks1[0][0], site1)
-                _, _, entryTime2, exitTime2 = dive_plan.getEntryTimes(diveableSlacks2[0][0], site2)
-
-                latest_start = max(entryTime1, entryTime2)
-                earliest_end = min(exitTime1, exitTime2)
-
-                if latest_start > earliest_end:
-                    print("BOTH SITES DIVEABLE: transfer time = {0:0.2f} minutes".format((latest_start-earliest_end).total_seconds() / 60))
-                    print("{} Diveable".format(site1['name']))
-                    dive_plan.printDive(diveableSlacks1[0][0], site1, diveableSlacks1[0][1])
-                    print("{} Diveable".format(site2['name']))
-                    dive_plan.printDive(diveableSlacks2[0][0], site2, diveableSlacks2[0][1])
-                else:
-                    print("{0}: Both sites diveable but times overlap by {1:0.2f} minutes".format(
-                        dt.strftime(day, intp.DATEFMT), (earliest_end-latest_start).total_seconds() / 60))
-
+            intervals[name] = getDiveIntervals(site, m, possibleDiveDays, TIME_FILTER) if m else []
+        print('{}: {} diveable windows ({})'.format(name, len(intervals[name]), label))
+
+    for pair in pairs:
+        name1, name2 = pair['name1'], pair['name2']
+        if name1 not in intervals or name2 not in intervals:
+            continue
+        schedules = getPairSchedules(intervals[name1], intervals[name2], name1 == name2, MIN_TRANSFER)
+        print()
+        print('{} - {}: {} schedules on {} days'.format(name1, name2, len(schedules),
+                                                        len({dt.strftime(a[0], intp.DATEFMT) for a, _, _, _ in schedules})))
+        for a, b, transfer, swapped in schedules:
+            first, second = (name2, name1) if swapped else (name1, name2)
+            print('\t{}: {} {}-{} -> transfer = {:0.0f} minutes -> {} {}-{}'.format(
+                dt.strftime(a[0], intp.DATEFMT), first, dt.strftime(a[0], intp.TIMEFMT),
+                dt.strftime(a[1], intp.TIMEFMT), transfer, second, dt.strftime(b[0], intp.TIMEFMT),
+                dt.strftime(b[1], intp.TIMEFMT)))
+            if PRINT_DIVES:
+                dive_plan.printDive(a[2], getSite(data['sites'], first), a[3])
+                dive_plan.printDive(b[2], getSite(data['sites'], second), b[3])
+
+    if cache:
+        cache.flush()
+    if calendar:
+        calendar.flush()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,130 @@
+'''
+Answers "what are the next N diveable windows anywhere?" across every site in dive_sites.json (or a subset).
+
+Each site gets a lazy, time-ordered stream of its diveable windows, walked day by day from its interpreter (whose
+range cache fetches ahead, so most days are cache hits) through the diveability calendar (see dive_calendar.py),
+refreshed a month of days ahead of the walk. The streams are merged with a heap-based k-way merge and the query
+stops as soon as N windows have come out. Every stream also yields an end-of-day marker, so a site with no diveable
+windows is only walked as far as the merged answer has reached, never to the end of the horizon. Work scales with
+the answer, not with the horizon times the number of sites.
+
+Examples:
+    python3 next_dives.py -n 10
+    python3 next_dives.py -n 5 -w --sites "deception pass, skyline wall, day island wall"
+    python3 next_dives.py -n 20 -d 2026-06-01 --sources harmonic --offline
+'''
+
+import argparse
+import heapq
+import itertools
+import json
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+import data_collect
+import dive_calendar
+import dive_plan
+import prediction_cache
+import rank_year_slacks
+import us_holidays
+from must_do_dives import getSite
+from dive_plan import pickInterpreter, stationKey
+from interpreter_common import DATEFMT, TIMEFMT
+
+CALENDAR_BLOCK_DAYS = 31  # days of a site refreshed in the calendar at once, ahead of reading them
+
+
+def isDiveDay(day, includeWorkdays, includeFridays):
+    '''Returns True if the day would be in dive_plan.getDiveDays with the same options.'''
+    if includeWorkdays:
+        return True
+    workdays = {0, 1, 2, 3} if includeFridays else {0, 1, 2, 3, 4}
+    return day.weekday() not in workdays or us_holidays.isHoliday(day)
+
+
+def siteWindows(index, site, m, label, start, horizonDays, timeFilter, includeWorkdays, includeFridays,
+                calendar=None, data=None):
+    '''
+    Yields (time, site index, window, label) for the diveable windows of the site in time order from the start day,
+    and (start of the next day, site index, None, None) markers after every day walked. Reads the diveability from
+    the calendar (a dive_calendar.CalendarStore, refreshed from the site's config in data) if given.
+    '''
+    days = [start + td(days=i) for i in range(horizonDays)]
+    for i, day in enumerate(days):
+        if calendar and i % CALENDAR_BLOCK_DAYS == 0:
+            block = [d for d in days[i:i + CALENDAR_BLOCK_DAYS] if isDiveDay(d, includeWorkdays, includeFridays)]
+            calendar.refresh(site, data, m, label, block)
+        if isDiveDay(day, includeWorkdays, includeFridays):
+            if calendar:
+                diveable = [r[0] for r in calendar.getDay(site['name'], label, day, timeFilter) or [] if r[1]]
+            else:
+                try:
+                    windows = m.getSlacks(day, timeFilter)
+                except Exception as e:
+                    print('Error fetching {} for {} on {}: {}'.format(label, site['name'], dt.strftime(day, DATEFMT),
+                                                                      repr(e)))
+                    windows = []
+                diveable = rank_year_slacks.diveableSlacks(windows, site)
+            for w in sorted(diveable, key=lambda w: w.time):
+                yield w.time, index, w, label
+        yield day + td(days=1), index, None, None
+
+
+def nextDives(sites, data, n, start, horizonDays=365, timeFilter='day', includeWorkdays=False,
+              includeFridays=False, sources=(), cache=None, offline=False, calendar=None):
+    '''
+    Returns [(site, window, source label)] of the first n diveable windows at any of the sites from the start day,
+    reading the diveability from the calendar (a dive_calendar.CalendarStore) if given.
+    '''
+    start = dt(start.year, start.month, start.day)
+    interpreters = {}  # sites on the same station share one interpreter and its cache
+    streams = []
+    for index, site in enumerate(sites):
+        key = stationKey(site)
+        if key not in interpreters:
+            _, choices = dive_plan.getInterpreters(site, data, cache, offline)
+            interpreters[key] = pickInterpreter(choices, sources)
+        m, label = interpreters[key]
+        if m:
+            streams.append(siteWindows(index, site, m, label, start, horizonDays, timeFilter, includeWorkdays,
+                                       includeFridays, calendar, data))
+    merged = heapq.merge(*streams, key=lambda e: (e[0], e[1]))
+    found = ((sites[index], w, label) for _, index, w, label in merged if w is not None)
+    return list(itertools.islice(found, n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the next diveable windows at any site')
+    parser.add_argument('-n', dest='N', default=10, type=int, help='Number of diveable windows to find')
+    parser.add_argument('--sites', default='', type=str,
+                        help='Comma-delimited site names to search, every site in dive_sites.json by default')
+    parser.add_argument('-d', '--start-date', dest='START', default=None, type=lambda d: dt.strptime(d, '%Y-%m-%d'),
+                        help='First day to search in the format yyyy-mm-dd, today by default')
+    parser.add_argument('--horizon', default=365, type=int, help='Stop searching a site after this many days')
+    dive_plan.add_arguments(parser)
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    if args.sites:
+        sites = [getSite(data['sites'], name) for name in dive_plan.parse_sites(args.sites, data['sites'])]
+    else:
+        sites = data['sites']
+    cache = None if args.NO_CACHE else prediction_cache.PredictionCache()
+    calendar = None if args.NO_CACHE or args.NO_CALENDAR else dive_calendar.CalendarStore()
+
+    dives = nextDives(sites, data, args.N, args.START or dt.now(), args.horizon, args.TIME_FILTER,
+                      args.INCLUDE_WORKDAYS, args.INCLUDE_FRIDAYS, args.sources, cache, args.OFFLINE, calendar)
+    for i, (site, w, label) in enumerate(dives):
+        times = dive_plan.getEntryTimes(w, site)
+        entry = '\tEntry {}'.format(dt.strftime(times[2], TIMEFMT)) if times else ''
+        print('{:>3}. {:<28} {}{}\t({})'.format(i + 1, site['name'][:28], w, entry, label))
+    if len(dives) < args.N:
+        print('Only {} diveable windows found within {} days'.format(len(dives), args.horizon))
+    if cache:
+        cache.flush()
+    if calendar:
+        calendar.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+'''
+Multi-objective ranking of dive windows, vectorised with NumPy.
+
+Every window has costs to minimise, e.g. the current speed sum, the negated margin to sunrise/sunset and whether it
+falls on a workday. skyline() finds the Pareto front, the windows no other window beats on every cost, in
+O(n log n) for two continuous costs plus an optional cost with a few discrete levels (like workday 0/1).
+weighted_scores() collapses the costs to one number for a plain ranking instead.
+'''
+
+import numpy as np
+
+
+def skyline(costs, levels=None) -> np.ndarray:
+    '''
+    Returns a boolean mask of the rows of costs that no other row dominates.
+
+    Args:
+        costs: (n, 2) array of continuous costs, lower is better.
+        levels: Optional (n,) array of a discrete cost with few distinct values, lower is better.
+
+    A row dominates another if it is no worse in every cost and better in at least one. Identical rows don't
+    dominate each other, so all copies of a non-dominated row are kept.
+    '''
+    costs = np.asarray(costs, dtype=float).reshape(-1, 2)
+    n = len(costs)
+    if levels is None:
+        levels = np.zeros(n, dtype=int)
+    levels = np.asarray(levels)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+
+    # copies are judged once, by one representative row
+    rows = np.column_stack([costs, levels])
+    unique, inverse = np.unique(rows, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # np.unique sorts rows lexicographically by the first cost, then the second, then the level. Any row earlier in
+    # that order with no worse second cost and level dominates the row. For each level, sweep the running minimum of
+    # the second cost over the earlier rows with at most that level.
+    second, level = unique[:, 1], unique[:, 2]
+    dominated = np.zeros(len(unique), dtype=bool)
+    for value in np.unique(level):
+        eligible = np.where(level <= value, second, np.inf)
+        earlierMin = np.concatenate([[np.inf], np.minimum.accumulate(eligible)[:-1]])
+        at = level == value
+        dominated[at] = earlierMin[at] <= second[at]
+    return ~dominated[inverse]
+
+
+def weighted_scores(costs, weights) -> np.ndarray:
+    '''Returns the weighted sum of each row of the (n, k) costs, lower is better.'''
+    return np.asarray(costs, dtype=float).reshape(len(costs), -1) @ np.asarray(weights, dtype=float)
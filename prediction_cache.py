@@ -0,0 +1,294 @@
+'''
+Persistent per-day cache of the dive windows (current slacks and high/low tides) returned by the interpreters.
+
+Windows are stored unfiltered (TIME_FILTER_ALL) in one JSON file per source and station under prediction-cache/,
+keyed by day. The time filter is applied when reading. Cached days don't expire: a day is only fetched again by
+prefetch.py --refresh, which is how to pick up predictions a source revised after they were cached. Bump
+CACHE_VERSION if the stored fields or the parsing of a source changes.
+
+prefetch.py fills the cache ahead of time. dive_plan.py and rank_year_slacks.py read through it, so a day that
+has been prefetched never touches the network. Saving merges in the days another process (e.g. a rank_batch.py
+worker on the same station, or prefetch.py --refresh) wrote to the file since it was loaded, keeping only the days
+this process put. The merge and the write hold an exclusive lock on a .lock file next to the cache file, so
+concurrent processes never lose each other's days, and each write goes through its own temporary file.
+'''
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime as dt
+
+try:
+    import fcntl
+except ImportError:  # Windows, saves are only serialised within one process
+    fcntl = None
+
+import data_collect
+import profiling
+from interpreter_common import DATEFMT, TIME_FILTER_ALL, passes_time_filter
+
+CACHE_DIR = 'prediction-cache'
+CACHE_VERSION = 1
+
+
+# ----------------------------------------- (de)serialization --------------------------------------------------------
+def timeToStr(t) -> str:
+    '''Returns the ISO format of a datetime, or None.'''
+    return t.isoformat() if t else None
+
+
+def timeFromStr(s):
+    '''Inverse of timeToStr.'''
+    return dt.fromisoformat(s) if s else None
+
+
+def _tideToDict(tide):
+    if tide is None:
+        return None
+    return {'time': timeToStr(tide.time), 'height': tide.height, 'high': tide.isHighTide,
+            'sunrise': timeToStr(tide.sunriseTime), 'sunset': timeToStr(tide.sunsetTime), 'moon': tide.moonPhase}
+
+
+def _tideFromDict(d):
+    import interpreter_tides
+    if d is None:
+        return None
+    tide = interpreter_tides.Tide()
+    tide.time = timeFromStr(d['time'])
+    tide.height = d['height']
+    tide.isHighTide = d['high']
+    tide.sunriseTime = timeFromStr(d['sunrise'])
+    tide.sunsetTime = timeFromStr(d['sunset'])
+    tide.moonPhase = d['moon']
+    return tide
+
+
+def windowToDict(w) -> dict:
+    '''Returns a JSON serializable dict for a Slack or TideDiveWindow.'''
+    if hasattr(w, 'tide'):
+        return {'kind': 'tide', 'tide': _tideToDict(w.tide), 'prev': _tideToDict(w.prevTide),
+                'next': _tideToDict(w.nextTide)}
+    return {'kind': 'slack', 'time': timeToStr(w.time), 'sunrise': timeToStr(w.sunriseTime),
+            'sunset': timeToStr(w.sunsetTime), 'moon': w.moonPhase, 'beforeEbb': w.slackBeforeEbb,
+            'ebb': w.ebbSpeed, 'flood': w.floodSpeed, 'maxEbb': timeToStr(w.maxEbbTime),
+            'maxFlood': timeToStr(w.maxFloodTime)}
+
+
+def windowFromDict(d):
+    '''Inverse of windowToDict.'''
+    if d['kind'] == 'tide':
+        import interpreter_tides
+        return interpreter_tides.TideDiveWindow(_tideFromDict(d['tide']), _tideFromDict(d['prev']),
+                                                _tideFromDict(d['next']))
+    import interpreter
+    s = interpreter.Slack()
+    s.time = timeFromStr(d['time'])
+    s.sunriseTime = timeFromStr(d['sunrise'])
+    s.sunsetTime = timeFromStr(d['sunset'])
+    s.moonPhase = d['moon']
+    s.slackBeforeEbb = d['beforeEbb']
+    s.ebbSpeed = d['ebb']
+    s.floodSpeed = d['flood']
+    s.maxEbbTime = timeFromStr(d['maxEbb'])
+    s.maxFloodTime = timeFromStr(d['maxFlood'])
+    return s
+
+
+def slug(name) -> str:
+    '''Returns name as a lowercase file name.'''
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+@contextmanager
+def fileLock(path):
+    '''Holds an exclusive lock on path + '.lock' across processes (and threads, flock locks are per open file).'''
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def writeJson(path, contents):
+    '''Writes compact JSON through a temporary file of its own, so an interrupted write never leaves half a file.'''
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(contents, f, separators=(',', ':'))
+        os.replace(tmp, path)  # atomic
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+# ----------------------------------------- cache ---------------------------------------------------------------------
+class _CacheFile:
+    '''The cached days of one source at one station, loaded on first use.'''
+
+    def __init__(self, path, source, station):
+        self.path = path
+        self.lock = threading.Lock()
+        self.saveLock = threading.Lock()  # one save of the file at a time
+        self.dirty = False
+        self.days = self._read()  # 'YYYY-MM-DD' -> list of window dicts
+        self.fingerprints = {}  # 'YYYY-MM-DD' -> hash of the day's window dicts, computed on first use
+        self.changed = set()  # days put since the last save
+        self.header = {'version': CACHE_VERSION, 'source': source, 'station': station}
+
+    def _read(self):
+        '''Returns the days stored in the file, {} if there is none or it is unreadable.'''
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    contents = json.load(f)
+                if contents.get('version') == CACHE_VERSION:
+                    return contents['days']
+            except (OSError, ValueError, KeyError) as e:
+                print('Ignoring unreadable prediction cache file {}: {}'.format(self.path, repr(e)))
+        return {}
+
+    def save(self):
+        with self.saveLock, fileLock(self.path):
+            self._save()
+
+    def _save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+        onDisk = self._read()
+        with self.lock:
+            # the days put here win, every other day is taken from disk in case another process refreshed it
+            for day, dicts in onDisk.items():
+                if day not in self.changed:
+                    self.days[day] = dicts
+                    self.fingerprints.pop(day, None)
+            # snapshot, other threads keep adding days while this one writes
+            contents = dict(self.header, days=dict(self.days))
+            changed, self.changed = self.changed, set()
+            self.dirty = False
+        try:
+            writeJson(self.path, contents)
+        except BaseException:
+            with self.lock:
+                self.changed |= changed
+                self.dirty = True  # the days are still unsaved, the next flush retries
+            raise
+
+    def fingerprint(self, key):
+        '''Returns a hash of the stored windows of the day, or None if the day is not stored.'''
+        with self.lock:
+            if key not in self.fingerprints:
+                dicts = self.days.get(key)
+                if dicts is None:
+                    return None
+                self.fingerprints[key] = hashlib.sha1(json.dumps(dicts, sort_keys=True).encode()).hexdigest()[:16]
+            return self.fingerprints[key]
+
+
+class PredictionCache:
+    '''Thread safe store of per-day windows for (source, station) pairs.'''
+
+    def __init__(self, directory=None):
+        self.directory = directory or data_collect.absName(CACHE_DIR)
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _file(self, source, station) -> _CacheFile:
+        key = (source, station)
+        with self._lock:
+            f = self._files.get(key)
+            if f is None:
+                path = os.path.join(self.directory, slug(source), slug(station) + '.json')
+                f = self._files[key] = _CacheFile(path, source, station)
+            return f
+
+    def getDay(self, source, station, day):
+        '''Returns the cached unfiltered windows for the day, or None if the day is not cached.'''
+        f = self._file(source, station)
+        with f.lock:
+            dicts = f.days.get(dt.strftime(day, DATEFMT))
+        if dicts is None:
+            return None
+        return [windowFromDict(d) for d in dicts]
+
+    def hasDay(self, source, station, day) -> bool:
+        f = self._file(source, station)
+        with f.lock:
+            return dt.strftime(day, DATEFMT) in f.days
+
+    def putDay(self, source, station, day, windows):
+        f = self._file(source, station)
+        dicts = [windowToDict(w) for w in windows]
+        key = dt.strftime(day, DATEFMT)
+        with f.lock:
+            f.days[key] = dicts
+            f.fingerprints.pop(key, None)
+            f.changed.add(key)
+            f.dirty = True
+
+    def dayFingerprint(self, source, station, day):
+        '''
+        Returns a hash of the cached windows of the day, or None if the day is not cached. It changes whenever the
+        day is refetched with different predictions (e.g. prefetch.py --refresh), see dive_calendar.py.
+        '''
+        return self._file(source, station).fingerprint(dt.strftime(day, DATEFMT))
+
+    def flush(self):
+        '''Writes every modified file to disk.'''
+        with self._lock:
+            files = list(self._files.values())
+        for f in files:
+            f.save()
+
+
+class CachedInterpreter:
+    '''
+    Read-through cache in front of an Interpreter or TideInterpreter with the same getSlacks(day, time_filter)
+    interface. Cache misses are fetched unfiltered from the wrapped interpreter and stored, unless offline is set,
+    in which case a miss returns no windows. Days where the source returned nothing are not stored since that is
+    how the interpreters report fetch errors. Other attributes (getDayUrl, numAPICalls, ...) come from the wrapped
+    interpreter.
+    '''
+
+    def __init__(self, inner, source, station, cache, offline=False):
+        self.inner = inner
+        self.source = source
+        self.stationName = station['name']
+        self.cache = cache
+        self.offline = offline
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def missingDays(self, days):
+        return [d for d in days if not self.cache.hasDay(self.source, self.stationName, d)]
+
+    def fingerprint(self, day):
+        '''Returns a hash of the cached windows of the day, or None if it is not cached, see dayFingerprint.'''
+        return self.cache.dayFingerprint(self.source, self.stationName, day)
+
+    def getSlacks(self, day, time_filter):
+        windows = self.cache.getDay(self.source, self.stationName, day)
+        if windows is not None:
+            profiling.cache_hit('prediction_cache')
+        else:
+            profiling.cache_miss('prediction_cache')
+            if self.offline:
+                print('{} predictions for {} on {} are not cached, run prefetch.py'.format(
+                    self.source, self.stationName, dt.strftime(day, DATEFMT)))
+                return []
+            windows = self.inner.getSlacks(day, TIME_FILTER_ALL)
+            if windows:
+                self.cache.putDay(self.source, self.stationName, day, windows)
+        return [w for w in windows if passes_time_filter(w.time, w.sunriseTime, w.sunsetTime, time_filter)]
@@ -0,0 +1,204 @@
+'''
+Fills the persistent prediction cache (see prediction_cache.py) so that dive_plan.py and rank_year_slacks.py can
+plan without touching the network.
+
+Walks every station and tide_station in dive_sites.json and every source configured for it (NOAA, Canada API,
+Canada PDF for stations with a ca_code, Dairiki, XTide, harmonic, tides), one job per station and source, run in
+parallel. Each source is walked day by day so it fetches its own preferred range per request (14 days for NOAA and
+the Canada API, a month for Dairiki, a year per CHS PDF, the whole range in one XTide Docker run or harmonic
+prediction). The cache is written and a progress line printed after every range, and days already cached are
+skipped, so an interrupted prefetch resumes where it stopped. --refresh refetches cached days, e.g. to pick up
+revised predictions.
+
+Examples:
+    python3 prefetch.py                      # next 30 days for every station and source
+    python3 prefetch.py --futuredays 120 --workers 16
+    python3 prefetch.py --year 2027 --sources "canada pdf,dairiki"
+    python3 prefetch.py --stations "deception, gabriola" --refresh
+'''
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+import data_collect
+import dive_plan
+import interpreter as intp
+import prediction_cache
+import profiling
+from interpreter_common import DATEFMT, TIME_FILTER_ALL
+
+# days covered by one request of each source, the cache is saved after each range
+RANGE_DAYS = {
+    'NOAA': 14,
+    'Canada API': 14,
+    'Dairiki': 31,
+    'Canada PDF': 366,
+    'XTide Docker': 366,
+    'Harmonic': 366,
+    'XTide': 7,
+    'Tide': 3,
+    'Harmonic Tide': 366,
+}
+
+
+class Progress:
+    '''Thread safe job and day counters with one line printed per fetched range and per finished job.'''
+
+    def __init__(self, jobs, days):
+        self.lock = threading.Lock()
+        self.jobs = jobs
+        self.days = days
+        self.jobsDone = 0
+        self.daysDone = 0
+        self.fetched = 0
+        self.errors = 0
+        self.start = time.perf_counter()
+
+    def addDays(self, n):
+        with self.lock:
+            self.daysDone += n
+
+    def _status(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.daysDone / elapsed if elapsed else 0.0
+        remaining = (self.days - self.daysDone) / rate if rate else 0.0
+        return '[{:>4}/{} jobs, {:>3.0f}% days, ~{:.0f}s left]'.format(
+            self.jobsDone, self.jobs, self.daysDone / self.days * 100 if self.days else 100, remaining)
+
+    def finishRange(self, label, stationName, first, last, fetched, errors):
+        with self.lock:
+            print('{} {:<12} {:<60} {} to {}: {} fetched, {} errors'.format(
+                self._status(), label, stationName[:60], dt.strftime(first, DATEFMT), dt.strftime(last, DATEFMT),
+                fetched, errors))
+
+    def finishJob(self, label, stationName, fetched, cached, errors, seconds):
+        with self.lock:
+            self.jobsDone += 1
+            self.fetched += fetched
+            self.errors += errors
+            print('{} {:<12} {:<60} {} fetched, {} cached, {} errors ({:.1f}s)'.format(
+                self._status(), label, stationName[:60], fetched, cached, errors, seconds))
+
+
+def getJobs(data, sources, stationFilter):
+    '''Returns [(station, interpreter, label)] for every configured source of every (matching) station.'''
+    jobs = []
+    stations = [(s, dive_plan.getStationInterpreters) for s in data['stations']]
+    stations += [(s, dive_plan.getTideStationInterpreters) for s in data['tide_stations']]
+    for station, getInterpreters in stations:
+        if stationFilter and not any(f in station['name'].lower() for f in stationFilter):
+            continue
+        for m, label in getInterpreters(station):
+            if sources and label.lower() not in sources:
+                continue
+            jobs.append((station, m, label))
+    return jobs
+
+
+def prefetchJob(station, m, label, days, cache, refresh, progress, stop):
+    start = time.perf_counter()
+    stationName = station['name']
+    todo = days if refresh else [d for d in days if not cache.hasDay(label, stationName, d)]
+    progress.addDays(len(days) - len(todo))
+    fetched, errors = 0, 0
+    if todo and isinstance(m, intp.XTideDockerInterpreter):
+        try:
+            m.preload_range(todo[0], todo[-1])  # one container run (or harmonic prediction) for the whole range
+        except Exception as e:
+            print('Error preloading {} for {}: {}'.format(label, stationName, repr(e)))
+    rangeDays = RANGE_DAYS.get(label, 7)
+    rangeDone = []  # days of the current range, saved and reported once the day after it comes up
+
+    def finishRange():
+        cache.flush()
+        if rangeDone:
+            progress.finishRange(label, stationName, rangeDone[0], rangeDone[-1], fetched - rangeFetched,
+                                 errors - rangeErrors)
+
+    for day in todo:
+        if stop.is_set():
+            break
+        if rangeDone and day >= rangeDone[0] + td(days=rangeDays):
+            finishRange()
+            rangeDone = []
+        if not rangeDone:
+            rangeFetched, rangeErrors = fetched, errors
+        try:
+            windows = m.getSlacks(day, TIME_FILTER_ALL)
+        except Exception as e:
+            print('Error fetching {} for {} on {}: {}'.format(label, stationName, dt.strftime(day, DATEFMT), repr(e)))
+            windows = []
+        if windows:
+            cache.putDay(label, stationName, day, windows)
+            fetched += 1
+        else:
+            errors += 1
+        rangeDone.append(day)
+        progress.addDays(1)
+    finishRange()
+    progress.finishJob(label, stationName, fetched, len(days) - len(todo), errors, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prefetch predictions for every station into the prediction cache')
+    parser.add_argument('-f', '--futuredays', dest='DAYS_IN_FUTURE', default=30, type=int,
+                        help='Number of days after the start date to prefetch')
+    parser.add_argument('-d', '--start-date', dest='START', default=None, type=lambda d: dt.strptime(d, '%Y-%m-%d'),
+                        help='First day to prefetch in the format yyyy-mm-dd, today by default')
+    parser.add_argument('--year', dest='YEAR', default=None, type=int,
+                        help='Prefetch the whole calendar year instead of --start-date/--futuredays')
+    parser.add_argument('--sources', default='', type=str,
+                        help='Comma-delimited subset of sources ({})'.format(', '.join(RANGE_DAYS)))
+    parser.add_argument('--stations', default='', type=str,
+                        help='Comma-delimited station name substrings to limit the prefetch to')
+    parser.add_argument('--workers', default=8, type=int, help='Station/source jobs fetched concurrently')
+    parser.add_argument('--refresh', action='store_true', default=False, help='Refetch days that are already cached')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start_from_args(args)
+
+    if args.YEAR:
+        start = dt(args.YEAR, 1, 1)
+        days = dive_plan.getAllDays((dt(args.YEAR, 12, 31) - start).days, start)
+    else:
+        days = dive_plan.getAllDays(args.DAYS_IN_FUTURE, args.START or dt.now())
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    sources = [s.strip().lower() for s in args.sources.split(',') if s.strip()]
+    stationFilter = [s.strip().lower() for s in args.stations.split(',') if s.strip()]
+    jobs = getJobs(data, sources, stationFilter)
+    if not jobs:
+        print('No stations and sources matched')
+        exit(1)
+
+    cache = prediction_cache.PredictionCache()
+    progress = Progress(len(jobs), len(jobs) * len(days))
+    print('Prefetching {} to {} for {} station/source jobs into {}'.format(
+        dt.strftime(days[0], DATEFMT), dt.strftime(days[-1], DATEFMT), len(jobs), cache.directory))
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    try:
+        futures = [pool.submit(prefetchJob, station, m, label, days, cache, args.refresh, progress, stop)
+                   for station, m, label in jobs]
+        for future in as_completed(futures):
+            future.result()
+    except KeyboardInterrupt:
+        print('Interrupted, saving what has been fetched so far. Rerun to resume.')
+        stop.set()
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        cache.flush()
+
+    print('Done in {:.1f}s: {} days fetched, {} days without predictions'.format(
+        time.perf_counter() - progress.start, progress.fetched, progress.errors))
+    profiling.report_from_args(args)
+
+
+if __name__ == '__main__':
+    main()
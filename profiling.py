@@ -0,0 +1,209 @@
+'''
+Lightweight run-time instrumentation shared by the interpreters and tools.
+
+Records counters and inclusive wall-clock timers keyed by 'category.source', for example
+'network.noaa', 'docker.xtide', 'pdf_parse.chs', 'html_parse.dairiki', 'slack_build.xtide',
+'ephemeris.sun_moon' and 'evaluation.is_diveable', plus cache hit/miss counts per source.
+
+Instrumentation is off by default and costs one function call per timed block while off.
+Enable it with enable() (the --profile and --profile-trace flags on dive_plan.py and
+rank_year_slacks.py), then print_summary() for a table or write_chrome_trace() for
+chrome://tracing / Perfetto.
+
+Usage:
+    with profiling.timed('network.noaa'):
+        response = requests.get(url)
+    profiling.cache_hit('noaa')
+'''
+
+import argparse
+import json
+import threading
+import time
+from typing import Optional
+
+# Timer categories in the order they are printed in the summary
+CATEGORIES = ['network', 'docker', 'pdf_parse', 'html_parse', 'slack_build', 'ephemeris', 'evaluation']
+
+_enabled = False
+_trace = False
+_lock = threading.Lock()
+_counters: dict[str, int] = {}
+_timers: dict[str, list] = {}  # name -> [calls, total seconds, max seconds]
+_traceEvents: list[dict] = []
+_origin = time.perf_counter()  # when instrumentation was enabled, trace timestamps are relative to it
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.start, time.perf_counter())
+        return False
+
+
+def enable(trace: bool = False) -> None:
+    """Turn on instrumentation. If trace is True, each timed block is also kept for the Chrome trace export."""
+    global _enabled, _trace, _origin
+    if not _enabled:
+        _origin = time.perf_counter()
+    _enabled = True
+    _trace = _trace or trace
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Clear all recorded counters, timers and trace events."""
+    global _origin
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+        _traceEvents.clear()
+        _origin = time.perf_counter()
+
+
+def timed(name: str):
+    """Context manager timing the enclosed block under the given 'category.source' name."""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add n to the named counter."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def cache_hit(source: str) -> None:
+    count('cache.{}.hit'.format(source))
+
+
+def cache_miss(source: str) -> None:
+    count('cache.{}.miss'.format(source))
+
+
+def _record(name: str, start: float, end: float) -> None:
+    elapsed = end - start
+    with _lock:
+        timer = _timers.get(name)
+        if timer is None:
+            _timers[name] = [1, elapsed, elapsed]
+        else:
+            timer[0] += 1
+            timer[1] += elapsed
+            if elapsed > timer[2]:
+                timer[2] = elapsed
+        if _trace:
+            category = name.split('.', 1)[0]
+            _traceEvents.append({
+                'name': name, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': threading.get_ident(),
+                'ts': (start - _origin) * 1e6, 'dur': elapsed * 1e6,
+            })
+
+
+def summary() -> dict:
+    """Returns {'run_seconds': float, 'timers': {name: {...}}, 'counters': {...}, 'cache': {source: {...}}}."""
+    with _lock:
+        timers = {name: {'calls': t[0], 'total_seconds': t[1], 'max_seconds': t[2]} for name, t in _timers.items()}
+        counters = dict(_counters)
+    cache: dict[str, dict] = {}
+    for name, n in counters.items():
+        if name.startswith('cache.'):
+            _, source, kind = name.split('.', 2)
+            cache.setdefault(source, {'hit': 0, 'miss': 0})[kind] = n
+    for stats in cache.values():
+        lookups = stats['hit'] + stats['miss']
+        stats['hit_ratio'] = stats['hit'] / lookups if lookups else 0.0
+    return {'run_seconds': time.perf_counter() - _origin, 'timers': timers, 'counters': counters, 'cache': cache}
+
+
+def print_summary() -> None:
+    """Print a per-category and per-source timing table, the counters and the cache hit ratios."""
+    data = summary()
+    timers = data['timers']
+    run_total = data['run_seconds']
+
+    def sort_key(name):
+        category = name.split('.', 1)[0]
+        return (CATEGORIES.index(category) if category in CATEGORIES else len(CATEGORIES), name)
+
+    print()
+    print('Profiled run time: {:.3f}s'.format(run_total))
+    print('{:<36} {:>8} {:>11} {:>10} {:>10} {:>7}'.format('Timer (inclusive)', 'calls', 'total', 'mean', 'max',
+                                                              '% run'))
+    for name in sorted(timers, key=sort_key):
+        t = timers[name]
+        share = '{:.1f}'.format(t['total_seconds'] / run_total * 100) if run_total else ''
+        print('{:<36} {:>8} {:>10.3f}s {:>8.2f}ms {:>8.2f}ms {:>7}'.format(
+            name, t['calls'], t['total_seconds'], t['total_seconds'] / t['calls'] * 1000,
+            t['max_seconds'] * 1000, share))
+    counters = {k: v for k, v in data['counters'].items() if not k.startswith('cache.')}
+    if counters:
+        print()
+        print('{:<36} {:>8}'.format('Counter', 'count'))
+        for name in sorted(counters):
+            print('{:<36} {:>8}'.format(name, counters[name]))
+    if data['cache']:
+        print()
+        print('{:<36} {:>8} {:>8} {:>10}'.format('Cache', 'hits', 'misses', 'hit ratio'))
+        for source in sorted(data['cache']):
+            c = data['cache'][source]
+            print('{:<36} {:>8} {:>8} {:>9.1f}%'.format(source, c['hit'], c['miss'], c['hit_ratio'] * 100))
+
+
+def write_chrome_trace(path: str, metadata: Optional[dict] = None) -> None:
+    """Write the recorded timed blocks in Chrome trace event format (load in chrome://tracing or Perfetto)."""
+    with _lock:
+        events = list(_traceEvents)
+        counters = dict(_counters)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                   'otherData': dict(metadata or {}, counters=counters)}, f)
+    print('Chrome trace with {} events written to {}'.format(len(events), path))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the --profile and --profile-trace options to a tool's argument parser."""
+    parser.add_argument('--profile', action='store_true', default=False, dest='PROFILE',
+                        help='Print per-stage timers, counters and cache hit ratios after the run')
+    parser.add_argument('--profile-trace', default=None, dest='PROFILE_TRACE', metavar='FILE',
+                        help='Write a Chrome trace JSON of the run to FILE (chrome://tracing or ui.perfetto.dev)')
+
+
+def start_from_args(args: argparse.Namespace) -> None:
+    """Enables instrumentation if either profiling option was given."""
+    if args.PROFILE or args.PROFILE_TRACE:
+        enable(trace=bool(args.PROFILE_TRACE))
+
+
+def report_from_args(args: argparse.Namespace) -> None:
+    """Prints the summary table and/or writes the Chrome trace requested by the profiling options."""
+    if args.PROFILE:
+        print_summary()
+    if args.PROFILE_TRACE:
+        write_chrome_trace(args.PROFILE_TRACE)
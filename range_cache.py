@@ -0,0 +1,142 @@
+"""
+Interval-aware cache of time-ordered prediction events (slacks or tides).
+
+Keeps the set of fetched [start, end) ranges merged into disjoint intervals, and all events fetched for them
+de-duplicated and sorted by time. Interpreters ask for the uncovered gaps of a range, fetch only those (usually
+extended by a look-ahead so a day by day walk hits the cache), and read events back with a binary search.
+"""
+
+import bisect
+from datetime import datetime as dt
+from datetime import timedelta as td
+from typing import Any, Callable, Hashable, Optional
+
+
+def day_start(day) -> dt:
+    """Returns midnight at the start of the given date or datetime."""
+    return dt(day.year, day.month, day.day)
+
+
+class RangeCache:
+    """
+    Events from possibly overlapping fetches, with the covered time ranges.
+
+    Args:
+        key: Returns the identity of an event for de-duplication. Defaults to the event time.
+        lookahead_days: Extra days past a requested range that callers should fetch on a miss.
+    """
+
+    def __init__(self, key: Optional[Callable[[Any], Hashable]] = None, lookahead_days: int = 0) -> None:
+        self.lookahead_days = lookahead_days
+        self._key = key or (lambda e: e.time)
+        self._intervals: list[list[dt]] = []  # sorted, disjoint and non-adjacent [start, end)
+        self._times: list[dt] = []            # event times, parallel to _events
+        self._events: list[Any] = []
+        self._keys: set = set()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def clear(self) -> None:
+        self._intervals.clear()
+        self._times.clear()
+        self._events.clear()
+        self._keys.clear()
+
+    @property
+    def intervals(self) -> list[tuple[dt, dt]]:
+        return [(s, e) for s, e in self._intervals]
+
+    def add(self, start: dt, end: dt, events: list) -> None:
+        """
+        Records [start, end) as covered and merges in its events, skipping ones already cached. Events outside
+        [start, end) are dropped: fetches are padded past the range and the events near their edges can be incomplete
+        (e.g. a slack missing the max current after it), the fetch that covers them stores the complete ones.
+        """
+        if start >= end:
+            return
+        self._add_interval(start, end)
+        new = []
+        for e in events:
+            if not start <= e.time < end:
+                continue
+            k = self._key(e)
+            if k not in self._keys:
+                self._keys.add(k)
+                new.append(e)
+        if not new:
+            return
+        new.sort(key=lambda e: e.time)
+        if not self._times or new[0].time >= self._times[-1]:
+            # the common case of walking forward in time, no need to re-sort
+            self._events.extend(new)
+            self._times.extend(e.time for e in new)
+        else:
+            self._events = sorted(self._events + new, key=lambda e: e.time)
+            self._times = [e.time for e in self._events]
+
+    def _add_interval(self, start: dt, end: dt) -> None:
+        # first interval that could touch [start, end), and the first one past it
+        i = bisect.bisect_left([e for _, e in self._intervals], start)
+        j = i
+        while j < len(self._intervals) and self._intervals[j][0] <= end:
+            start = min(start, self._intervals[j][0])
+            end = max(end, self._intervals[j][1])
+            j += 1
+        self._intervals[i:j] = [[start, end]]
+
+    def gaps(self, start: dt, end: dt) -> list[tuple[dt, dt]]:
+        """Returns the uncovered parts of [start, end) in order."""
+        result = []
+        cursor = start
+        for s, e in self._intervals:
+            if e <= cursor:
+                continue
+            if s >= end:
+                break
+            if s > cursor:
+                result.append((cursor, s))
+            cursor = max(cursor, e)
+            if cursor >= end:
+                break
+        if cursor < end:
+            result.append((cursor, end))
+        return result
+
+    def covers(self, start: dt, end: dt) -> bool:
+        return not self.gaps(start, end)
+
+    def covers_day(self, day) -> bool:
+        start = day_start(day)
+        return self.covers(start, start + td(days=1))
+
+    def between(self, start: dt, end: dt) -> list:
+        """Returns the cached events with start <= time < end."""
+        lo = bisect.bisect_left(self._times, start)
+        hi = bisect.bisect_left(self._times, end, lo)
+        return self._events[lo:hi]
+
+    def on_day(self, day) -> list:
+        start = day_start(day)
+        return self.between(start, start + td(days=1))
+
+    def all(self) -> list:
+        return list(self._events)
+
+    def fetch_range(self, day, days: int = 1) -> Optional[tuple[dt, dt]]:
+        """
+        Returns the [start, end) to fetch so that the days starting at day are covered, extended by the look-ahead:
+        from the first uncovered moment to the end of the look-ahead, clipped at the next covered interval (covered
+        parts between gaps are fetched again and de-duplicated). Returns None if the requested days are covered.
+        """
+        start = day_start(day)
+        missing = self.gaps(start, start + td(days=days))
+        if not missing:
+            return None
+        fetch_start = missing[0][0]
+        fetch_end = max(missing[-1][1], start + td(days=days + self.lookahead_days))
+        for s, _ in self._intervals:
+            if missing[-1][1] <= s < fetch_end:
+                fetch_end = s
+                break
+        return fetch_start, fetch_end
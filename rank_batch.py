@@ -0,0 +1,236 @@
+'''
+Ranks the diveable slacks (or tide windows) of every site in dive_sites.json, or a chosen subset, over many years in
+one run. The batch mode of rank_year_slacks.py.
+
+Work is split into one job per station and year, run in a process pool. Every site on a station is ranked from the
+same predictions, so a station's windows are only fetched or computed once per year. Workers get the station data
+once when they start and read through the prediction cache and the diveability calendar (see dive_calendar.py), so
+prefetched or harmonic predictions make a full region sweep a matter of minutes. The results are merged into one
+report per site: percent of days and slacks diveable per year, the change from the year before, and the best windows
+over all years.
+
+Examples:
+    python3 rank_batch.py --years 2026-2030 --sources harmonic --offline
+    python3 rank_batch.py --sites "deception pass, skyline wall" --years 2027 --top 20
+    python3 rank_batch.py --years 2026-2028 --workers 8 --output ranking.json
+'''
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime as dt
+
+import data_collect
+import dive_calendar
+import dive_plan
+import prediction_cache
+import rank_year_slacks
+from dive_plan import pickInterpreter, stationKey
+from must_do_dives import getSite
+from interpreter_common import DATEFMT
+
+# set in each worker process by _initWorker
+_DATA = None
+_OPTIONS = None
+
+
+def parseYears(years):
+    '''Returns the list of years in a string like "2026", "2026-2030" or "2026,2028".'''
+    result = []
+    for part in years.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            result.extend(range(int(first), int(last) + 1))
+        elif part:
+            result.append(int(part))
+    return sorted(set(result))
+
+
+def getJobs(sites, years):
+    '''Returns [(station key, [site names], year)], one job per station and year.'''
+    stations = {}
+    for site in sites:
+        stations.setdefault(stationKey(site), []).append(site['name'])
+    return [(key, names, year) for key, names in stations.items() for year in years]
+
+
+def _initWorker(data, options):
+    global _DATA, _OPTIONS
+    _DATA = data
+    _OPTIONS = options
+
+
+def rankJob(key, siteNames, year):
+    '''
+    Ranks the sites sharing one station over one year. Returns (label, [site result dicts]), each with the counts of
+    days and slacks, diveable ones, and the best windows as (magnitude, time, description).
+    '''
+    start = time.perf_counter()
+    sites = [getSite(_DATA['sites'], name) for name in siteNames]
+    cache = None if _OPTIONS['noCache'] else prediction_cache.PredictionCache()
+    station, interpreters = dive_plan.getInterpreters(sites[0], _DATA, cache, _OPTIONS['offline'])
+    m, label = pickInterpreter(interpreters, _OPTIONS['sources'])
+    calendar = None if _OPTIONS['noCache'] or _OPTIONS['noCalendar'] else dive_calendar.CalendarStore()
+    if not m:
+        return None, [], time.perf_counter() - start
+
+    days = dive_plan.getDiveDays((dt(year, 12, 31) - dt(year, 1, 1)).days, dt(year, 1, 1),
+                                 _OPTIONS['includeWorkdays'], _OPTIONS['includeFridays'])
+    # One container run or harmonic prediction for the whole year
+    if hasattr(m, 'preload_range') and not _OPTIONS['offline']:
+        missing = m.missingDays(days) if cache else days
+        if missing:
+            try:
+                m.preload_range(missing[0], missing[-1])
+            except Exception as e:
+                print('Error preloading {} for {}: {}'.format(label, station['name'], repr(e)))
+
+    results = []
+    for site in sites:
+        results.append({'site': site['name'], 'station': station['name'], 'source': label, 'year': year,
+                        'days': len(days), 'diveableDays': 0, 'slacks': 0, 'diveable': 0,
+                        '_best': rank_year_slacks.TopK(_OPTIONS['top'], key=lambda s: s.magnitude()),
+                        '_prevDay': None})
+    if calendar:
+        for site in sites:
+            calendar.refresh(site, _DATA, m, label, days)
+    for day in days:
+        # (number of slacks, diveable slacks) of each site on the day
+        if calendar:
+            counts = []
+            for site in sites:
+                rows = calendar.getDay(site['name'], label, day, _OPTIONS['timeFilter']) or []
+                counts.append((len(rows), [r[0] for r in rows if r[1]]))
+        else:
+            try:
+                windows = m.getSlacks(day, _OPTIONS['timeFilter'])
+            except Exception as e:
+                print('Error fetching {} for {} on {}: {}'.format(label, station['name'], dt.strftime(day, DATEFMT),
+                                                                  repr(e)))
+                continue
+            counts = [(len(windows), rank_year_slacks.diveableSlacks(windows, site)) for site in sites]
+        for result, (numSlacks, diveable) in zip(results, counts):
+            result['slacks'] += numSlacks
+            for s in diveable:
+                result['diveable'] += 1
+                result['_best'].push(s)
+                if result['_prevDay'] != day:
+                    result['_prevDay'] = day
+                    result['diveableDays'] += 1
+    if cache:
+        cache.flush()
+    if calendar:
+        calendar.flush()
+
+    for result in results:
+        result['best'] = [(s.magnitude(), dt.strftime(s.time, '%Y-%m-%d %H:%M'), str(s))
+                          for s in result.pop('_best').sorted()]
+        del result['_prevDay']
+    return label, results, time.perf_counter() - start
+
+
+def percent(part, whole):
+    return float(part) / whole * 100 if whole else 0.0
+
+
+def mergeResults(results, top):
+    '''Returns {site: report} with the per-year results in year order, the totals and the best windows overall.'''
+    report = {}
+    for r in sorted(results, key=lambda r: (r['site'], r['year'])):
+        site = report.setdefault(r['site'], {'site': r['site'], 'station': r['station'], 'source': r['source'],
+                                             'years': [], 'days': 0, 'diveableDays': 0, 'slacks': 0, 'diveable': 0,
+                                             'best': rank_year_slacks.TopK(top, key=lambda b: b[0])})
+        site['years'].append({k: r[k] for k in ('year', 'days', 'diveableDays', 'slacks', 'diveable')})
+        for k in ('days', 'diveableDays', 'slacks', 'diveable'):
+            site[k] += r[k]
+        for b in r['best']:
+            site['best'].push(tuple(b))
+    for site in report.values():
+        site['best'] = site['best'].sorted()
+    return report
+
+
+def printReport(report):
+    for site in report.values():
+        print()
+        print('=== {} ({}, {}) ==='.format(site['site'], site['station'], site['source']))
+        print('{:<6}{:>26}{:>28}{:>10}'.format('Year', 'Days diveable', 'Slacks diveable', 'Change'))
+        prev = None
+        for y in site['years']:
+            daysPercent = percent(y['diveableDays'], y['days'])
+            change = '' if prev is None else '{:+.2f}%'.format(daysPercent - prev)
+            print('{:<6}{:>26}{:>28}{:>10}'.format(
+                y['year'], '{:0.2f}% ({}/{})'.format(daysPercent, y['diveableDays'], y['days']),
+                '{:0.2f}% ({}/{})'.format(percent(y['diveable'], y['slacks']), y['diveable'], y['slacks']), change))
+            prev = daysPercent
+        print('{:<6}{:>26}{:>28}'.format(
+            'All', '{:0.2f}% ({}/{})'.format(percent(site['diveableDays'], site['days']), site['diveableDays'],
+                                            site['days']),
+            '{:0.2f}% ({}/{})'.format(percent(site['diveable'], site['slacks']), site['diveable'], site['slacks'])))
+        if site['best']:
+            print('Best {}:'.format(len(site['best'])))
+            for magnitude, _, description in site['best']:
+                print('\t{}\tMagnitude = {:0.1f}'.format(description, magnitude))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank the diveable slacks of many sites over many years')
+    parser.add_argument('--sites', default='', type=str,
+                        help='Comma-delimited site names to rank, every site in dive_sites.json by default')
+    parser.add_argument('--years', default=str(dt.now().year), type=str,
+                        help='Years to rank, e.g. "2026", "2026-2030" or "2026,2028"')
+    parser.add_argument('--top', default=10, type=int, help='Number of best windows reported per site')
+    parser.add_argument('--workers', default=os.cpu_count() or 1, type=int, help='Worker processes')
+    parser.add_argument('--output', default=None, type=str, help='Also write the report as JSON to this file')
+    dive_plan.add_arguments(parser)
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    if args.sites:
+        sites = [getSite(data['sites'], name) for name in dive_plan.parse_sites(args.sites, data['sites'])]
+    else:
+        sites = data['sites']
+    years = parseYears(args.years)
+    jobs = getJobs(sites, years)
+
+    options = {'sources': args.sources,
+               'timeFilter': args.TIME_FILTER, 'includeWorkdays': args.INCLUDE_WORKDAYS,
+               'includeFridays': args.INCLUDE_FRIDAYS, 'top': args.top, 'offline': args.OFFLINE,
+               'noCache': args.NO_CACHE, 'noCalendar': args.NO_CALENDAR}
+    print('Ranking {} sites on {} stations over {} in {} jobs with {} workers'.format(
+        len(sites), len(jobs) // len(years) if years else 0, args.years, len(jobs), args.workers))
+
+    start = time.perf_counter()
+    results = []
+    done = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_initWorker,
+                             initargs=(data, options)) as pool:
+        futures = {pool.submit(rankJob, key, names, year): (key, year) for key, names, year in jobs}
+        for future in as_completed(futures):
+            (_, stationName), year = futures[future]
+            done += 1
+            try:
+                label, siteResults, seconds = future.result()
+            except Exception as e:
+                print('[{:>4}/{}] {} {}: error {}'.format(done, len(jobs), stationName[:60], year, repr(e)))
+                continue
+            if not label:
+                print('[{:>4}/{}] {} {}: no matching source'.format(done, len(jobs), stationName[:60], year))
+                continue
+            results.extend(siteResults)
+            print('[{:>4}/{}] {:<60} {} {:<14} ({:.1f}s)'.format(done, len(jobs), stationName[:60], year, label,
+                                                                 seconds))
+
+    report = mergeResults(results, args.top)
+    printReport(report)
+    print('\nRanked {} site-years in {:.1f}s'.format(len(results), time.perf_counter() - start))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(list(report.values()), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,189 @@
 '''
 This program is used to rank the longest and shortest slack times for a current
 station over a given time interval. Longer slacks are present when the max
-current speed on the exchange before and after slack is smaller.
+current speed on the exchange before and after slack is smaller. With
+SORT_BY_WINDOW the slacks are ranked by the minutes the modelled current stays
+below the site's slack_window_speed instead (see current_curve.py).
+
+Slacks stream from the interpreter through the diveability filter into heaps of
+the best (and optionally worst) slacks. Every diveable slack is printed by
+default, set TOP_K to bound the heap so long rankings never hold every slack at
+once.
+
+RANK_MODE 'weighted' ranks by a weighted sum of the current, the margin to
+sunrise/sunset and whether the slack is on a workday. 'pareto' prints the
+skyline of slacks that no other slack beats on all three (see pareto.py).
 '''
 
+import argparse
+import heapq
+import itertools
 import dive_plan
 import data_collect
 import interpreter as intp
 import json
+import prediction_cache
+import profiling
+import us_holidays
 from must_do_dives import getSite
 from datetime import datetime as dt
 
 
-def getDiveableSlacks(slacks, site):
-    """Returns list of slacks that are dive-able for the given site."""
-    diveableSlacks = []
+def diveableSlacks(slacks, site):
+    """Yields the slacks (or tide windows) that are dive-able for the given site."""
     for s in slacks:
-        if s.ebbSpeed > 0.0:
-            print('WARNING - EBB SPEED IS POSITIVE')
-        if s.floodSpeed < 0.0:
-            print('WARNING - FLOOD SPEED IS NEGATIVE')
+        if isinstance(s, intp.Slack):
+            if s.ebbSpeed > 0.0:
+                print('WARNING - EBB SPEED IS POSITIVE')
+            if s.floodSpeed < 0.0:
+                print('WARNING - FLOOD SPEED IS NEGATIVE')
 
         diveable, info = dive_plan.isDiveable(s, site, False)
         if diveable:
-            diveableSlacks.append(s)
-    return diveableSlacks
+            yield s
+
+
+def getDiveableSlacks(slacks, site):
+    """Returns list of slacks that are dive-able for the given site."""
+    return list(diveableSlacks(slacks, site))
+
+
+def generateSlacks(m, days, timeFilter):
+    """Yields the slacks of the given days in order, one day of predictions at a time."""
+    for day in days:
+        yield from m.getSlacks(day, timeFilter)
+
+
+def chunks(items, size):
+    """Yields lists of up to size consecutive items."""
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def withWindows(slacks, threshold, station=None, shape='cosine', chunkSize=256):
+    """Yields (slack, minutes below threshold around it), computed a chunk of slacks at a time. The window is measured
+    on the predicted curve of the harmonics.HarmonicStation if given, and modelled from the max currents otherwise."""
+    import current_curve
+    for chunk in chunks(slacks, chunkSize):
+        if station:
+            before, after = current_curve.harmonic_window_minutes(station, chunk, threshold)
+        else:
+            before, after = current_curve.window_minutes(chunk, threshold, shape)
+        yield from zip(chunk, (before + after).tolist())
+
+
+def rankCosts(items, byWindow=False, preferDark=False):
+    """
+    Returns the (n, 3) costs to minimise of (slack, window minutes) items, one column per ranking criterion:
+    current (the speed sum in knots, or the window in negative hours with byWindow), daylight (the margin to the
+    nearer of sunrise and sunset in negative hours, positive hours with preferDark) and workday (1 on workdays,
+    0 on weekends and holidays).
+    """
+    import numpy as np
+    speedSum = np.array([abs(s.ebbSpeed) + abs(s.floodSpeed) for s, _ in items], dtype=float)
+    windows = np.array([w for _, w in items], dtype=float)
+    times = np.array([s.time for s, _ in items], dtype='datetime64[s]')
+    sunrise = np.array([s.sunriseTime for s, _ in items], dtype='datetime64[s]')
+    sunset = np.array([s.sunsetTime for s, _ in items], dtype='datetime64[s]')
+    margin = np.minimum(times - sunrise, sunset - times).astype(float) / 3600
+    workday = np.array([s.time.weekday() < 5 and not us_holidays.isHoliday(s.time) for s, _ in items], dtype=float)
+    return np.column_stack([-windows / 60 if byWindow else speedSum, margin if preferDark else -margin, workday])
+
+
+class ParetoFront:
+    """
+    The items streamed through so far that no other item beats on every cost (see pareto.skyline). Each chunk is
+    merged into the front and pruned right away, so memory stays bounded by the size of the front.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._costs = None
+
+    def push(self, items, costs):
+        import numpy as np
+        import pareto
+        items = self._items + list(items)
+        costs = costs if self._costs is None else np.vstack([self._costs, costs])
+        keep = pareto.skyline(costs[:, :2], costs[:, 2])
+        self._items = [item for item, k in zip(items, keep) if k]
+        self._costs = costs[keep]
 
+    def __len__(self):
+        return len(self._items)
 
+    def sorted(self):
+        """Returns the front ordered by the first cost, then the second."""
+        import numpy as np
+        if self._costs is None:
+            return []
+        order = np.lexsort((self._costs[:, 1], self._costs[:, 0]))
+        return [self._items[i] for i in order]
 
-def getInterpreter(station, use_xtide_docker, use_noaa):
-    """Returns the appropriate interpreter for the given station and settings."""
-    if use_xtide_docker:
-        return intp.XTideDockerInterpreter(station['name'], station)
+
+class TopK:
+    """
+    The k items with the smallest keys pushed so far (largest with largest=True), in a bounded heap so memory
+    stays constant however many items stream through. With k None every item is kept.
+    """
+
+    def __init__(self, k, key, largest=False):
+        self.k = k
+        self.key = key
+        self.largest = largest
+        self._heap = []  # (kept-worst-first key, tie breaker, item)
+        self._count = itertools.count()
+
+    def push(self, item):
+        if self.k is not None and self.k <= 0:
+            return
+        key = self.key(item)
+        # heapq is a min heap, its root is the kept item that the next better one replaces
+        entry = (key if self.largest else -key, -next(self._count), item)
+        if self.k is None or len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def sorted(self):
+        """Returns the kept items from best to worst, in push order between equal keys."""
+        return [e[2] for e in sorted(self._heap, reverse=True)]
+
+
+def getInterpreter(station, use_xtide_docker, use_noaa, use_harmonic=False):
+    """Returns the appropriate (interpreter, source label) for the given station and settings. Labels match
+    dive_plan.getInterpreters so the prediction cache is shared with dive_plan.py and prefetch.py."""
+    if use_harmonic:
+        return intp.HarmonicInterpreter(station['name'], station), "Harmonic"
+    elif use_xtide_docker:
+        return intp.XTideDockerInterpreter(station['name'], station), "XTide Docker"
     elif use_noaa:
         if 'british columbia' in station['name'].lower():
             print('using Canadian Currents API')
-            return intp.CanadaAPIInterpreter("", station)
+            return intp.CanadaAPIInterpreter("", station), "Canada API"
         else:
-            return intp.NoaaAPIInterpreter(station['url_noaa_api'], station)
+            return intp.NoaaAPIInterpreter(station['url_noaa_api'], station), "NOAA"
     else:
-        return intp.TBoneSCInterpreter(station['url_xtide_a'], station['name'])
+        return intp.TBoneSCInterpreter(station['url_xtide_a'], station['name']), "XTide"
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Rank the diveable slacks of a site over a long time interval')
+    parser.add_argument('--offline', action='store_true', default=False, dest='OFFLINE',
+                        help='Only use predictions already in the prediction cache (fill it with prefetch.py)')
+    parser.add_argument('--no-cache', action='store_true', default=False, dest='NO_CACHE',
+                        help='Always fetch from the source, bypassing the prediction cache')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start_from_args(args)
+
     # ---------------------------------- CONFIGURABLE PARAMETERS ------------------------------------------------------
     # SITE = 'Whiskey Point'
     # SITE = 'Boat Pass'
@@ -59,6 +200,7 @@ def main():
     # SITE = 'Day Island Wall'
     # SITE = 'Sechelt Rapids'
     # SITE = 'Nakwakto'
+    USE_HARMONIC = False  # offline prediction from harmonics.json, see harmonics.py
     USE_XTIDE_DOCKER = False
     USE_NOAA = True
     TIME_FILTER = intp.TIME_FILTER_EARLY_NIGHT
@@ -66,56 +208,129 @@ def main():
     START_DATE = dt(2026, 3, 1)
     INCLUDE_WORKDAYS = False
     INCLUDE_FRIDAYS = True
+    SORT_BY_WINDOW = False  # rank by minutes below the site's slack_window_speed instead of the speed sum
+    WINDOW_SHAPE = 'cosine'  # 'cosine' or 'thirds' current curve between events, see current_curve.py
+    TOP_K = None  # number of best slacks printed, None for every diveable slack
+    BOTTOM_K = 0  # number of worst diveable slacks printed
+    RANK_MODE = 'sum'  # 'sum' (speed sum, or window with SORT_BY_WINDOW), 'weighted' or 'pareto', see rankCosts
+    WEIGHTS = (1.0, 0.25, 1.0)  # weighted mode cost of a knot (or window hour), a daylight margin hour and a workday
+    USE_CALENDAR = True  # read diveability from the materialised calendar (off with --no-cache), see dive_calendar.py
     # -----------------------------------------------------------------------------------------------------------------
 
     data = json.loads(open(data_collect.absName('dive_sites.json')).read())
     siteJson = getSite(data['sites'], SITE)
     station = dive_plan.getStation(data['stations'], siteJson['data'])
 
-    m = getInterpreter(station, USE_XTIDE_DOCKER, USE_NOAA)
+    m, label = getInterpreter(station, USE_XTIDE_DOCKER, USE_NOAA, USE_HARMONIC)
 
     days = dive_plan.getDiveDays(DAYS_IN_FUTURE, START_DATE, INCLUDE_WORKDAYS, INCLUDE_FRIDAYS)
 
-    # Preload full range once for XTide Docker to avoid per-day container runs
-    if USE_XTIDE_DOCKER and isinstance(m, intp.XTideDockerInterpreter) and days:
-        m.preload_range(days[0], days[-1])
+    cache = None
+    if not args.NO_CACHE:
+        cache = prediction_cache.PredictionCache()
+        m = prediction_cache.CachedInterpreter(m, label, station, cache, args.OFFLINE)
 
-    slacks = []
-    for day in days:
-        slacks.extend(m.getSlacks(day, TIME_FILTER))
+    # Preload full range once for XTide Docker and harmonic predictions to avoid per-day container runs
+    if (USE_XTIDE_DOCKER or USE_HARMONIC) and days and not args.OFFLINE:
+        missing = m.missingDays(days) if cache else days
+        if missing:
+            m.preload_range(missing[0], missing[-1])
 
-    # Filter out the non-diveable slacks
-    diveableSlacks = getDiveableSlacks(slacks, siteJson)
+    # Minutes the current stays below the site's window speed around each slack, measured on the predicted curve
+    # for harmonic predictions and modelled from the max currents otherwise
+    import current_curve
+    threshold = current_curve.window_speed(siteJson)
+    harmonicStation = None
+    if USE_HARMONIC:
+        import harmonics
+        harmonicStation = harmonics.get_station(station['name'])
 
-    # Calculate and print stats
-    if len(slacks) > 0:
-        percentSlacksDiveable = float(len(diveableSlacks)) / len(slacks) * 100
-        print('{:0.2f}% of all slacks are diveable ({}/{})'.format(
-            percentSlacksDiveable, len(diveableSlacks), len(slacks)))
+    # Rank by the current cost (speed sum from weakest to strongest, or window from longest to shortest), or by the
+    # weighted costs, computed a chunk of slacks at a time
+    preferDark = TIME_FILTER in (intp.TIME_FILTER_NIGHT, intp.TIME_FILTER_EARLY_NIGHT)
+    best = TopK(TOP_K, lambda x: x[2])
+    worst = TopK(BOTTOM_K, lambda x: x[2], largest=True)
+    front = ParetoFront()
 
+    # Stream the slacks through the filter and the rankings, counting stats on the way
+    numSlacks = 0
+    numDiveable = 0
     diveableDays = 0
     prevDay = ''
-    for s in diveableSlacks:
-        curDay = dt.strftime(s.time, intp.DATEFMT)
-        if prevDay != curDay:
-            prevDay = curDay
-            diveableDays += 1
+
+    def counted(slacks):
+        nonlocal numSlacks
+        for s in slacks:
+            numSlacks += 1
+            yield s
+
+    calendar = None
+    if USE_CALENDAR and not args.NO_CACHE:
+        import dive_calendar
+        calendar = dive_calendar.CalendarStore()
+        calendar.refresh(siteJson, data, m, label, days)
+        diveable = (r[0] for r in counted(calendar.getRows(SITE, label, days, TIME_FILTER)) if r[1])
+    else:
+        diveable = diveableSlacks(counted(generateSlacks(m, days, TIME_FILTER)), siteJson)
+    scored = withWindows(diveable, threshold, harmonicStation, WINDOW_SHAPE)
+    for chunk in chunks(scored, 1024):
+        for s, window in chunk:
+            numDiveable += 1
+            curDay = dt.strftime(s.time, intp.DATEFMT)
+            if prevDay != curDay:
+                prevDay = curDay
+                diveableDays += 1
+        costs = rankCosts(chunk, SORT_BY_WINDOW, preferDark)
+        if RANK_MODE == 'pareto':
+            front.push(chunk, costs)
+            continue
+        if RANK_MODE == 'weighted':
+            import pareto
+            scores = pareto.weighted_scores(costs, WEIGHTS)
+        else:
+            scores = costs[:, 0]
+        for (s, window), score in zip(chunk, scores.tolist()):
+            best.push((s, window, score))
+            worst.push((s, window, score))
+
+    # Print stats
+    if numSlacks > 0:
+        percentSlacksDiveable = float(numDiveable) / numSlacks * 100
+        print('{:0.2f}% of all slacks are diveable ({}/{})'.format(
+            percentSlacksDiveable, numDiveable, numSlacks))
 
     percentDaysDiveable = float(diveableDays) / len(days) * 100
     print('{:0.2f}% of all days are diveable ({}/{})'.format(
         percentDaysDiveable, diveableDays, len(days)))
 
-    # Sort by the sum of the max current speeds from weakest to strongest
-    diveableSlacks.sort(key=lambda x: abs(x.ebbSpeed) + abs(x.floodSpeed))
-
     # Print results
-    for s in diveableSlacks:
+    def printSlack(s, window, score=None):
         afterSunrise = (s.time - s.sunriseTime).total_seconds() / 60.0
         beforeSunset = (s.sunsetTime - s.time).total_seconds() / 60.0
-        print('{}\tSpeed sum = {:0.1f}\tTime before/after dark = {:0.0f}min'.format(
-            s, abs(s.ebbSpeed) + abs(s.floodSpeed), min(beforeSunset, afterSunrise)))
+        print('{}\tSpeed sum = {:0.1f}\tWindow < {}kt = {:0.0f}min\tTime before/after dark = {:0.0f}min{}'.format(
+            s, abs(s.ebbSpeed) + abs(s.floodSpeed), threshold, window, min(beforeSunset, afterSunrise),
+            '\tScore = {:0.2f}'.format(score) if RANK_MODE == 'weighted' else ''))
+
+    if RANK_MODE == 'pareto':
+        print('{} diveable slacks not beaten on current, daylight margin and workday by any other:'.format(len(front)))
+        for s, window in front.sorted():
+            printSlack(s, window)
+    else:
+        print('Best {} diveable slacks:'.format(len(best)))
+        for s, window, score in best.sorted():
+            printSlack(s, window, score)
+        if BOTTOM_K:
+            print('Worst {} diveable slacks:'.format(len(worst)))
+            for s, window, score in worst.sorted():
+                printSlack(s, window, score)
+
+    print('number of api calls: {}'.format(m.numAPICalls))
+    if cache:
+        cache.flush()
+    if calendar:
+        calendar.flush()
+    profiling.report_from_args(args)
+
 
-    if USE_NOAA and 'british columbia' in station['name'].lower():
-        print('number of api calls: {}'.format(m.numAPICalls))
 if __name__ == '__main__':
     main()
@@ -14,6 +14,7 @@ https://console.cloud.google.com/apis/credentials?project=sonorous-reach-118520
 
 import dive_plan, data_collect
 import interpreter as intp
+import rank_year_slacks
 import json
 from must_do_dives import getSite
 from datetime import datetime as dt
@@ -27,21 +28,6 @@ from googleapiclient.errors import HttpError
 
 GCAL_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
 
-# returns list of slacks in given list that are divable for the given site, mostly taken from must_do_dives.py
-def getDiveableSlacks(slacks, site):
-    diveableSlacks = []
-    for s in slacks:
-        if s.ebbSpeed > 0.0:
-            print('WARNING - EBB SPEED IS POSITIVE')
-        if s.floodSpeed < 0.0:
-            print('WARNING - FLOOD SPEED IS NEGATIVE')
-
-        # Check if diveable or not
-        diveable, info = dive_plan.isDiveable(s, site, False)
-        if diveable:
-            diveableSlacks.append(s)
-    return diveableSlacks
-
 # returns the string representation of the number as an ordinal (1st, 2nd, 3rd, 4th, 5th, etc)
 def ordinal(n: int):
     if 11 <= (n % 100) <= 13:
@@ -124,23 +110,20 @@ def main():
     else:
         m = intp.TBoneSCInterpreter(station['url_xtide_a'], station['name'])
 
-    slacks = []
     days = dive_plan.getAllDays(365, dt(2026, 1, 1))
     # days = dive_plan.getAllDays(230)
-    for day in days:
-        slacks.extend(m.getSlacks(day, TIME_FILTER))
-
-    # filter out the non-diveable slacks
-    diveableSlacks = getDiveableSlacks(slacks, siteJson)
 
-    # sort by the sum of the max current speeds from weakest to strongest
-    diveableSlacks.sort(key=lambda x: abs(x.ebbSpeed)+abs(x.floodSpeed))
+    # keep the 30 diveable slacks with the smallest sum of the max current speeds as they stream in
+    best = rank_year_slacks.TopK(30, key=lambda x: abs(x.ebbSpeed)+abs(x.floodSpeed))
+    for s in rank_year_slacks.diveableSlacks(rank_year_slacks.generateSlacks(m, days, TIME_FILTER), siteJson):
+        best.push(s)
+    bestSlacks = best.sorted()
 
-    for s in diveableSlacks:
+    for s in bestSlacks:
         print('{}\tSpeed sum = {:0.1f}'.format(s, abs(s.ebbSpeed)+abs(s.floodSpeed)))
 
     # create gcal events for the top dives over this time period
-    postToGCal(diveableSlacks[:30], SITE, 'NOAA' if NOAA else 'XTide')
+    postToGCal(bestSlacks, SITE, 'NOAA' if NOAA else 'XTide')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,170 @@
+'''
+Benchmarks the interpreters against the local stand-in server (stand_in_server.py) instead of the real NOAA,
+Canada and Dairiki services. Drives the same per-day loops as dive_plan.py ('plan' mode, every configured source
+for each site) or rank_year_slacks.py ('rank' mode, one source over a long horizon) and reports throughput, tail
+latency and API call counts.
+
+Examples:
+    python3 stand_in_benchmark.py --sites "deception pass, skyline wall" --futuredays 30 --latency 200 --jitter 50
+    python3 stand_in_benchmark.py --mode rank --sites "gabriola pass" --futuredays 365 --error-rate 0.05
+    python3 stand_in_benchmark.py --sites "day island wall" --workers 4 --rate-limit 10 --fallback-station "Hale Passage, west end, Puget Sound, Washington Current"
+'''
+
+import argparse
+import copy
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+
+import data_collect
+import dive_plan
+import interpreter as intp
+import interpreter_tides as intp_tides
+from stand_in_server import StandInServer, CANADA_PREFIX
+
+# sources the stand-in can serve, by dive_plan interpreter label
+SERVED_SOURCES = ('NOAA', 'Canada API', 'Dairiki')
+# source preference when ranking a single source per site
+RANK_SOURCE_ORDER = ('NOAA', 'Canada API', 'Dairiki')
+
+
+def percentile(sortedValues, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sortedValues:
+        return 0.0
+    k = max(0, min(len(sortedValues) - 1, int(round(p / 100.0 * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[k]
+
+
+def pointInterpretersAt(server):
+    """Points the module-level Canada API base url at the stand-in (NOAA/Dairiki urls come from the station)."""
+    base = server.baseUrl + CANADA_PREFIX + '/api/v1'
+    intp.CANADA_API_BASE_URL = base
+    intp_tides.CANADA_API_BASE_URL = base
+
+
+class ClientStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.slacks = 0
+        self.diveable = 0
+        self.latencies = []  # seconds per getSlacks call
+        self.apiCalls = {}   # source label -> interpreter numAPICalls
+
+    def record(self, seconds, slacks, diveable, error):
+        with self.lock:
+            self.calls += 1
+            self.latencies.append(seconds)
+            self.slacks += slacks
+            self.diveable += diveable
+            self.errors += 1 if error else 0
+
+    def addApiCalls(self, label, n):
+        with self.lock:
+            self.apiCalls[label] = self.apiCalls.get(label, 0) + n
+
+
+def runSite(siteData, data, days, mode, timeFilter, stats):
+    _, interpreters = dive_plan.getInterpreters(siteData, data)
+    interpreters = [(m, label) for m, label in interpreters if label in SERVED_SOURCES]
+    if mode == 'rank' and interpreters:
+        interpreters.sort(key=lambda x: RANK_SOURCE_ORDER.index(x[1]))
+        interpreters = interpreters[:1]
+    if not interpreters:
+        print('No stand-in served sources configured for {}'.format(siteData['name']))
+        return
+    for day in days:
+        for m, label in interpreters:
+            start = time.perf_counter()
+            slacks, error = [], False
+            try:
+                slacks = m.getSlacks(day, timeFilter)
+            except Exception as e:
+                error = True
+                print('Error fetching and reading slacks from {} for {}: {}'.format(label, siteData['name'], repr(e)))
+            diveable = sum(1 for s in slacks if dive_plan.isDiveable(s, siteData, False)[0])
+            stats.record(time.perf_counter() - start, len(slacks), diveable, error)
+    for m, label in interpreters:
+        stats.addApiCalls(label, m.numAPICalls)
+
+
+def printLatencies(title, latencies):
+    values = sorted(latencies)
+    if not values:
+        print('{}: no samples'.format(title))
+        return
+    print('{}: n={}  mean={:.1f}ms  p50={:.1f}ms  p90={:.1f}ms  p99={:.1f}ms  max={:.1f}ms'.format(
+        title, len(values), sum(values) / len(values) * 1000, percentile(values, 50) * 1000,
+        percentile(values, 90) * 1000, percentile(values, 99) * 1000, values[-1] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the interpreters against a latency-injecting stand-in')
+    parser.add_argument('--sites', default='Deception Pass', type=str, help='Comma-delimited list of dive sites')
+    parser.add_argument('--mode', choices=['plan', 'rank'], default='plan',
+                        help='plan: every source per site like dive_plan.py, rank: one source like rank_year_slacks.py')
+    parser.add_argument('-f', '--futuredays', dest='DAYS_IN_FUTURE', default=14, type=int)
+    parser.add_argument('-d', '--start-date', dest='START', default=dt(2026, 3, 1),
+                        type=lambda d: dt.strptime(d, '%Y-%m-%d'))
+    parser.add_argument('-w', '--includeworkdays', action='store_true', default=False, dest='INCLUDE_WORKDAYS')
+    parser.add_argument('-t', '--time-filter', choices=['day', 'night', 'early_night', 'all'], default='all',
+                        dest='TIME_FILTER')
+    parser.add_argument('--workers', default=1, type=int, help='Sites benchmarked concurrently')
+    parser.add_argument('--latency', default=0, type=float, help='Stand-in base latency per response in ms')
+    parser.add_argument('--jitter', default=0, type=float, help='Stand-in uniform +/- latency jitter in ms')
+    parser.add_argument('--error-rate', default=0.0, type=float, dest='ERROR_RATE')
+    parser.add_argument('--rate-limit', default=0, type=float, dest='RATE_LIMIT')
+    parser.add_argument('--burst', default=1, type=int)
+    parser.add_argument('--fallback-station', default=None, dest='FALLBACK')
+    parser.add_argument('--seed', default=None, type=int, help='Seed for injected jitter and errors')
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    server = StandInServer(data, 0, args.latency, args.jitter, args.ERROR_RATE, args.RATE_LIMIT, args.burst,
+                           args.FALLBACK, seed=args.seed).start()
+    pointInterpretersAt(server)
+
+    # interpreters get redirected copies of the station configs
+    standInData = copy.deepcopy(data)
+    standInData['stations'] = [server.redirectStation(s) for s in data['stations']]
+    standInData['tide_stations'] = [server.redirectStation(s) for s in data['tide_stations']]
+
+    siteNames = [name.strip().lower() for name in args.sites.split(',') if name.strip()]
+    sites = [s for s in standInData['sites'] if s['name'].lower() in siteNames]
+    if len(sites) != len(siteNames):
+        print('Unknown dive site in {}. Options: {}'.format(args.sites, dive_plan.listDiveSites(data['sites'])))
+        exit(1)
+    days = dive_plan.getDiveDays(args.DAYS_IN_FUTURE, args.START, args.INCLUDE_WORKDAYS)
+
+    print('Stand-in at {} (latency={}ms jitter={}ms errors={:.0%} rate limit={}/s)'.format(
+        server.baseUrl, args.latency, args.jitter, args.ERROR_RATE, args.RATE_LIMIT or 'none'))
+    print('{} mode: {} site(s) x {} day(s), {} worker(s)'.format(args.mode, len(sites), len(days), args.workers))
+
+    stats = ClientStats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [pool.submit(runSite, s, standInData, days, args.mode, args.TIME_FILTER, stats) for s in sites]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    requests = server.stats.total()
+    print()
+    print('Wall time: {:.2f}s'.format(elapsed))
+    print('Throughput: {:.1f} site-days/s, {:.1f} getSlacks calls/s, {:.1f} requests/s'.format(
+        len(sites) * len(days) / elapsed, stats.calls / elapsed, requests / elapsed))
+    printLatencies('getSlacks latency', stats.latencies)
+    printLatencies('Stand-in request latency', server.stats.latencies)
+    print('Requests by route: {}'.format(server.stats.requests))
+    print('Responses by status: {}'.format(server.stats.statuses))
+    print('Interpreter API calls: {}'.format(stats.apiCalls))
+    print('Slacks: {} ({} diveable), getSlacks errors: {}'.format(stats.slacks, stats.diveable, stats.errors))
+
+
+if __name__ == '__main__':
+    main()
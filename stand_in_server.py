@@ -0,0 +1,428 @@
+'''
+Local HTTP stand-in for the current prediction services used by the interpreters. Serves NOAA
+current_predictions, Canada (DFO) stations/{id}/data and Dairiki monthly pages built from the
+xtide-offline data (or from recorded fixtures) so the fetchers can be load-tested without hitting
+the real services.
+
+Latency, jitter, error rate and a rate limit can be injected to mimic a slow or flaky upstream.
+
+Routes (the real host is replaced by the stand-in's address plus a source prefix):
+    /noaa/api/prod/datagetter?...&station=PUG1642&begin_date=20260301&end_date=20260315
+    /canada/api/v1/stations/{id}/data?time-series-code=wcp1-events&from=...&to=...
+    /dairiki/tides/monthly.php/{code}/{yyyy-mm}
+
+Example:
+    python3 stand_in_server.py --port 8642 --latency 250 --jitter 100 --error-rate 0.02 --rate-limit 5
+'''
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime as dt
+from datetime import timedelta as td
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import data_collect
+import xtide_saver
+from interpreter_common import DATEFMT, get_canada_station_id_local
+
+FIXTURE_DIR = 'stand-in-fixtures'
+
+NOAA_PREFIX = '/noaa'
+CANADA_PREFIX = '/canada'
+DAIRIKI_PREFIX = '/dairiki'
+
+# real host -> stand-in path prefix
+UPSTREAM_HOSTS = {
+    'https://api.tidesandcurrents.noaa.gov': NOAA_PREFIX,
+    'https://api-sine.dfo-mpo.gc.ca': CANADA_PREFIX,
+    'https://www.dairiki.org': DAIRIKI_PREFIX,
+}
+
+# offline xtide timezone token -> hours to add to get UTC
+UTC_OFFSETS = {'pst': 8, 'pdt': 7}
+
+
+class OfflineEvent:
+    """A max/slack/min current event read from an xtide-offline file, in local (Pacific) time."""
+
+    def __init__(self, time, utcTime, kind, speed):
+        self.time = time        # naive local datetime
+        self.utcTime = utcTime  # naive UTC datetime
+        self.kind = kind        # 'max_flood', 'max_ebb', 'slack', 'min_flood' or 'min_ebb'
+        self.speed = speed      # knots, flood positive, ebb negative, 0 for slack
+
+
+def _parseOfflineLine(line):
+    tokens = line.split()
+    if len(tokens) < 6 or tokens[4] != 'knots':
+        return None
+    time = dt.strptime(tokens[0] + ' ' + tokens[1], '%Y-%m-%d %H:%M')
+    utcTime = time + td(hours=UTC_OFFSETS.get(tokens[2], 8))
+    speed = float(tokens[3])
+    if 'max flood' in line:
+        return OfflineEvent(time, utcTime, 'max_flood', abs(speed))
+    elif 'max ebb' in line:
+        return OfflineEvent(time, utcTime, 'max_ebb', -abs(speed))
+    elif 'slack' in line:
+        return OfflineEvent(time, utcTime, 'slack', 0.0)
+    elif 'min flood' in line:
+        return OfflineEvent(time, utcTime, 'min_flood', abs(speed))
+    elif 'min ebb' in line:
+        return OfflineEvent(time, utcTime, 'min_ebb', -abs(speed))
+    return None
+
+
+class OfflineStation:
+    """All current events for one station from its xtide-offline file, sorted by time."""
+
+    def __init__(self, fileName):
+        self.events = []
+        with open(data_collect.absName(fileName), 'r') as f:
+            for line in f:
+                event = _parseOfflineLine(line)
+                if event:
+                    self.events.append(event)
+        self._times = [e.time for e in self.events]
+        self._utcTimes = [e.utcTime for e in self.events]
+
+    # Returns the events with start <= local time < end
+    def between(self, start, end):
+        return self.events[bisect.bisect_left(self._times, start):bisect.bisect_left(self._times, end)]
+
+    # Returns the events with start <= UTC time < end
+    def betweenUtc(self, start, end):
+        return self.events[bisect.bisect_left(self._utcTimes, start):bisect.bisect_left(self._utcTimes, end)]
+
+
+# ----------------------------------- response bodies in each service's format -----------------------------------------
+def noaaCurrentPredictions(events):
+    """NOAA datagetter product=currents_predictions&interval=MAX_SLACK response body."""
+    cp = []
+    for e in events:
+        if e.kind == 'slack':
+            eventType = 'slack'
+        else:
+            eventType = 'flood' if e.speed > 0 else 'ebb'  # NOAA reports min ebb/flood as a plain ebb/flood
+        cp.append({'Time': dt.strftime(e.time, '%Y-%m-%d %H:%M'), 'Type': eventType,
+                   'Velocity_Major': e.speed, 'Depth': '', 'meanFloodDir': 0, 'meanEbbDir': 180, 'Bin': ''})
+    return {'current_predictions': {'units': 'knots', 'cp': cp}}
+
+
+def canadaEvents(events):
+    """DFO stations/{id}/data?time-series-code=wcp1-events response body (qualifier format)."""
+    body = []
+    for e in events:
+        if e.kind == 'slack':
+            qualifier = 'SLACK'
+        else:
+            qualifier = 'EXTREMA_FLOOD' if e.speed > 0 else 'EXTREMA_EBB'
+        body.append({'eventDate': dt.strftime(e.utcTime, '%Y-%m-%dT%H:%M:%SZ'), 'qualifier': qualifier,
+                     'value': abs(e.speed), 'qcFlagCode': '2', 'timeSeriesId': ''})
+    return body
+
+
+def dairikiMonthHtml(events, code):
+    """Dairiki monthly.php page with one tidetable row per day."""
+    rows = []
+    byDay = {}
+    for e in events:
+        byDay.setdefault(dt.strftime(e.time, DATEFMT), []).append(e)
+    for dayStr, dayEvents in byDay.items():
+        cells = ['<td class="first date"><a href="daily.php/{}/{}">{}</a></td>'.format(code, dayStr, int(dayStr[8:]))]
+        for e in dayEvents:
+            timeStr = dt.strftime(e.time, '%H:%M')
+            if e.kind == 'slack':
+                cells.append('<td>{}</td>'.format(timeStr))
+            else:
+                suffix = 'F' if e.speed > 0 else 'E'
+                cells.append('<td class="left">{}</td><td class="right">{:.1f}{}</td>'.format(timeStr, e.speed, suffix))
+        rows.append('<tr>{}</tr>'.format(''.join(cells)))
+    return ('<html><body><table class="tidetable"><thead><tr><th>Date</th><th>Turn</th><th colspan="2">Max</th>'
+            '</tr></thead><tbody>\n{}\n</tbody></table></body></html>').format('\n'.join(rows))
+
+
+# ------------------------------------------------ server -------------------------------------------------------------
+class TokenBucket:
+    """Requests per second limiter, a rate of 0 disables it."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class StandInStats:
+    """Per-route request counts, status codes and handling times (including injected latency)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}   # route -> count
+        self.statuses = {}   # status code -> count
+        self.latencies = []  # seconds per request
+
+    def record(self, route, status, seconds):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.latencies.append(seconds)
+
+    def total(self):
+        return sum(self.requests.values())
+
+
+class StandInServer:
+    """
+    Threaded stand-in for the NOAA, Canada and Dairiki services.
+
+    Args:
+        data: parsed dive_sites.json, used to map station ids/codes to xtide-offline files
+        latencyMs: base delay added to every response
+        jitterMs: uniform random +/- jitter added to the base delay
+        errorRate: fraction of requests (0-1) answered with a 503
+        rateLimit: max requests per second before answering 429 (0 disables)
+        fallbackStation: station name whose offline data is served for stations without offline data
+        record: proxy requests without a fixture to the real service and save the response as a fixture
+    """
+
+    def __init__(self, data, port=0, latencyMs=0, jitterMs=0, errorRate=0.0, rateLimit=0, burst=1,
+                 fallbackStation=None, record=False, seed=None):
+        self.data = data
+        self.latencyMs = latencyMs
+        self.jitterMs = jitterMs
+        self.errorRate = errorRate
+        self.limiter = TokenBucket(rateLimit, burst)
+        self.fallbackStation = fallbackStation
+        self.record = record
+        self.random = random.Random(seed)
+        self.stats = StandInStats()
+        self._offline = {}  # file name -> OfflineStation
+        self._offlineLock = threading.Lock()
+        self._noaaStations = {}
+        self._canadaStations = {}
+        self._dairikiStations = {}
+        for station in data['stations']:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(station.get('url_noaa_api', '')).query)
+            if 'station' in query:
+                self._noaaStations[query['station'][0]] = station
+            if station.get('ca_code'):
+                self._canadaStations[get_canada_station_id_local(station)] = station
+            if station.get('url_dairiki') and '/monthly.php/' in station['url_dairiki']:
+                self._dairikiStations[station['url_dairiki'].rstrip('/').split('/')[-1]] = station
+
+        handler = type('StandInHandler', (_StandInHandler,), {'server_ref': self})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.baseUrl = 'http://127.0.0.1:{}'.format(self.port)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def redirectUrl(self, url):
+        """Returns the given service url pointed at this stand-in."""
+        for host, prefix in UPSTREAM_HOSTS.items():
+            if url and url.startswith(host):
+                return self.baseUrl + prefix + url[len(host):]
+        return url
+
+    def redirectStation(self, station):
+        """Returns a copy of the given station config with its service urls pointed at this stand-in."""
+        redirected = dict(station)
+        for key in ('url_noaa_api', 'url_dairiki', 'url_noaa'):
+            if redirected.get(key):
+                redirected[key] = self.redirectUrl(redirected[key])
+        return redirected
+
+    def _offlineFor(self, station):
+        fileName = xtide_saver.getFileName(station['name']) if station else None
+        if not fileName or not os.path.exists(data_collect.absName(fileName)):
+            if not self.fallbackStation:
+                return None
+            fileName = xtide_saver.getFileName(self.fallbackStation)
+        with self._offlineLock:
+            if fileName not in self._offline:
+                self._offline[fileName] = OfflineStation(fileName)
+            return self._offline[fileName]
+
+    def _delay(self):
+        seconds = (self.latencyMs + self.random.uniform(-self.jitterMs, self.jitterMs)) / 1000.0
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # Returns (route, status, content type, body bytes) for the given request path
+    def respond(self, path):
+        parsed = urllib.parse.urlparse(path)
+        query = {k: v[0] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+        if parsed.path.startswith(NOAA_PREFIX):
+            route = 'noaa'
+        elif parsed.path.startswith(CANADA_PREFIX):
+            route = 'canada'
+        elif parsed.path.startswith(DAIRIKI_PREFIX):
+            route = 'dairiki'
+        else:
+            return 'unknown', 404, 'text/plain', b'unknown route'
+
+        if not self.limiter.take():
+            return route, 429, 'text/plain', b'rate limit exceeded'
+        if self.errorRate and self.random.random() < self.errorRate:
+            return route, 503, 'text/plain', b'injected error'
+
+        fixture = self._fixturePath(path)
+        if os.path.exists(fixture):
+            with open(fixture, 'rb') as f:
+                body = f.read()
+            return route, 200, 'application/json' if route != 'dairiki' else 'text/html', body
+
+        try:
+            if route == 'noaa':
+                result = self._respondNoaa(query)
+            elif route == 'canada':
+                result = self._respondCanada(parsed.path, query)
+            else:
+                result = self._respondDairiki(parsed.path)
+        except (ValueError, KeyError) as e:
+            return route, 400, 'text/plain', 'bad request: {}'.format(repr(e)).encode()
+
+        if result is None and self.record:
+            result = self._recordUpstream(route, path, fixture)
+        if result is None:
+            return route, 404, 'text/plain', b'no offline data or fixture for this station'
+        contentType, body = result
+        return route, 200, contentType, body
+
+    def _respondNoaa(self, query):
+        station = self._noaaStations.get(query.get('station'))
+        offline = self._offlineFor(station)
+        if not offline:
+            return None
+        begin = dt.strptime(query['begin_date'], '%Y%m%d')
+        end = dt.strptime(query['end_date'], '%Y%m%d') + td(days=1)
+        body = noaaCurrentPredictions(offline.between(begin, end))
+        return 'application/json', json.dumps(body).encode()
+
+    def _respondCanada(self, path, query):
+        parts = path.rstrip('/').split('/')
+        if parts[-1] != 'data' or query.get('time-series-code') != 'wcp1-events':
+            return None
+        offline = self._offlineFor(self._canadaStations.get(parts[-2]))
+        if not offline:
+            return None
+        start = dt.strptime(query['from'], '%Y-%m-%dT%H:%M:%SZ')
+        end = dt.strptime(query['to'], '%Y-%m-%dT%H:%M:%SZ')
+        body = canadaEvents(offline.betweenUtc(start, end))
+        return 'application/json', json.dumps(body).encode()
+
+    def _respondDairiki(self, path):
+        parts = path.rstrip('/').split('/')
+        code, yearMonth = parts[-2], parts[-1]
+        offline = self._offlineFor(self._dairikiStations.get(code))
+        if not offline:
+            return None
+        start = dt.strptime(yearMonth, '%Y-%m')
+        end = dt(start.year + 1, 1, 1) if start.month == 12 else dt(start.year, start.month + 1, 1)
+        return 'text/html', dairikiMonthHtml(offline.between(start, end), code).encode()
+
+    @staticmethod
+    def _fixturePath(path):
+        return data_collect.absName(os.path.join(FIXTURE_DIR, hashlib.sha1(path.encode()).hexdigest()))
+
+    def _recordUpstream(self, route, path, fixture):
+        for host, prefix in UPSTREAM_HOSTS.items():
+            if path.startswith(prefix):
+                url = host + path[len(prefix):]
+                break
+        else:
+            return None
+        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+        with urllib.request.urlopen(req) as response:
+            body = response.read()
+        os.makedirs(os.path.dirname(fixture), exist_ok=True)
+        with open(fixture, 'wb') as f:
+            f.write(body)
+        print('Recorded fixture for {}'.format(url))
+        return ('application/json' if route != 'dairiki' else 'text/html'), body
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    server_ref = None  # StandInServer, set on the generated subclass
+
+    def do_GET(self):
+        start = time.perf_counter()
+        stand_in = self.server_ref
+        route, status, contentType, body = stand_in.respond(self.path)
+        stand_in._delay()
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+        stand_in.stats.record(route, status, time.perf_counter() - start)
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output readable
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the NOAA, Canada and Dairiki current services')
+    parser.add_argument('--port', default=8642, type=int)
+    parser.add_argument('--latency', default=0, type=float, help='Base latency per response in ms')
+    parser.add_argument('--jitter', default=0, type=float, help='Uniform +/- latency jitter in ms')
+    parser.add_argument('--error-rate', default=0.0, type=float, dest='ERROR_RATE',
+                        help='Fraction of requests answered with HTTP 503')
+    parser.add_argument('--rate-limit', default=0, type=float, dest='RATE_LIMIT',
+                        help='Max requests per second before HTTP 429 (0 disables)')
+    parser.add_argument('--burst', default=1, type=int, help='Requests allowed in a burst under the rate limit')
+    parser.add_argument('--fallback-station', default=None, dest='FALLBACK',
+                        help='Station whose xtide-offline data is served for stations without offline data')
+    parser.add_argument('--record', action='store_true', default=False,
+                        help='Proxy requests without offline data to the real service and save them as fixtures')
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    server = StandInServer(data, args.port, args.latency, args.jitter, args.ERROR_RATE, args.RATE_LIMIT, args.burst,
+                           args.FALLBACK, args.record)
+    print('Serving stand-in at {}'.format(server.baseUrl))
+    for host, prefix in UPSTREAM_HOSTS.items():
+        print('\t{} -> {}{}'.format(host, server.baseUrl, prefix))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print('Served {} requests: {}'.format(server.stats.total(), server.stats.requests))
+
+
+if __name__ == '__main__':
+    main()
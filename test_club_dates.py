@@ -0,0 +1,45 @@
+'''
+Checks the packed bitsets of club_dates.DiveCalendar against the same questions asked of a set of diveable days per
+site.
+
+    python3 test_club_dates.py
+'''
+
+import random
+
+from club_dates import DiveCalendar
+
+SITES = ['A', 'B', 'C', 'D', 'E']
+
+
+def testMatchesSets():
+    rng = random.Random(44)
+    for _ in range(200):
+        days = list(range(rng.randint(0, 29)))  # mostly not a multiple of 8, so the last byte is padded
+        names = SITES[:rng.randint(1, len(SITES))]
+        diveableDays = {name: {d for d in days if rng.random() < 0.5} for name in names}
+        calendar = DiveCalendar.fromDiveable(names, days, [[d in diveableDays[n] for d in days] for n in names])
+        for name in names:
+            assert calendar.diveable(name).tolist() == [d in diveableDays[name] for d in days]
+        for _ in range(10):
+            chosen = rng.sample(names, rng.randint(0, len(names)))
+            every = set(days).intersection(*[diveableDays[n] for n in chosen])
+            some = set().union(*[diveableDays[n] for n in chosen])
+            assert calendar.allOf(chosen).tolist() == [d in every for d in days], chosen
+            assert calendar.anyOf(chosen).tolist() == [d in some for d in days], chosen
+            subset = chosen or None
+            counted = [sum(d in diveableDays[n] for n in (chosen or names)) for d in days]
+            assert calendar.counts(subset).tolist() == counted
+            k = rng.randint(0, len(names) + 1)
+            assert calendar.atLeast(k, subset).tolist() == [c >= k for c in counted]
+            for d in days:
+                assert calendar.sitesOn(d, subset) == [n for n in (chosen or names) if d in diveableDays[n]]
+
+
+def main():
+    testMatchesSets()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Checks the dynamic program of dive_itinerary against scoring every increasing sequence of a day's windows.
+
+    python3 test_dive_itinerary.py
+'''
+
+import itertools
+import random
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+from dive_itinerary import bestItinerary
+
+DAY = dt(2026, 6, 1, 6)
+SITES = ['A', 'B', 'C', 'D']
+
+
+class _Window:
+    def __init__(self, magnitude):
+        self._magnitude = magnitude
+
+    def magnitude(self):
+        return self._magnitude
+
+
+def _randomWindows(rng):
+    windows = []
+    for _ in range(rng.randint(0, 9)):
+        entry = DAY + td(minutes=rng.randrange(0, 12 * 60, 5))
+        exit = entry + td(minutes=rng.randint(20, 60))
+        windows.append((rng.choice(SITES), (entry, exit, _Window(rng.randint(0, 4)), None)))
+    windows.sort(key=lambda w: w[1][0])
+    return windows
+
+
+def _score(windows, path, surfaceInterval, transfer, allowRepeat):
+    '''Returns the score of diving the windows at the given indices in order, or None if they can't all be dived.'''
+    names = [windows[j][0] for j in path]
+    if not allowRepeat and len(set(names)) < len(names):
+        return None
+    waiting = 0.0
+    for i, j in zip(path, path[1:]):
+        gap = (windows[j][1][0] - windows[i][1][1]).total_seconds() / 60
+        if gap < max(surfaceInterval, transfer(windows[i][0], windows[j][0])):
+            return None
+        waiting += gap
+    return (len(path), -sum(windows[j][1][2].magnitude() for j in path), -waiting)
+
+
+def testMatchesEnumeration():
+    rng = random.Random(42)
+    for _ in range(500):
+        windows = _randomWindows(rng)
+        minutes = {(a, b): rng.choice([0, 15, 45, 90]) for a in SITES for b in SITES}
+
+        def transfer(name1, name2):
+            return minutes[(name1, name2)]
+
+        surfaceInterval = rng.choice([0, 30, 60])
+        maxDives = rng.randint(1, 4)
+        for allowRepeat in (False, True):
+            scores = [_score(windows, path, surfaceInterval, transfer, allowRepeat)
+                      for size in range(1, maxDives + 1)
+                      for path in itertools.combinations(range(len(windows)), size)]
+            expected = max((s for s in scores if s is not None), default=None)
+            itinerary, score = bestItinerary(windows, surfaceInterval, transfer, maxDives, allowRepeat)
+            assert score == expected, (score, expected, windows)
+            # the itinerary returned is one that reaches the score
+            path = [windows.index(w) for w in itinerary]
+            assert path == sorted(path)
+            assert (_score(windows, path, surfaceInterval, transfer, allowRepeat) if path else None) == expected
+
+
+def main():
+    testMatchesEnumeration()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
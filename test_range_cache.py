@@ -0,0 +1,99 @@
+'''
+Checks RangeCache against a set of covered hours: the merged intervals, gaps, coverage, fetch ranges and the events
+read back, after random overlapping, adjacent and disjoint adds.
+
+    python3 test_range_cache.py
+'''
+
+import random
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+from range_cache import RangeCache
+
+BASE = dt(2026, 1, 1)
+HOURS = 24 * 10
+
+
+class _Event:
+    def __init__(self, hour):
+        self.time = BASE + td(hours=hour)
+
+
+def _at(hour):
+    return BASE + td(hours=hour)
+
+
+def _runs(hours, start, end):
+    '''Returns the [start, end) runs of the hours in [start, end) that are not in the given set.'''
+    runs = []
+    for h in range(start, end):
+        if h in hours:
+            continue
+        if runs and runs[-1][1] == h:
+            runs[-1][1] = h + 1
+        else:
+            runs.append([h, h + 1])
+    return [(_at(s), _at(e)) for s, e in runs]
+
+
+def testGaps():
+    rng = random.Random(31)
+    for _ in range(200):
+        cache = RangeCache()
+        covered = set()
+        events = set()
+        for _ in range(rng.randint(0, 8)):
+            start = rng.randrange(HOURS)
+            end = min(HOURS, start + rng.randint(0, 48))
+            cache.add(_at(start), _at(end), [_Event(h) for h in range(start - 3, end + 3)])
+            covered.update(range(start, end))
+            events.update(range(start, end))
+
+            # intervals stay sorted, disjoint and non-adjacent, and cover exactly the added hours
+            intervals = cache.intervals
+            assert all(e1 < s2 for (_, e1), (s2, _) in zip(intervals, intervals[1:])), intervals
+            assert _runs(set(range(HOURS)) - covered, 0, HOURS) == intervals
+        for _ in range(20):
+            start = rng.randrange(HOURS)
+            end = rng.randint(start, HOURS)
+            assert cache.gaps(_at(start), _at(end)) == _runs(covered, start, end), (start, end)
+            assert cache.covers(_at(start), _at(end)) == covered.issuperset(range(start, end))
+            assert [e.time for e in cache.between(_at(start), _at(end))] == \
+                [_at(h) for h in sorted(events) if start <= h < end]
+        assert len(cache) == len(events)
+
+
+def testFetchRange():
+    rng = random.Random(131)
+    for _ in range(200):
+        lookahead = rng.randint(0, 3)
+        cache = RangeCache(lookahead_days=lookahead)
+        covered = set()
+        for _ in range(rng.randint(0, 4)):
+            start = 24 * rng.randrange(10)
+            end = start + 24 * rng.randint(1, 3)
+            cache.add(_at(start), _at(end), [])
+            covered.update(range(start, end))
+        day = rng.randrange(10)
+        days = rng.randint(1, 3)
+        missing = _runs(covered, 24 * day, 24 * (day + days))
+        fetch = cache.fetch_range(_at(24 * day), days)
+        if not missing:
+            assert fetch is None
+            continue
+        # from the first uncovered hour through the look-ahead, stopping at the first covered hour after the last gap
+        lastGapEnd = (missing[-1][1] - BASE) // td(hours=1)
+        end = max(lastGapEnd, 24 * (day + days + lookahead))
+        nextCovered = min([h for h in covered if h >= lastGapEnd], default=end)
+        assert fetch == (missing[0][0], _at(min(end, nextCovered))), (fetch, missing)
+
+
+def main():
+    testGaps()
+    testFetchRange()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+'''
+Checks the streaming rankers of rank_year_slacks against sorting every item, and the Pareto front against pairwise
+dominance.
+
+    python3 test_rank_year_slacks.py
+'''
+
+import random
+
+import numpy as np
+
+import pareto
+from rank_year_slacks import ParetoFront, TopK
+
+
+def testTopKMatchesSort():
+    rng = random.Random(37)
+    for _ in range(300):
+        items = [(rng.randint(0, 20), i) for i in range(rng.randint(0, 60))]  # (key with ties, push order)
+        for k in (None, 0, 1, 3, len(items), len(items) + 5):
+            for largest in (False, True):
+                top = TopK(k, key=lambda item: item[0], largest=largest)
+                for item in items:
+                    top.push(item)
+                expected = sorted(items, key=lambda item: item[0], reverse=largest)
+                expected = expected if k is None else expected[:k]
+                assert top.sorted() == expected, (k, largest, items)
+                assert len(top) == len(expected)
+
+
+def _dominated(costs):
+    '''Returns which rows of costs some other row is no worse than in every cost and better than in one.'''
+    return [any(all(o <= c) and any(o < c) for o in costs) for c in costs]
+
+
+def _randomCosts(rng, n):
+    # few distinct values so that ties and copies are common, the last column is a 0/1 level like workday
+    rows = [[rng.randint(0, 6), rng.randint(0, 6), rng.randint(0, 1)] for _ in range(n)]
+    return np.array(rows, dtype=float).reshape(-1, 3)
+
+
+def testSkylineMatchesPairwise():
+    rng = random.Random(39)
+    for _ in range(300):
+        costs = _randomCosts(rng, rng.randint(0, 40))
+        expected = [not d for d in _dominated(costs)]
+        assert pareto.skyline(costs[:, :2], costs[:, 2]).tolist() == expected, costs
+        assert pareto.skyline(costs[:, :2]).tolist() == [not d for d in _dominated(costs[:, :2])], costs
+
+
+def testParetoFrontMatchesPairwise():
+    rng = random.Random(139)
+    for _ in range(300):
+        costs = _randomCosts(rng, rng.randint(0, 40))
+        front = ParetoFront()
+        chunk = rng.randint(1, 10)
+        for lo in range(0, len(costs), chunk):
+            front.push(range(lo, min(lo + chunk, len(costs))), costs[lo:lo + chunk])
+        kept = [i for i, d in enumerate(_dominated(costs)) if not d]
+        assert sorted(front.sorted()) == kept, costs
+        assert len(front) == len(kept)
+        ordered = [tuple(costs[i, :2]) for i in front.sorted()]
+        assert ordered == sorted(ordered)
+
+
+def main():
+    testTopKMatchesSort()
+    testSkylineMatchesPairwise()
+    testParetoFrontMatchesPairwise()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
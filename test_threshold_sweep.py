@@ -0,0 +1,97 @@
+'''
+Checks threshold_sweep.sweep against evaluating every grid point one slack at a time with Slack.isDiveable and
+_getEntryTimes on a copy of the site with the point's values.
+
+    python3 test_threshold_sweep.py
+'''
+
+import itertools
+import math
+import random
+from datetime import datetime as dt
+from datetime import timedelta as td
+
+import numpy as np
+
+from interpreter import Slack, _getEntryTimes
+from threshold_sweep import OFFSET_KEYS, PERCENTILES, SPEED_KEYS, slackArrays, sweep
+
+START = dt(2026, 3, 1)
+
+
+def _randomSlacks(rng):
+    slacks = []
+    for day in range(rng.randint(0, 6)):
+        sunrise = START + td(days=day, minutes=rng.randint(5 * 60, 8 * 60))
+        for _ in range(rng.randint(0, 4)):
+            s = Slack()
+            s.time = START + td(days=day, minutes=rng.randrange(24 * 60))
+            s.sunriseTime = sunrise if rng.random() < 0.9 else None
+            s.slackBeforeEbb = rng.random() < 0.5
+            s.floodSpeed = rng.randint(0, 40) / 10
+            s.ebbSpeed = -rng.randint(0, 40) / 10
+            slacks.append(s)
+    return slacks
+
+
+def _randomSite(rng):
+    return {
+        'diveable_before_ebb': rng.random() < 0.8,
+        'diveable_before_flood': rng.random() < 0.8,
+        'diveable_off_slack': rng.random() < 0.3,
+        'max_diveable_flood': rng.randint(0, 10) / 10,
+        'max_diveable_ebb': rng.randint(0, 10) / 10,
+        'dive_duration': rng.choice([45, 60, 75, 90]),
+        'surface_swim_time': rng.choice([0, 5, 10]),
+    }
+
+
+def _expected(slacks, site, point):
+    '''Returns the days, slacks, percentiles and fraction before sunrise for one grid point.'''
+    site = dict(site, **point)
+    diveable = [s for s in slacks if s.isDiveable(site, False)[0]]
+    speeds = [s.floodSpeed + abs(s.ebbSpeed) for s in diveable]
+    early = [s for s in diveable if s.sunriseTime and _getEntryTimes(s, site)[2] < s.sunriseTime]
+    result = {
+        'days': len({s.time.toordinal() for s in diveable}),
+        'slacks': len(diveable),
+        'beforeSunrise': len(early) / len(diveable) if diveable else math.nan,
+    }
+    for q in PERCENTILES:
+        result['p{}'.format(q)] = np.percentile(speeds, q, method='lower') if speeds else math.nan
+    return result
+
+
+def _same(a, b):
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+def testMatchesIsDiveable():
+    rng = random.Random(46)
+    for _ in range(100):
+        slacks = _randomSlacks(rng)
+        site = _randomSite(rng)
+        grid = {
+            'max_flood': [rng.randint(0, 40) / 10 for _ in range(rng.randint(1, 3))],
+            'max_ebb': [rng.choice([1, -1]) * rng.randint(0, 40) / 10 for _ in range(rng.randint(1, 3))],
+            'max_total_speed': [rng.randint(0, 80) / 10 for _ in range(rng.randint(1, 3))],
+            'slack_before_ebb': [rng.randint(-90, 30) for _ in range(rng.randint(1, 3))],
+            'slack_before_flood': [rng.randint(-90, 30) for _ in range(rng.randint(1, 3))],
+        }
+        result = sweep(slackArrays(slacks), site, grid, chunkSize=rng.randint(1, 8))
+        keys = SPEED_KEYS + OFFSET_KEYS
+        for p, values in enumerate(itertools.product(*[grid[k] for k in keys])):
+            point = dict(zip(keys, values))
+            for key, value in point.items():
+                assert result[key][p] == value, (key, p)
+            for key, value in _expected(slacks, site, point).items():
+                assert _same(result[key][p], value), (key, result[key][p], value, point)
+
+
+def main():
+    testMatchesIsDiveable()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
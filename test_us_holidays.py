@@ -0,0 +1,41 @@
+'''
+Checks us_holidays against pandas' USFederalHolidayCalendar, which dive_plan.py used before it.
+
+    python3 test_us_holidays.py
+'''
+
+from datetime import datetime
+
+import us_holidays
+
+
+def testMatchesPandas():
+    try:
+        from pandas.tseries.holiday import USFederalHolidayCalendar
+    except ImportError:
+        print('pandas is not installed, skipping the comparison with USFederalHolidayCalendar')
+        return
+    start, end = datetime(1971, 1, 1), datetime(2100, 12, 31)
+    expected = [d.to_pydatetime() for d in USFederalHolidayCalendar().holidays(start, end)]
+    assert us_holidays.holidays(start, end) == expected
+
+
+def testIsHoliday():
+    start, end = datetime(2020, 1, 1), datetime(2030, 12, 31)
+    observed = set(us_holidays.holidays(start, end))
+    day = start
+    while day <= end:
+        assert us_holidays.isHoliday(day) == (day in observed), day
+        day = datetime.fromordinal(day.toordinal() + 1)
+    # New Year's Day 2022 was a Saturday, observed on Friday 2021-12-31
+    assert us_holidays.isHoliday(datetime(2021, 12, 31))
+
+
+def main():
+    testMatchesPandas()
+    testIsHoliday()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+'''
+What-if sweep of a current site's thresholds and offsets in dive_sites.json, for calibrating a site (see the COMMENT
+fields on Day Island Wall) without trial and error.
+
+A grid of max_flood, max_ebb, max_total_speed, slack_before_ebb and slack_before_flood values is evaluated against
+the site's slacks over a year or decades, read through the prediction cache. For every grid point it reports the
+diveable days, the diveable slacks, the spread of their speed sums (10th, 50th and 90th percentile) and how often the
+entry falls before sunrise. Other keys (diveable_before_ebb, diveable_off_slack, dive_duration, ...) stay as
+configured for the site.
+
+The speed thresholds decide which slacks are diveable and the offsets only move the entry time, so the two are
+swept separately and combined:
+    - the diveable mask of every speed combination is one broadcast comparison over all slacks
+    - percentiles come from cumulative counts over the slacks sorted once by speed sum, not a sort per grid point
+    - entries before sunrise for every offset are one matrix product of the diveable masks with the offset
+      thresholds, for the slacks before ebb and before flood separately
+A thousand point grid over a year of slacks is evaluated in well under a second.
+
+Grid values are a single value, a comma-delimited list, or start:stop:step (inclusive), and default to the site's
+current value. Negative values need an = (--slack-before-ebb=-70:-30:10).
+
+Examples:
+    python3 threshold_sweep.py --site "Day Island Wall" --slack-before-ebb=-70:-30:10 --slack-before-flood=-40:0:10
+    python3 threshold_sweep.py --site "Deception Pass" -f 3650 --max-flood 1:4:0.25 --max-ebb 1:4:0.25 \\
+        --max-total-speed 3,4,5,6 --sort speed --output sweep.csv
+'''
+
+import argparse
+import csv
+import itertools
+import json
+import time
+from datetime import datetime as dt
+
+import numpy as np
+
+import data_collect
+import dive_plan
+import interpreter as intp
+import prediction_cache
+from must_do_dives import getSite
+from dive_plan import pickInterpreter
+
+SPEED_KEYS = ['max_flood', 'max_ebb', 'max_total_speed']
+OFFSET_KEYS = ['slack_before_ebb', 'slack_before_flood']
+PERCENTILES = [10, 50, 90]
+
+
+def parseValues(text, default):
+    '''Returns the array of values in "2.5", "1,2,3" or "1:3:0.5" (inclusive), or [default] if text is empty.'''
+    if not text:
+        return np.array([default], dtype=float)
+    if ':' in text:
+        start, stop, step = [float(v) for v in text.split(':')]
+        return np.arange(start, stop + step / 2, step)
+    return np.array([float(v) for v in text.split(',')])
+
+
+def _minutes(t):
+    return t.timestamp() / 60 if t else np.nan
+
+
+def slackArrays(slacks):
+    '''Returns a dict of arrays with the fields of the slacks needed by sweep(), sorted by time.'''
+    slacks = sorted(slacks, key=lambda s: s.time)
+    return {
+        'flood': np.array([s.floodSpeed for s in slacks], dtype=float),
+        'ebb': np.array([abs(s.ebbSpeed) for s in slacks], dtype=float),
+        'beforeEbb': np.array([bool(s.slackBeforeEbb) for s in slacks], dtype=bool),
+        'time': np.array([_minutes(s.time) for s in slacks], dtype=float),
+        'sunrise': np.array([_minutes(s.sunriseTime) for s in slacks], dtype=float),
+        'day': np.array([s.time.toordinal() for s in slacks], dtype=int),
+    }
+
+
+def sweep(arrays, site, grid, chunkSize=64):
+    '''
+    Evaluates every combination of the grid values {key: array} of SPEED_KEYS and OFFSET_KEYS for the slacks.
+    Returns a dict of (points,) arrays: the value of each key, 'days', 'slacks', 'p10', 'p50', 'p90' of the speed
+    sum of the diveable slacks (nan if none) and 'beforeSunrise', the fraction of them entered before sunrise.
+    Points are ordered like itertools.product over SPEED_KEYS then OFFSET_KEYS.
+    '''
+    flood, ebb, beforeEbb = arrays['flood'], arrays['ebb'], arrays['beforeEbb']
+    speedSum = flood + ebb
+    n = len(flood)
+
+    # diveability that doesn't depend on the grid
+    sideOk = np.where(beforeEbb, site['diveable_before_ebb'], site['diveable_before_flood'])
+    offSlack = np.zeros(n, dtype=bool)
+    if site.get('diveable_off_slack'):
+        offSlack = (flood < site['max_diveable_flood']) | (ebb < site['max_diveable_ebb'])
+
+    speeds = np.array(list(itertools.product(*[grid[k] for k in SPEED_KEYS])), dtype=float).reshape(-1, 3)
+    offsetsEbb, offsetsFlood = np.asarray(grid['slack_before_ebb']), np.asarray(grid['slack_before_flood'])
+
+    # entry = slack + offset - dive_duration / 2 - surface_swim_time, so it's before sunrise when the offset is
+    # below this margin
+    margin = arrays['sunrise'] - arrays['time'] + site['dive_duration'] / 2 + site['surface_swim_time']
+    margin = np.where(np.isnan(margin), -np.inf, margin)
+    earlyEbb = ((margin[:, None] > offsetsEbb[None, :]) & beforeEbb[:, None]).astype(float)  # (n, ebb offsets)
+    earlyFlood = ((margin[:, None] > offsetsFlood[None, :]) & ~beforeEbb[:, None]).astype(float)
+
+    dayStarts = np.flatnonzero(np.r_[True, arrays['day'][1:] != arrays['day'][:-1]]) if n else np.zeros(0, int)
+    bySpeed = np.argsort(speedSum, kind='stable')
+    sortedSpeed = speedSum[bySpeed]
+
+    s = len(speeds)
+    days = np.zeros(s, dtype=int)
+    count = np.zeros(s, dtype=int)
+    percentiles = np.full((s, len(PERCENTILES)), np.nan)
+    ebbEarly = np.zeros((s, len(offsetsEbb)))
+    floodEarly = np.zeros((s, len(offsetsFlood)))
+    for lo in range(0, s, chunkSize):
+        chunk = speeds[lo:lo + chunkSize]
+        speedOk = ((flood[None, :] <= chunk[:, 0:1]) & (ebb[None, :] <= np.abs(chunk[:, 1:2])) &
+                   (speedSum[None, :] <= chunk[:, 2:3]))
+        diveable = sideOk[None, :] & (offSlack[None, :] | speedOk)
+        k = diveable.sum(axis=1)
+        count[lo:lo + chunkSize] = k
+        if not n:
+            continue
+        days[lo:lo + chunkSize] = np.logical_or.reduceat(diveable, dayStarts, axis=1).sum(axis=1)
+        # the i-th smallest diveable speed sum is where the running count over the speed order reaches i + 1
+        ranks = np.cumsum(diveable[:, bySpeed], axis=1, dtype=np.int32)
+        for j, q in enumerate(PERCENTILES):
+            target = np.floor(q / 100 * (k - 1)).astype(int) + 1
+            at = np.argmax(ranks >= target[:, None], axis=1)
+            percentiles[lo:lo + chunkSize, j] = np.where(k > 0, sortedSpeed[at], np.nan)
+        diveableFloat = diveable.astype(float)
+        ebbEarly[lo:lo + chunkSize] = diveableFloat @ earlyEbb
+        floodEarly[lo:lo + chunkSize] = diveableFloat @ earlyFlood
+
+    # combine every speed combination with every pair of offsets
+    shape = (s, len(offsetsEbb), len(offsetsFlood))
+    early = ebbEarly[:, :, None] + floodEarly[:, None, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beforeSunrise = np.where(count[:, None, None] > 0, early / count[:, None, None], np.nan)
+    result = {key: np.broadcast_to(speeds[:, i, None, None], shape).ravel() for i, key in enumerate(SPEED_KEYS)}
+    result['slack_before_ebb'] = np.broadcast_to(offsetsEbb[None, :, None], shape).ravel()
+    result['slack_before_flood'] = np.broadcast_to(offsetsFlood[None, None, :], shape).ravel()
+    result['days'] = np.broadcast_to(days[:, None, None], shape).ravel()
+    result['slacks'] = np.broadcast_to(count[:, None, None], shape).ravel()
+    for j, q in enumerate(PERCENTILES):
+        result['p{}'.format(q)] = np.broadcast_to(percentiles[:, j, None, None], shape).ravel()
+    result['beforeSunrise'] = beforeSunrise.ravel()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep the thresholds and offsets of a current site')
+    parser.add_argument('--site', required=True, type=str, help='Site name from dive_sites.json')
+    for key in SPEED_KEYS + OFFSET_KEYS:
+        parser.add_argument('--' + key.replace('_', '-'), default='', type=str, dest=key,
+                            help='Values of {}: "v", "v1,v2,..." or "start:stop:step", the site\'s by default'.format(key))
+    parser.add_argument('-d', '--start-date', dest='START', default=None, type=lambda d: dt.strptime(d, '%Y-%m-%d'),
+                        help='First day in the format yyyy-mm-dd, today by default')
+    parser.add_argument('-f', '--futuredays', dest='DAYS_IN_FUTURE', default=365, type=int,
+                        help='Number of days after the start date to evaluate')
+    parser.add_argument('--sort', choices=['days', 'speed', 'sunrise'], default='days',
+                        help='Print the most diveable days, the lowest median speed sum or the fewest entries '
+                             'before sunrise first')
+    parser.add_argument('--top', default=20, type=int, help='Number of grid points to print')
+    parser.add_argument('--output', default=None, type=str, help='Write every grid point to this CSV file')
+    dive_plan.add_arguments(parser, calendar=False)
+    args = parser.parse_args()
+
+    data = json.loads(open(data_collect.absName('dive_sites.json')).read())
+    names = dive_plan.parse_sites(args.site, data['sites'])
+    if len(names) != 1:
+        print('Give one site name with --site, not "{}"'.format(args.site))
+        exit(1)
+    site = getSite(data['sites'], names[0])
+    if 'data_tides' in site:
+        print('{} is a tide site, only current sites have these thresholds'.format(site['name']))
+        exit(1)
+
+    cache = None if args.NO_CACHE else prediction_cache.PredictionCache()
+    _, choices = dive_plan.getInterpreters(site, data, cache, args.OFFLINE)
+    m, label = pickInterpreter(choices, args.sources)
+    if not m:
+        print('No source for {}'.format(site['name']))
+        exit(1)
+    days = dive_plan.getDiveDays(args.DAYS_IN_FUTURE, args.START or dt.now(), args.INCLUDE_WORKDAYS,
+                                 args.INCLUDE_FRIDAYS)
+    slacks = [s for day in days for s in m.getSlacks(day, args.TIME_FILTER) if isinstance(s, intp.Slack)]
+    if cache:
+        cache.flush()
+    arrays = slackArrays(slacks)
+    print('{}: {} slacks on {} days ({})'.format(site['name'], len(slacks), len(days), label))
+
+    grid = {key: parseValues(getattr(args, key), site[key]) for key in SPEED_KEYS + OFFSET_KEYS}
+    start = time.perf_counter()
+    result = sweep(arrays, site, grid)
+    points = len(result['days'])
+    print('Evaluated {} grid points in {:0.2f}s'.format(points, time.perf_counter() - start))
+
+    current = sweep(arrays, site, {key: [site[key]] for key in SPEED_KEYS + OFFSET_KEYS})
+    if args.sort == 'days':
+        order = np.lexsort((np.nan_to_num(result['p50'], nan=np.inf), -result['days']))
+    elif args.sort == 'speed':
+        order = np.lexsort((-result['days'], np.nan_to_num(result['p50'], nan=np.inf)))
+    else:
+        order = np.lexsort((-result['days'], np.nan_to_num(result['beforeSunrise'], nan=np.inf)))
+
+    def printRow(title, r, i):
+        print('{:<8} {:>9.2f} {:>7.2f} {:>9.2f} {:>10.0f} {:>12.0f} {:>5} {:>6} {:>5.1f} {:>5.1f} {:>5.1f} '
+              '{:>7.1f}%'.format(title, r['max_flood'][i], r['max_ebb'][i], r['max_total_speed'][i],
+                                 r['slack_before_ebb'][i], r['slack_before_flood'][i], r['days'][i], r['slacks'][i],
+                                 r['p10'][i], r['p50'][i], r['p90'][i], r['beforeSunrise'][i] * 100))
+
+    print('{:<8} {:>9} {:>7} {:>9} {:>10} {:>12} {:>5} {:>6} {:>5} {:>5} {:>5} {:>8}'.format(
+        '', 'max_flood', 'max_ebb', 'max_total', 'before_ebb', 'before_flood', 'days', 'slacks', 'p10', 'p50',
+        'p90', 'early'))
+    printRow('current', current, 0)
+    for rank, i in enumerate(order[:args.top]):
+        printRow('#{}'.format(rank + 1), result, i)
+
+    if args.output:
+        keys = SPEED_KEYS + OFFSET_KEYS + ['days', 'slacks'] + ['p{}'.format(q) for q in PERCENTILES] + \
+               ['beforeSunrise']
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(keys)
+            for i in order:
+                writer.writerow([result[k][i] for k in keys])
+        print('Wrote {} grid points to {}'.format(points, args.output))
+
+
+if __name__ == '__main__':
+    main()
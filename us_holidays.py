@@ -0,0 +1,77 @@
+'''
+US federal holiday calendar computed from the OPM rules, without pandas.
+
+Gives the same observed dates as pandas' USFederalHolidayCalendar (which dive_plan.py used to import only for
+this). Saturday holidays are observed on the Friday before and Sunday holidays on the Monday after. Results are
+cached per calendar year.
+https://www.opm.gov/policy-data-oversight/pay-leave/federal-holidays/
+'''
+
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+MONDAY, THURSDAY = 0, 3
+
+
+def _nearestWorkday(d: date) -> date:
+    if d.weekday() == 5:
+        return d - timedelta(days=1)
+    if d.weekday() == 6:
+        return d + timedelta(days=1)
+    return d
+
+
+def _nthWeekday(year: int, month: int, weekday: int, n: int) -> date:
+    '''Returns the nth (1 based) given weekday of the month, or the last one if n is -1.'''
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+# (name, first observed date the rule applies from, rule returning the observed date in the given year)
+RULES = [
+    ("New Year's Day", None, lambda y: _nearestWorkday(date(y, 1, 1))),
+    ('Birthday of Martin Luther King, Jr.', date(1986, 1, 1), lambda y: _nthWeekday(y, 1, MONDAY, 3)),
+    ("Washington's Birthday", None, lambda y: _nthWeekday(y, 2, MONDAY, 3)),
+    ('Memorial Day', None, lambda y: _nthWeekday(y, 5, MONDAY, -1)),
+    ('Juneteenth National Independence Day', date(2021, 6, 18), lambda y: _nearestWorkday(date(y, 6, 19))),
+    ('Independence Day', None, lambda y: _nearestWorkday(date(y, 7, 4))),
+    ('Labor Day', None, lambda y: _nthWeekday(y, 9, MONDAY, 1)),
+    ('Columbus Day', None, lambda y: _nthWeekday(y, 10, MONDAY, 2)),
+    ('Veterans Day', None, lambda y: _nearestWorkday(date(y, 11, 11))),
+    ('Thanksgiving Day', None, lambda y: _nthWeekday(y, 11, THURSDAY, 4)),
+    ('Christmas Day', None, lambda y: _nearestWorkday(date(y, 12, 25))),
+]
+
+
+@lru_cache(maxsize=None)
+def holidaysInYear(year: int) -> dict[date, str]:
+    '''Returns {observed date: holiday name} for the observed holidays that fall in the calendar year.
+    New Year's Day of the following year can be observed on December 31st.'''
+    holidays = {}
+    for y in (year, year + 1):
+        for name, startDate, rule in RULES:
+            d = rule(y)
+            if d.year == year and (startDate is None or d >= startDate):
+                holidays[d] = name
+    return dict(sorted(holidays.items()))
+
+
+def isHoliday(day) -> bool:
+    '''Returns true if the given date or datetime is an observed federal holiday.'''
+    d = date(day.year, day.month, day.day)
+    return d in holidaysInYear(d.year)
+
+
+def holidays(start, end) -> list[datetime]:
+    '''Returns the observed holidays between start and end (inclusive) as midnight datetimes.'''
+    startDate = date(start.year, start.month, start.day)
+    endDate = date(end.year, end.month, end.day)
+    result = []
+    for year in range(startDate.year, endDate.year + 1):
+        for d in holidaysInYear(year):
+            if startDate <= d <= endDate:
+                result.append(datetime(d.year, d.month, d.day))
+    return result